@@ -1,14 +1,41 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 import uvicorn
 
 from routes import router
+from services.registry import registry
+from services.message_buffer import debounce_scheduler
+from services.metrics import setup_tracing
+from services.log import setup_logging
+from exceptions.exceptions import ConfigurationException
 from config.config import Config
 
 
 Config.setup_environment()
 Config.validate()
+setup_logging()
+setup_tracing()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # In worker mode this process only ingests, `python -m worker` generates the replies
+    if Config.WORKER_MODE:
+        yield
+        return
+
+    # Buffered messages would only pile up unanswered, so a registry that can't start stops the API
+    if not await registry.startup():
+        raise ConfigurationException(f"Services failed to start: {registry.status()['error']}")
+
+    debounce_scheduler.start()
+    yield
+    await debounce_scheduler.stop()
+    await registry.shutdown()
+
 
-app = FastAPI(title="WhatsApp AI Chatbot", version="1.0.0")
+app = FastAPI(title="WhatsApp AI Chatbot", version="1.0.0", lifespan=lifespan)
 
 app.include_router(router)
 
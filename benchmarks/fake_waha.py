@@ -0,0 +1,42 @@
+import time
+import asyncio
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeWahaServer:
+
+    def __init__(self, latency=0.0):
+        self.__latency = latency
+        self.__runner = None
+        self.sent = []
+        self.typing = Counter()
+
+    async def __send_text(self, request):
+        data = await request.json()
+        if self.__latency:
+            await asyncio.sleep(self.__latency)
+        self.sent.append((time.perf_counter(), data['chatId'], data['text']))
+        return web.json_response({'id': f'fake_{len(self.sent)}'})
+
+    async def __typing(self, request):
+        data = await request.json()
+        self.typing[request.path.rsplit('/', 1)[-1]] += 1
+        return web.json_response({'chatId': data.get('chatId')})
+
+    async def start(self, host='127.0.0.1', port=3999):
+        app = web.Application()
+        app.router.add_post('/api/sendText', self.__send_text)
+        app.router.add_post('/api/startTyping', self.__typing)
+        app.router.add_post('/api/stopTyping', self.__typing)
+
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, host, port).start()
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
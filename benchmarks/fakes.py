@@ -0,0 +1,76 @@
+import time
+import asyncio
+
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from bot.bm25 import build_bm25_index
+
+
+CORPUS = [
+    "A TechCorp atende de segunda a sexta, das 8h às 18h, e aos sábados das 9h às 13h.",
+    "O prazo de entrega padrão é de 5 a 7 dias úteis para todo o Brasil.",
+    "Trocas e devoluções podem ser solicitadas em até 30 dias após o recebimento.",
+    "O suporte técnico está disponível pelo e-mail suporte@techcorp.com e pelo telefone (11) 4000-1234.",
+    "O plano Básico custa R$ 49,90 por mês e inclui até 5 usuários.",
+    "O plano Empresarial custa R$ 199,90 por mês, com usuários ilimitados e suporte prioritário.",
+    "Pagamentos são aceitos via Pix, boleto bancário e cartão de crédito em até 12 vezes.",
+    "O produto TC-4410 é um roteador com Wi-Fi 6 e garantia de 24 meses.",
+]
+
+
+def last_human_message(messages):
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content
+    return messages[-1].content if messages else ''
+
+
+class FakeChatModel(BaseChatModel):
+    # Echoes the question so the harness can match every reply to the messages it answers
+    latency: float = 0.5
+    chunks: int = 8
+
+    @property
+    def _llm_type(self):
+        return 'fake-latency-chat'
+
+    def __answer(self, messages):
+        return f"Resposta automática.\n\nVocê perguntou: {last_human_message(messages)}"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.__answer(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.__answer(messages)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        answer = self.__answer(messages)
+        size = max(1, len(answer) // self.chunks + 1)
+        for start in range(0, len(answer), size):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=answer[start:start + size]))
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    latency: float = 0.05
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return self.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency)
+        return self.embed_documents(texts)
+
+
+def build_fake_corpus(persist_directory, embedding):
+    ids = [f'benchmark-{index}' for index in range(len(CORPUS))]
+    vector_store = Chroma(persist_directory=persist_directory, embedding_function=embedding)
+    vector_store.add_texts(CORPUS, metadatas=[{'source': 'benchmark'} for _ in CORPUS], ids=ids)
+    build_bm25_index(zip(ids, CORPUS), index_version='benchmark', persist_directory=persist_directory)
@@ -0,0 +1,235 @@
+import os
+import re
+import json
+import time
+import shutil
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+# Must be set before config is imported: the app validates the key and logs at import time
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+from config.config import Config  # noqa: E402
+from exceptions.exceptions import ConfigurationException  # noqa: E402
+
+
+MESSAGE_TAG_PATTERN = re.compile(r'\[(c\d+-m\d+)\]')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline load and latency benchmark for the chatbot webhook')
+    parser.add_argument('--chats', type=int, default=50, help='number of simulated chats')
+    parser.add_argument('--messages', type=int, default=3, help='messages sent by each chat')
+    parser.add_argument('--gap', type=float, default=0.2, help='seconds between messages of one chat')
+    parser.add_argument('--ramp', type=float, default=2.0, help='seconds over which chats start')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='share of webhooks delivered twice')
+    parser.add_argument('--debounce', type=float, default=1.0, help='DEBOUNCE_SECONDS for the run')
+    parser.add_argument(
+        '--min-debounce', type=float, default=None,
+        help='DEBOUNCE_MIN_SECONDS for the run, defaults to the configured value capped at --debounce',
+    )
+    parser.add_argument('--fixed-debounce', action='store_true', help='disable DEBOUNCE_ADAPTIVE for the run')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='fake chat model latency in seconds')
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help='fake embedding latency in seconds')
+    parser.add_argument('--waha-latency', type=float, default=0.0, help='fake WAHA sendText latency in seconds')
+    parser.add_argument('--streaming', action='store_true', help='enable STREAMING_ENABLED for the run')
+    parser.add_argument('--worker-mode', action='store_true', help='ingest through the Redis stream, with an in-process worker')
+    parser.add_argument('--redis-url', default=None, help='use a real Redis instead of fakeredis (it gets flushed)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds to wait for the last reply')
+    parser.add_argument('--api-port', type=int, default=5999)
+    parser.add_argument('--waha-port', type=int, default=3999)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args()
+
+
+def use_redis(redis_url):
+    if redis_url:
+        Config.REDIS_URL = redis_url
+        return False
+
+    try:
+        import fakeredis
+    except ImportError as e:
+        raise ConfigurationException("Benchmarks without --redis-url need fakeredis[lua], see requirements_dev.txt") from e
+
+    # Swapped in before the services import the clients, so every module shares the fake server
+    import services.redis_client as redis_module
+    server = fakeredis.FakeServer()
+    redis_module.redis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    redis_module.sync_redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    return True
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def drive_chat(client, chat_index, args, sent_at, http_times):
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    chat_id = f'5511{chat_index:08d}@c.us'
+
+    for message_index in range(args.messages):
+        tag = f'c{chat_index}-m{message_index}'
+        body = {
+            'event': 'message',
+            'payload': {
+                'id': f'false_{chat_id}_{tag}',
+                'from': chat_id,
+                'fromMe': False,
+                'body': f'Qual o horário de atendimento? [{tag}]',
+            },
+        }
+
+        # A redelivery reuses the WAHA message id, it must not produce a second reply
+        deliveries = 2 if random.random() < args.duplicate_rate else 1
+        for _ in range(deliveries):
+            started = time.perf_counter()
+            response = await client.post('/chatbot/webhook/', json=body)
+            http_times.append(time.perf_counter() - started)
+            sent_at.setdefault(tag, started)
+            response.raise_for_status()
+
+        if message_index < args.messages - 1:
+            await asyncio.sleep(args.gap)
+
+
+def build_report(args, sent_at, http_times, replies, started, finished_at):
+    answered = defaultdict(list)
+    for replied_at, _, text in replies:
+        for tag in set(MESSAGE_TAG_PATTERN.findall(text)):
+            answered[tag].append(replied_at)
+
+    latencies = [min(answered[tag]) - sent_at[tag] for tag in sent_at if tag in answered]
+    lost = [tag for tag in sent_at if tag not in answered]
+    duplicated = [tag for tag, times in answered.items() if len(times) > 1]
+    elapsed = (finished_at or time.perf_counter()) - started
+
+    def rounded(value):
+        return round(value, 4) if value is not None else None
+
+    return {
+        'chats': args.chats,
+        'messages': len(sent_at),
+        'webhook_requests': len(http_times),
+        'replies_sent': len(replies),
+        'elapsed_seconds': rounded(elapsed),
+        'webhooks_per_second': rounded(len(http_times) / elapsed if elapsed else 0.0),
+        'replies_per_second': rounded(len(replies) / elapsed if elapsed else 0.0),
+        'webhook_p50_seconds': rounded(percentile(http_times, 0.50)),
+        'webhook_p99_seconds': rounded(percentile(http_times, 0.99)),
+        'reply_p50_seconds': rounded(percentile(latencies, 0.50)),
+        'reply_p95_seconds': rounded(percentile(latencies, 0.95)),
+        'reply_p99_seconds': rounded(percentile(latencies, 0.99)),
+        'lost_messages': len(lost),
+        'duplicated_replies': len(duplicated),
+        'debounce_seconds': args.debounce,
+        'debounce_min_seconds': Config.DEBOUNCE_MIN_SECONDS,
+        'debounce_adaptive': not args.fixed_debounce,
+        'worker_mode': args.worker_mode,
+    }
+
+
+async def run(args):
+    fake_redis = use_redis(args.redis_url)
+
+    # Imported only now so they pick up the patched Redis clients
+    from app import app
+    from bot.ai_bot import AIBot
+    from services.registry import registry
+    from services.message_buffer import debounce_scheduler, stream_consumer
+    from services.redis_client import redis_client
+    from benchmarks.fakes import FakeChatModel, FakeEmbeddings, build_fake_corpus
+    from benchmarks.fake_waha import FakeWahaServer
+
+    if not fake_redis:
+        await redis_client.flushdb()
+
+    persist_directory = tempfile.mkdtemp(prefix='chatbot-benchmark-')
+    Config.CHROMA_PERSIST_DIR = persist_directory
+    Config.DEBOUNCE_SECONDS = args.debounce
+    Config.DEBOUNCE_MIN_SECONDS = min(Config.DEBOUNCE_MIN_SECONDS, args.debounce) if args.min_debounce is None else args.min_debounce
+    Config.DEBOUNCE_ADAPTIVE = not args.fixed_debounce
+    Config.STREAMING_ENABLED = args.streaming
+    Config.WORKER_MODE = args.worker_mode
+    # The app validated its settings at import, the overrides must pass the same checks
+    Config.validate()
+
+    llm = FakeChatModel(latency=args.llm_latency)
+    embedding = FakeEmbeddings(size=256, latency=args.embedding_latency)
+    build_fake_corpus(persist_directory, embedding)
+
+    waha = FakeWahaServer(latency=args.waha_latency)
+    Config.WAHA_API_URL = await waha.start(port=args.waha_port)
+
+    # Started here with the fakes, the lifespan's own startup call then finds the registry ready
+    await registry.startup(bot_factory=lambda **tenant: AIBot(llm=llm, embedding=embedding, **tenant))
+    if not registry.is_ready:
+        raise ConfigurationException(f"Benchmark services failed to start: {registry.status()['error']}")
+
+    # The lifespan skips the reply side in worker mode, run it here as `python -m worker` would
+    if args.worker_mode:
+        await stream_consumer.start()
+        debounce_scheduler.start()
+
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=args.api_port, log_level='warning'))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    sent_at = {}
+    http_times = []
+    limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{args.api_port}', limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(drive_chat(client, index, args, sent_at, http_times) for index in range(args.chats)))
+
+        expected = args.chats * args.messages
+        deadline = time.perf_counter() + args.timeout
+        finished_at = None
+        while time.perf_counter() < deadline:
+            replied = {tag for _, _, text in waha.sent for tag in MESSAGE_TAG_PATTERN.findall(text)}
+            if len(replied) >= expected:
+                finished_at = waha.sent[-1][0]
+                break
+            await asyncio.sleep(0.1)
+
+        # Late duplicates would show up right after the last expected reply
+        await asyncio.sleep(max(1.0, args.debounce))
+
+    report = build_report(args, sent_at, http_times, list(waha.sent), started, finished_at)
+
+    server.should_exit = True
+    await server_task
+    if args.worker_mode:
+        await stream_consumer.stop()
+        await debounce_scheduler.stop()
+    await waha.stop()
+    shutil.rmtree(persist_directory, ignore_errors=True)
+    return report
+
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for key, value in report.items():
+        print(f'{key:>22}: {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+# Must be set before config is imported: the app validates the key and logs at import time
+os.environ.setdefault('OPENAI_API_KEY', 'sk-benchmark')
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+
+import numpy as np  # noqa: E402
+
+from config.config import Config  # noqa: E402
+
+
+CHROMA_BATCH_SIZE = 5000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Query latency and recall of the vector store backends')
+    parser.add_argument('--vectors', type=int, default=20000, help='chunks in the synthetic corpus')
+    parser.add_argument('--dimensions', type=int, default=1536, help='embedding size (text-embedding-3-small is 1536)')
+    parser.add_argument('--clusters', type=int, default=200, help='topics the synthetic chunks are drawn around')
+    parser.add_argument('--queries', type=int, default=200, help='queries timed per backend')
+    parser.add_argument('--k', type=int, default=Config.RAG_SEARCH_K, help='results per query')
+    parser.add_argument(
+        '--rescore-factor',
+        type=int,
+        default=Config.VECTOR_STORE_RESCORE_FACTOR,
+        help='candidates re-scored exactly per result by the quantized indexes',
+    )
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args()
+
+
+def build_corpus(args, rng):
+    # Chunks of one document sit close together, like real embeddings of related passages
+    centroids = rng.standard_normal((args.clusters, args.dimensions)).astype(np.float32)
+    labels = rng.integers(0, args.clusters, args.vectors)
+    vectors = centroids[labels] + 0.6 * rng.standard_normal((args.vectors, args.dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    picked = rng.integers(0, args.vectors, args.queries)
+    queries = vectors[picked] + 0.3 * rng.standard_normal((args.queries, args.dimensions)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+def exact_top_k(vectors, queries, k):
+    scores = queries @ vectors.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def directory_bytes(path, names=None):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if names is None or any(name.startswith(prefix) for prefix in names):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def measure(vector_store, queries, truth, k):
+    vector_store.warm_up()
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        docs = vector_store.similarity_search_by_vector(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - started)
+        hits += len({int(doc.id) for doc in docs} & expected)
+
+    return {
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'recall_at_k': round(hits / (len(queries) * k), 4),
+    }
+
+
+def run(args):
+    from bot.rag import sync_flat_index
+    from bot.vector_stores import ChromaVectorStore, FlatVectorStore
+
+    rng = np.random.default_rng(args.seed)
+    vectors, queries = build_corpus(args, rng)
+    truth = exact_top_k(vectors, queries, args.k)
+
+    persist_directory = tempfile.mkdtemp(prefix='vector-benchmark-')
+    report = {'vectors': args.vectors, 'dimensions': args.dimensions, 'queries': args.queries, 'k': args.k}
+    try:
+        chroma = ChromaVectorStore(persist_directory=persist_directory)
+        started = time.perf_counter()
+        for start in range(0, args.vectors, CHROMA_BATCH_SIZE):
+            batch = range(start, min(start + CHROMA_BATCH_SIZE, args.vectors))
+            chroma._collection.add(
+                ids=[str(index) for index in batch],
+                embeddings=vectors[batch.start:batch.stop],
+                documents=[f'chunk {index}' for index in batch],
+                metadatas=[{'source': 'benchmark'} for _ in batch],
+            )
+        report['chroma'] = {'build_seconds': round(time.perf_counter() - started, 3), **measure(chroma, queries, truth, args.k)}
+
+        # Each flat variant is exported from the Chroma collection, as the migration tool does
+        for dtype in ('float16', 'float32'):
+            Config.VECTOR_STORE_FLAT_DTYPE = dtype
+            started = time.perf_counter()
+            sync_flat_index(chroma, 'benchmark', persist_directory, force=True)
+            flat = FlatVectorStore(persist_directory=persist_directory, quantization='none')
+            report[f'flat_{dtype}'] = {
+                'build_seconds': round(time.perf_counter() - started, 3),
+                'vector_bytes': directory_bytes(persist_directory, ['flat_vectors-']),
+                **measure(flat, queries, truth, args.k),
+            }
+            flat.release()
+
+        # The last export left float32 vectors for the re-scoring, the codes are written beside them
+        for quantization in ('int8', 'binary'):
+            flat = FlatVectorStore(
+                persist_directory=persist_directory,
+                quantization=quantization,
+                rescore_factor=args.rescore_factor,
+            )
+            stats = flat.stats()
+            report[f'flat_{quantization}'] = {
+                'scanned_bytes': stats['scanned_bytes'],
+                'savings': stats['savings'],
+                **measure(flat, queries, truth, args.k),
+            }
+            flat.release()
+
+        chroma.release()
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+    return report
+
+
+def main():
+    args = parse_args()
+    report = run(args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for key in ('vectors', 'dimensions', 'queries', 'k'):
+        print(f'{key:>14}: {report[key]}')
+    for backend in ('chroma', 'flat_float32', 'flat_float16', 'flat_int8', 'flat_binary'):
+        print(f'{backend:>14}: ' + ', '.join(f'{name}={value}' for name, value in report[backend].items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,141 @@
+import logging
+import asyncio
+import time
+
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_chroma import Chroma
-from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
-from services.memory import get_session_history, trim_history_if_needed
+from bot.embedding_cache import CachedQueryEmbeddings
+from bot.answer_cache import SemanticAnswerCache
+from bot.history_window import HistorySummarizer, select_history_window, include_unsummarized, build_summary_message
+from bot.tokens import get_encoding
+from bot.context_compression import ContextCompressor
+from bot.bm25 import BM25Index, reciprocal_rank_fusion
+from bot.streaming import SegmentSplitter
+from bot.vector_stores import build_vector_store
+from services.metrics import track_stage, observe_stage
+from services.memory import aget_history_context, aadd_session_messages
 
 from config.config import Config
 
 
+logger = logging.getLogger(__name__)
+
+
 class AIBot:
-    def __init__(self):
+    def __init__(self, llm=None, embedding=None, persist_directory=None, system_prompt=None, cache_namespace=None):
         self.__model = Config.OPENAI_MODEL
         self.__temperature = Config.OPENAI_TEMPERATURE
-        self.__retriever = self.__build_retriever()
+        # Injected models replace the OpenAI clients, the benchmarks use this to run offline
+        self.__llm = llm
+        self.__persist_directory = persist_directory or Config.CHROMA_PERSIST_DIR
+        self.__system_prompt = system_prompt
+        self.__embedding = self.__build_embedding(embedding)
+        self.__vector_store = self.__build_vector_store()
+        self.__bm25 = BM25Index(self.__persist_directory) if Config.RAG_BM25_ENABLED else None
         self.__chain = self.__build_chain()
+        self.__answer_cache = self.__build_answer_cache(cache_namespace)
+        self.__summarizer = self.__build_summarizer()
+        self.__compressor = ContextCompressor()
+
+    def __build_embedding(self, embedding=None):
+        if embedding is None:
+            embedding = OpenAIEmbeddings(
+                model=Config.OPENAI_EMBEDDING_MODEL,
+                openai_api_key=Config.OPENAI_API_KEY
+            )
+
+        if not Config.EMBEDDING_CACHE_ENABLED:
+            return embedding
+
+        return CachedQueryEmbeddings(embedding, model_name=Config.OPENAI_EMBEDDING_MODEL)
+
+    def __build_vector_store(self):
+        return build_vector_store(self.__persist_directory, self.__embedding)
+
+    def __build_answer_cache(self, namespace):
+        if not Config.ANSWER_CACHE_ENABLED:
+            return None
+
+        return SemanticAnswerCache(persist_directory=self.__persist_directory, namespace=namespace)
+
+    def __vector_k(self):
+        # With hybrid search the vector side only proposes candidates, fusion picks the final k
+        if self.__bm25 is not None:
+            return max(Config.RAG_HYBRID_CANDIDATES, Config.RAG_SEARCH_K)
+        return Config.RAG_SEARCH_K
+
+    def __mmr_kwargs(self):
+        k = self.__vector_k()
+        return {
+            'k': k,
+            'fetch_k': max(Config.RAG_FETCH_K, k),
+            'lambda_mult': Config.RAG_MMR_LAMBDA,
+        }
 
-    def __build_retriever(self):
-        persist_directory = Config.CHROMA_PERSIST_DIR
+    def __fuse(self, vector_docs, lexical_hits):
+        fused_ids = reciprocal_rank_fusion([
+            [doc.id for doc in vector_docs],
+            [doc_id for doc_id, _ in lexical_hits],
+        ])[:Config.RAG_SEARCH_K]
 
-        embedding = OpenAIEmbeddings(
-            model=Config.OPENAI_EMBEDDING_MODEL,
-            openai_api_key=Config.OPENAI_API_KEY
+        docs_by_id = {doc.id: doc for doc in vector_docs}
+        missing = [doc_id for doc_id in fused_ids if doc_id not in docs_by_id]
+        logger.debug(
+            f'Hybrid retrieval: {len(vector_docs)} vector + {len(lexical_hits)} BM25 candidates, '
+            f'{len(missing)} lexical-only chunks in the top {len(fused_ids)}'
         )
+        return fused_ids, docs_by_id, missing
 
-        vector_store = Chroma(
-            persist_directory=persist_directory,
-            embedding_function=embedding,
+    async def __aretrieve(self, question, query_embedding):
+        # MMR reuses the vectors the store already holds, no extra embedding calls
+        if Config.RAG_MMR_ENABLED:
+            vector_search = self.__vector_store.amax_marginal_relevance_search_by_vector(
+                query_embedding,
+                **self.__mmr_kwargs(),
+            )
+        else:
+            vector_search = self.__vector_store.asimilarity_search_by_vector(
+                query_embedding,
+                k=self.__vector_k(),
+            )
+
+        if self.__bm25 is None:
+            return await vector_search
+
+        vector_docs, lexical_hits = await asyncio.gather(
+            vector_search,
+            asyncio.to_thread(self.__bm25.search, question, Config.RAG_HYBRID_CANDIDATES),
         )
+        fused_ids, docs_by_id, missing = self.__fuse(vector_docs, lexical_hits)
+        if missing:
+            docs_by_id.update({doc.id: doc for doc in await self.__vector_store.aget_by_ids(missing)})
+        return [docs_by_id[doc_id] for doc_id in fused_ids if doc_id in docs_by_id]
 
-        return vector_store.as_retriever(
-            search_kwargs={'k': Config.RAG_SEARCH_K},
+    def __build_summarizer(self):
+        if not Config.HISTORY_SUMMARY_ENABLED:
+            return None
+
+        llm = self.__llm or ChatOpenAI(
+            model=self.__model,
+            temperature=0,
+            max_tokens=Config.HISTORY_SUMMARY_MAX_TOKENS,
         )
+        return HistorySummarizer(llm)
 
-    def __build_messages(self, history_messages, question):
-        messages = []
-        for message in history_messages:
-            message_class = HumanMessage if message.get('fromMe') else AIMessage
-            messages.append(message_class(content=message.get('body')))
-        messages.append(HumanMessage(content=question))
-        return messages
+    def __build_history(self, history_context, session_id):
+        window = select_history_window(history_context['messages'])
+
+        if self.__summarizer is not None:
+            if session_id:
+                # Older turns are folded into the summary in the background, off the reply path
+                self.__summarizer.schedule(session_id, history_context, len(window))
+            window = include_unsummarized(history_context, window)
+
+        if history_context['summary']:
+            return [build_summary_message(history_context['summary'])] + window
+        return window
 
     def __build_chain(self):
         system_template = """You are a specialized AI assistant for a company's knowledge base. Your role is to answer questions ONLY based on the provided company documents and conversation history.
@@ -50,7 +146,13 @@ class AIBot:
         3. Always respond in Brazilian Portuguese
         4. Be helpful and professional
         5. If you find relevant information in the context, provide a clear and accurate answer
-        6. Do not make up information or use general knowledge outside the provided context
+        6. Do not make up information or use general knowledge outside the provided context"""
+
+        if self.__system_prompt:
+            # Tenant prompts are plain text, braces must not turn into template variables
+            system_template = self.__system_prompt.replace('{', '{{').replace('}', '}}')
+
+        system_template += """
 
         Context: {context}"""
 
@@ -60,7 +162,7 @@ class AIBot:
             ("human", "{input}"),
         ])
 
-        llm = ChatOpenAI(
+        llm = self.__llm or ChatOpenAI(
             model=self.__model,
             temperature=self.__temperature,
         )
@@ -68,38 +170,125 @@ class AIBot:
         document_chain = create_stuff_documents_chain(llm, prompt)
         return document_chain
 
-    def get_response(self, question, session_id=None):
-        print(f'Getting response for question: {question}, session_id: {session_id}')
+    def warm_up(self):
+        # Opens the persisted vector store so the first question doesn't pay for it
+        self.__vector_store.warm_up()
+        if self.__bm25 is not None:
+            self.__bm25.warm_up()
+        get_encoding(self.__model)
+
+    def resident_bytes(self):
+        return self.__vector_store.resident_bytes()
 
+    async def aclose(self):
+        if self.__summarizer is not None:
+            await self.__summarizer.aclose()
+        await asyncio.to_thread(self.__vector_store.release)
+
+    def embedding_cache_stats(self):
+        if isinstance(self.__embedding, CachedQueryEmbeddings):
+            return self.__embedding.stats()
+        return None
+
+    def answer_cache_stats(self):
+        if self.__answer_cache is not None:
+            return self.__answer_cache.stats()
+        return None
+
+    async def __aprepare(self, question, session_id):
+        history_context = {'messages': [], 'total': 0, 'summary': '', 'summary_covered': 0}
         if session_id:
             try:
-                print(f'Loading history from Redis for session: {session_id}')
-                redis_history = get_session_history(session_id)
-                formatted_history = redis_history.messages
-                print(f'Loaded {len(formatted_history)} history messages')
+                with track_stage('history_load'):
+                    history_context = await aget_history_context(session_id, limit=Config.MAX_HISTORY_MESSAGES)
             except Exception as e:
-                print(f"Error loading history from Redis: {e}")
-                formatted_history = []
-        else:
-            formatted_history = []
+                logger.warning(f'Error loading history from Redis: {e}', extra={'chat_id': session_id})
+
+        formatted_history = self.__build_history(history_context, session_id)
+        logger.debug(f"Loaded {len(history_context['messages'])} history messages, {len(formatted_history)} sent to the model")
 
-        print('Retrieving documents for question')
-        docs = self.__retriever.invoke(question)
+        # Embeds over the async OpenAI client, only the local Chroma lookup uses the executor
+        with track_stage('embedding'):
+            query_embedding = await self.__embedding.aembed_query(question)
 
-        response = self.__chain.invoke({
+        # Cached answers only make sense when the conversation doesn't change the question
+        use_answer_cache = (
+            self.__answer_cache is not None
+            and len(history_context['messages']) <= Config.ANSWER_CACHE_MAX_HISTORY_MESSAGES
+        )
+
+        cached_response = None
+        if use_answer_cache:
+            with track_stage('answer_cache'):
+                cached_response = await self.__answer_cache.lookup(query_embedding)
+
+        return formatted_history, query_embedding, use_answer_cache, cached_response
+
+    async def __abuild_inputs(self, question, query_embedding, formatted_history):
+        with track_stage('retrieval'):
+            docs = await self.__aretrieve(question, query_embedding)
+        with track_stage('compression'):
+            docs = await self.__compressor.acompress(question, docs)
+
+        return {
             "input": question,
             "context": docs,
             "chat_history": formatted_history
-        })
+        }
 
+    async def asave_exchange(self, session_id, question, response):
         if session_id:
             try:
-                print(f'Saving conversation to Redis for session: {session_id}')
-                redis_history = get_session_history(session_id)
-                redis_history.add_user_message(question)
-                redis_history.add_ai_message(response)
-                trim_history_if_needed(session_id)
+                with track_stage('history_save'):
+                    await aadd_session_messages(session_id, question, response)
             except Exception as e:
-                print(f"Error saving history to Redis: {e}")
+                logger.warning(f'Error saving history to Redis: {e}', extra={'chat_id': session_id})
+
+    async def aget_response(self, question, session_id=None, save_history=True):
+        logger.info('Getting response', extra={'chat_id': session_id, 'question': question})
 
+        formatted_history, query_embedding, use_answer_cache, response = await self.__aprepare(question, session_id)
+
+        if response is None:
+            inputs = await self.__abuild_inputs(question, query_embedding, formatted_history)
+            with track_stage('llm'):
+                response = await self.__chain.ainvoke(inputs)
+
+            if use_answer_cache:
+                await self.__answer_cache.store(question, query_embedding, response)
+
+        if save_history:
+            await self.asave_exchange(session_id, question, response)
         return response
+
+    async def astream_response(self, question, session_id=None):
+        logger.info('Streaming response', extra={'chat_id': session_id, 'question': question})
+
+        formatted_history, query_embedding, use_answer_cache, response = await self.__aprepare(question, session_id)
+        splitter = SegmentSplitter()
+
+        if response is not None:
+            for segment in splitter.feed(response) + splitter.flush():
+                yield segment
+        else:
+            inputs = await self.__abuild_inputs(question, query_embedding, formatted_history)
+
+            # Segments go out while the model keeps generating, history gets the whole answer
+            # Timed by hand, a span can't stay open across the yields to the sender
+            chunks = []
+            started = time.perf_counter()
+            async for chunk in self.__chain.astream(inputs):
+                if not chunks:
+                    observe_stage('llm_first_token', time.perf_counter() - started)
+                chunks.append(chunk)
+                for segment in splitter.feed(chunk):
+                    yield segment
+            observe_stage('llm', time.perf_counter() - started)
+            for segment in splitter.flush():
+                yield segment
+
+            response = ''.join(chunks)
+            if use_answer_cache:
+                await self.__answer_cache.store(question, query_embedding, response)
+
+        await self.asave_exchange(session_id, question, response)
@@ -0,0 +1,191 @@
+import logging
+import asyncio
+import os
+import json
+import time
+import hashlib
+
+import numpy as np
+
+from bot.embedding_cache import normalize_query, encode_vector, decode_vector
+from bot.rag import MANIFEST_FILE, get_index_version
+from services.redis_client import redis_client
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+
+    def __init__(self, persist_directory=None, threshold=None, max_entries=None, ttl=None, namespace=None):
+        self.__persist_directory = persist_directory or Config.CHROMA_PERSIST_DIR
+        # Tenants with the same documents but different prompts must not share answers
+        self.__key_prefix = f'{Config.ANSWER_CACHE_KEY_PREFIX}{namespace}:' if namespace else Config.ANSWER_CACHE_KEY_PREFIX
+        self.__threshold = threshold or Config.ANSWER_CACHE_SIMILARITY
+        self.__max_entries = max_entries or Config.ANSWER_CACHE_MAX_ENTRIES
+        self.__ttl = ttl or Config.ANSWER_CACHE_TTL
+        self.__version = None
+        self.__manifest_mtime = -1
+        self.__entries = {}
+        # Rows are written in place, a store must not copy the whole cache on the event loop
+        self.__matrix = None
+        self.__fields = []
+        self.__free_rows = []
+        self.__refreshed_at = 0.0
+        self.__hits = 0
+        self.__misses = 0
+
+    def __cache_key(self, version=None):
+        return f'{self.__key_prefix}{version or self.__version}'
+
+    def __put(self, field, vector, answer, created_at):
+        vector = normalize_vector(vector)
+        if self.__matrix is None or self.__matrix.shape[1] != vector.shape[0]:
+            self.__entries, self.__fields, self.__free_rows = {}, [], []
+            self.__matrix = np.zeros((self.__max_entries, vector.shape[0]), dtype=np.float32)
+
+        if field in self.__entries:
+            row = self.__entries[field]['row']
+        elif self.__free_rows:
+            row = self.__free_rows.pop()
+        else:
+            # Other workers may briefly push the hash past max_entries, grow by doubling
+            row = len(self.__fields)
+            if row == len(self.__matrix):
+                self.__matrix = np.concatenate([self.__matrix, np.zeros_like(self.__matrix)])
+            self.__fields.append(None)
+
+        self.__matrix[row] = vector
+        self.__fields[row] = field
+        self.__entries[field] = {'row': row, 'answer': answer, 'created_at': created_at}
+
+    def __remove(self, field):
+        row = self.__entries.pop(field)['row']
+        # A zeroed row scores 0 and never reaches the similarity threshold
+        self.__matrix[row] = 0
+        self.__fields[row] = None
+        self.__free_rows.append(row)
+
+    def __reset(self):
+        self.__entries = {}
+        self.__matrix = None
+        self.__fields = []
+        self.__free_rows = []
+        self.__refreshed_at = 0.0
+
+    async def __check_version(self):
+        manifest_path = os.path.join(self.__persist_directory, MANIFEST_FILE)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self.__manifest_mtime:
+            return
+
+        self.__manifest_mtime = mtime
+        version = await asyncio.to_thread(get_index_version, self.__persist_directory) if mtime else None
+        if version == self.__version:
+            return
+
+        previous = self.__version
+        self.__version = version
+        self.__reset()
+
+        if previous:
+            logger.info(f'Index version changed {previous} -> {version}, answer cache invalidated')
+            await redis_client.delete(self.__cache_key(previous))
+
+    async def __refresh(self):
+        # Picks up answers stored by other workers without reloading the whole hash
+        if time.monotonic() - self.__refreshed_at < Config.ANSWER_CACHE_REFRESH_SECONDS:
+            return
+        self.__refreshed_at = time.monotonic()
+
+        fields = set(await redis_client.hkeys(self.__cache_key()))
+        missing = [field for field in fields if field not in self.__entries]
+
+        for field in [field for field in self.__entries if field not in fields]:
+            self.__remove(field)
+
+        if missing:
+            values = await redis_client.hmget(self.__cache_key(), missing)
+            for field, value in zip(missing, values):
+                if value is None:
+                    continue
+                record = json.loads(value)
+                self.__put(field, decode_vector(record['embedding']), record['answer'], record['created_at'])
+
+    async def lookup(self, query_embedding):
+        try:
+            await self.__check_version()
+            if not self.__version:
+                return None
+
+            await self.__refresh()
+
+            if self.__entries:
+                scores = self.__matrix[:len(self.__fields)] @ normalize_vector(query_embedding)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.__threshold:
+                    self.__hits += 1
+                    logger.debug(f'Answer cache hit with similarity {scores[best]:.4f}')
+                    return self.__entries[self.__fields[best]]['answer']
+
+            self.__misses += 1
+            return None
+
+        except Exception as e:
+            logger.warning(f"Error reading answer cache: {e}")
+            return None
+
+    async def store(self, question, query_embedding, answer):
+        try:
+            await self.__check_version()
+            if not self.__version:
+                return
+
+            field = hashlib.sha256(normalize_query(question).encode('utf-8')).hexdigest()
+            created_at = time.time()
+            key = self.__cache_key()
+
+            evicted = []
+            if field not in self.__entries and len(self.__entries) >= self.__max_entries:
+                oldest = sorted(self.__entries, key=lambda item: self.__entries[item]['created_at'])
+                evicted = oldest[:len(self.__entries) - self.__max_entries + 1]
+
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(key, field, json.dumps({
+                    'question': question,
+                    'answer': answer,
+                    'embedding': encode_vector(query_embedding),
+                    'created_at': created_at,
+                }))
+                if evicted:
+                    pipe.hdel(key, *evicted)
+                pipe.expire(key, self.__ttl)
+                await pipe.execute()
+
+            for item in evicted:
+                self.__remove(item)
+            self.__put(field, query_embedding, answer, created_at)
+
+        except Exception as e:
+            logger.warning(f"Error writing answer cache: {e}")
+
+    def stats(self):
+        total = self.__hits + self.__misses
+        return {
+            'index_version': self.__version,
+            'entries': len(self.__entries),
+            'hits': self.__hits,
+            'misses': self.__misses,
+            'hit_ratio': round(self.__hits / total, 4) if total else 0.0,
+        }
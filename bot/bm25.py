@@ -0,0 +1,148 @@
+import logging
+import os
+import re
+import json
+import math
+import heapq
+import unicodedata
+from collections import Counter
+
+from bot.index_files import write_json_atomic, read_index_version
+from exceptions.exceptions import VectorStoreException
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+BM25_INDEX_FILE = 'bm25_index.json'
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    # Accent-insensitive so "informação" matches "informacao", product codes stay whole
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return TOKEN_PATTERN.findall(text)
+
+
+def build_bm25_index(documents, index_version=None, persist_directory=None):
+    if persist_directory is None:
+        persist_directory = Config.CHROMA_PERSIST_DIR
+
+    ids = []
+    doc_lengths = []
+    postings = {}
+
+    for doc_id, text in documents:
+        position = len(ids)
+        terms = Counter(tokenize(text or ''))
+        ids.append(doc_id)
+        doc_lengths.append(sum(terms.values()))
+        for term, frequency in terms.items():
+            postings.setdefault(term, []).append([position, frequency])
+
+    index = {
+        'index_version': index_version,
+        'ids': ids,
+        'doc_lengths': doc_lengths,
+        'postings': postings,
+    }
+
+    index_path = os.path.join(persist_directory, BM25_INDEX_FILE)
+    try:
+        os.makedirs(persist_directory, exist_ok=True)
+        write_json_atomic(index_path, index, separators=(',', ':'))
+    except Exception as e:
+        raise VectorStoreException(f"Error writing BM25 index {index_path}: {str(e)}") from e
+
+    print(f"BM25 index built: {len(ids)} chunks, {len(postings)} terms")
+    return len(ids)
+
+
+def get_bm25_index_version(persist_directory=None):
+    if persist_directory is None:
+        persist_directory = Config.CHROMA_PERSIST_DIR
+
+    return read_index_version(os.path.join(persist_directory, BM25_INDEX_FILE))
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    if k is None:
+        k = Config.RAG_RRF_K
+
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+
+    def __init__(self, persist_directory=None, k1=None, b=None):
+        self.__index_path = os.path.join(persist_directory or Config.CHROMA_PERSIST_DIR, BM25_INDEX_FILE)
+        self.__k1 = k1 or Config.RAG_BM25_K1
+        self.__b = b if b is not None else Config.RAG_BM25_B
+        self.__mtime = -1
+        self.__ids = []
+        self.__doc_lengths = []
+        self.__postings = {}
+        self.__idf = {}
+        self.__avg_length = 0.0
+
+    def __check_file(self):
+        # The indexer rewrites the file atomically, reload whenever it changes on disk
+        try:
+            mtime = os.stat(self.__index_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == self.__mtime:
+            return
+        self.__mtime = mtime
+
+        if mtime is None:
+            self.__ids, self.__doc_lengths, self.__postings, self.__idf = [], [], {}, {}
+            return
+
+        try:
+            with open(self.__index_path, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+        except Exception as e:
+            raise VectorStoreException(f"Error reading BM25 index {self.__index_path}: {str(e)}") from e
+
+        self.__ids = index['ids']
+        self.__doc_lengths = index['doc_lengths']
+        self.__postings = index['postings']
+
+        total = len(self.__ids)
+        self.__avg_length = (sum(self.__doc_lengths) / total if total else 0.0) or 1.0
+        self.__idf = {
+            term: math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.__postings.items()
+        }
+        logger.info(f"BM25 index loaded: {total} chunks, {len(self.__postings)} terms")
+
+    def search(self, query, k):
+        self.__check_file()
+        if not self.__ids:
+            return []
+
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.__idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.__postings[term]:
+                length_norm = 1 - self.__b + self.__b * self.__doc_lengths[position] / self.__avg_length
+                score = idf * frequency * (self.__k1 + 1) / (frequency + self.__k1 * length_norm)
+                scores[position] = scores.get(position, 0.0) + score
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.__ids[position], score) for position, score in best]
+
+    def warm_up(self):
+        self.__check_file()
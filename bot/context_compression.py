@@ -0,0 +1,125 @@
+import logging
+import asyncio
+import hashlib
+
+from langchain_core.documents import Document
+
+from bot.tokens import count_tokens
+from exceptions.exceptions import ConfigurationException
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+# Shortest shared edge treated as splitter overlap rather than a coincidence
+MIN_OVERLAP_CHARS = 30
+
+
+def build_reranker():
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError as e:
+        raise ConfigurationException("RAG_RERANK_ENABLED requires the sentence-transformers package") from e
+
+    return CrossEncoder(Config.RAG_RERANK_MODEL, device='cpu')
+
+
+def find_overlap(head, tail):
+    # Length of the longest suffix of head that is also a prefix of tail
+    for length in range(min(len(head), len(tail), Config.RAG_CHUNK_OVERLAP), MIN_OVERLAP_CHARS - 1, -1):
+        if head.endswith(tail[:length]):
+            return length
+    return 0
+
+
+def get_shingles(text, size=3):
+    words = text.lower().split()
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[index:index + size]) for index in range(len(words) - size + 1)}
+
+
+class ContextCompressor:
+
+    def __init__(self):
+        self.__reranker = build_reranker() if Config.RAG_RERANK_ENABLED else None
+
+    def __deduplicate(self, docs):
+        kept = []
+        kept_shingles = []
+        seen_hashes = set()
+
+        for doc in docs:
+            content = doc.page_content.strip()
+            digest = hashlib.sha1(' '.join(content.split()).lower().encode('utf-8')).hexdigest()
+            if not content or digest in seen_hashes:
+                continue
+            seen_hashes.add(digest)
+
+            source = doc.metadata.get('source')
+            for other in kept:
+                if other.metadata.get('source') != source:
+                    continue
+
+                # Neighbouring chunks of one file share up to RAG_CHUNK_OVERLAP characters
+                before = find_overlap(other.page_content, content)
+                if before:
+                    content = content[before:].strip()
+                after = find_overlap(content, other.page_content)
+                if after:
+                    content = content[:-after].strip()
+
+            if len(content) < MIN_OVERLAP_CHARS:
+                continue
+
+            shingles = get_shingles(content)
+            if any(
+                len(shingles & other) / len(shingles | other) >= Config.RAG_DEDUP_SIMILARITY
+                for other in kept_shingles
+            ):
+                continue
+
+            kept.append(Document(page_content=content, metadata=doc.metadata, id=doc.id))
+            kept_shingles.append(shingles)
+
+        return kept
+
+    def __rerank(self, question, docs):
+        if self.__reranker is None or len(docs) < 2:
+            return docs
+
+        scores = self.__reranker.predict([(question, doc.page_content) for doc in docs])
+        ranked = sorted(zip(scores, range(len(docs))), key=lambda item: item[0], reverse=True)
+        return [docs[index] for _, index in ranked]
+
+    def __trim_to_budget(self, docs):
+        kept = []
+        used = 0
+        for doc in docs:
+            tokens = count_tokens(doc.page_content)
+            if used + tokens > Config.RAG_CONTEXT_TOKEN_BUDGET:
+                if kept:
+                    continue
+            kept.append(doc)
+            used += tokens
+        return kept, used
+
+    def compress(self, question, docs):
+        tokens_before = sum(count_tokens(doc.page_content) for doc in docs)
+
+        compressed = self.__deduplicate(docs)
+        compressed = self.__rerank(question, compressed)
+        compressed, tokens_after = self.__trim_to_budget(compressed)
+
+        logger.debug(
+            f'Context compressed: {len(docs)} chunks / {tokens_before} tokens -> '
+            f'{len(compressed)} chunks / {tokens_after} tokens ({tokens_before - tokens_after} tokens saved)'
+        )
+        return compressed
+
+    async def acompress(self, question, docs):
+        # Cross-encoder inference is CPU bound, keep it off the event loop when enabled
+        if self.__reranker is not None:
+            return await asyncio.to_thread(self.compress, question, docs)
+        return self.compress(question, docs)
@@ -0,0 +1,151 @@
+import logging
+import time
+import base64
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from services.redis_client import redis_client, sync_redis_client
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    text = unicodedata.normalize('NFKC', text)
+    return ' '.join(text.lower().split())
+
+
+def encode_vector(vector):
+    return base64.b64encode(array('f', vector).tobytes()).decode('ascii')
+
+
+def decode_vector(value):
+    vector = array('f')
+    vector.frombytes(base64.b64decode(value))
+    return vector.tolist()
+
+
+class CachedQueryEmbeddings(Embeddings):
+
+    def __init__(self, embedding, model_name, max_size=None, ttl=None, redis_ttl=None):
+        self.__embedding = embedding
+        self.__model_name = model_name
+        self.__max_size = max_size or Config.EMBEDDING_CACHE_SIZE
+        self.__ttl = ttl or Config.EMBEDDING_CACHE_TTL
+        self.__redis_ttl = redis_ttl or Config.EMBEDDING_CACHE_REDIS_TTL
+        self.__local = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local_hits = 0
+        self.__redis_hits = 0
+        self.__misses = 0
+
+    def __cache_key(self, text):
+        digest = hashlib.sha256(normalize_query(text).encode('utf-8')).hexdigest()
+        return f'{Config.EMBEDDING_CACHE_KEY_PREFIX}{self.__model_name}:{digest}'
+
+    def __get_local(self, key):
+        with self.__lock:
+            entry = self.__local.get(key)
+            if entry is None:
+                return None
+
+            expires_at, vector = entry
+            if expires_at < time.monotonic():
+                del self.__local[key]
+                return None
+
+            self.__local.move_to_end(key)
+            self.__local_hits += 1
+            return vector
+
+    def __set_local(self, key, vector):
+        with self.__lock:
+            self.__local[key] = (time.monotonic() + self.__ttl, vector)
+            self.__local.move_to_end(key)
+            while len(self.__local) > self.__max_size:
+                self.__local.popitem(last=False)
+
+    def __record_redis_hit(self):
+        with self.__lock:
+            self.__redis_hits += 1
+
+    def __record_miss(self):
+        with self.__lock:
+            self.__misses += 1
+
+    def embed_documents(self, texts):
+        return self.__embedding.embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await self.__embedding.aembed_documents(texts)
+
+    def embed_query(self, text):
+        key = self.__cache_key(text)
+
+        vector = self.__get_local(key)
+        if vector is not None:
+            return vector
+
+        try:
+            cached = sync_redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Error reading embedding cache from Redis: {e}")
+            cached = None
+
+        if cached is not None:
+            vector = decode_vector(cached)
+            self.__record_redis_hit()
+        else:
+            vector = self.__embedding.embed_query(text)
+            self.__record_miss()
+            try:
+                sync_redis_client.set(key, encode_vector(vector), ex=self.__redis_ttl)
+            except Exception as e:
+                logger.warning(f"Error writing embedding cache to Redis: {e}")
+
+        self.__set_local(key, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        key = self.__cache_key(text)
+
+        vector = self.__get_local(key)
+        if vector is not None:
+            return vector
+
+        try:
+            cached = await redis_client.get(key)
+        except Exception as e:
+            logger.warning(f"Error reading embedding cache from Redis: {e}")
+            cached = None
+
+        if cached is not None:
+            vector = decode_vector(cached)
+            self.__record_redis_hit()
+        else:
+            vector = await self.__embedding.aembed_query(text)
+            self.__record_miss()
+            try:
+                await redis_client.set(key, encode_vector(vector), ex=self.__redis_ttl)
+            except Exception as e:
+                logger.warning(f"Error writing embedding cache to Redis: {e}")
+
+        self.__set_local(key, vector)
+        return vector
+
+    def stats(self):
+        with self.__lock:
+            total = self.__local_hits + self.__redis_hits + self.__misses
+            return {
+                'local_hits': self.__local_hits,
+                'redis_hits': self.__redis_hits,
+                'misses': self.__misses,
+                'local_size': len(self.__local),
+                'hit_ratio': round((self.__local_hits + self.__redis_hits) / total, 4) if total else 0.0,
+            }
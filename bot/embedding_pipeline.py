@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+import openai
+
+from exceptions.exceptions import EmbeddingException, ConfigurationException
+from config.config import Config
+
+
+def is_retryable_error(error):
+    if isinstance(error, (openai.APIConnectionError, TimeoutError, ConnectionError)):
+        return True
+
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+class EmbeddingPipeline:
+
+    def __init__(
+        self,
+        embedding,
+        write_batch,
+        batch_size=None,
+        max_concurrency=None,
+        max_retries=None,
+        backoff_seconds=None,
+        checkpoint_path=None,
+    ):
+        self.__embedding = embedding
+        self.__write_batch = write_batch
+        self.__batch_size = batch_size or Config.RAG_EMBEDDING_BATCH_SIZE
+        self.__max_concurrency = max_concurrency or Config.RAG_EMBEDDING_CONCURRENCY
+        self.__max_retries = Config.RAG_EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.__backoff_seconds = backoff_seconds or Config.RAG_EMBEDDING_BACKOFF_SECONDS
+        self.__checkpoint_path = checkpoint_path
+
+        if self.__batch_size <= 0:
+            raise ConfigurationException(f"Invalid embedding batch size: {self.__batch_size}. Must be positive.")
+        if self.__max_concurrency <= 0:
+            raise ConfigurationException(f"Invalid embedding concurrency: {self.__max_concurrency}. Must be positive.")
+
+        self.__done_ids = self.__load_checkpoint()
+        self.__retries = 0
+
+    def __load_checkpoint(self):
+        if not self.__checkpoint_path or not os.path.exists(self.__checkpoint_path):
+            return set()
+
+        done_ids = set()
+        try:
+            with open(self.__checkpoint_path, 'r', encoding='utf-8') as file:
+                line = ''
+                for line in file:
+                    try:
+                        done_ids.update(json.loads(line)['ids'])
+                    except (ValueError, KeyError):
+                        # A crash mid-append leaves a partial last line, its batch is simply embedded again
+                        continue
+
+            # Terminated so the next append doesn't land on the partial line
+            if line and not line.endswith('\n'):
+                with open(self.__checkpoint_path, 'a', encoding='utf-8') as file:
+                    file.write('\n')
+            print(f"Resuming from checkpoint with {len(done_ids)} chunks already embedded")
+            return done_ids
+        except Exception as e:
+            raise EmbeddingException(f"Error reading embedding checkpoint {self.__checkpoint_path}: {str(e)}") from e
+
+    def __save_checkpoint(self, ids):
+        if not self.__checkpoint_path:
+            return
+
+        try:
+            # One line per finished batch, so each save costs the batch and not the whole run
+            with open(self.__checkpoint_path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps({'ids': ids}) + '\n')
+        except Exception as e:
+            raise EmbeddingException(f"Error writing embedding checkpoint {self.__checkpoint_path}: {str(e)}") from e
+
+    def clear_checkpoint(self):
+        self.__done_ids = set()
+        if self.__checkpoint_path and os.path.exists(self.__checkpoint_path):
+            os.remove(self.__checkpoint_path)
+
+    def __embed_with_retry(self, texts):
+        attempt = 0
+        while True:
+            try:
+                return self.__embedding.embed_documents(texts)
+            except Exception as e:
+                if attempt >= self.__max_retries or not is_retryable_error(e):
+                    raise EmbeddingException(f"Error embedding batch of {len(texts)} chunks: {str(e)}") from e
+
+                # Exponential backoff with jitter so parallel batches don't retry in lockstep
+                delay = min(self.__backoff_seconds * (2 ** attempt), Config.RAG_EMBEDDING_MAX_BACKOFF_SECONDS)
+                delay = delay * (0.5 + random.random() / 2)
+                attempt += 1
+                self.__retries += 1
+                print(f"Embedding batch failed ({str(e)}), retry {attempt}/{self.__max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def __pending_batches(self, chunks):
+        pending = ((chunk_id, chunk) for chunk_id, chunk in chunks if chunk_id not in self.__done_ids)
+        while True:
+            batch = list(islice(pending, self.__batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def run(self, chunks):
+        started = time.perf_counter()
+        embedded = 0
+        skipped_before = len(self.__done_ids)
+        batches = self.__pending_batches(chunks)
+
+        # Bounded in-flight window, the chunk stream is only consumed as batches complete
+        with ThreadPoolExecutor(max_workers=self.__max_concurrency) as executor:
+            in_flight = {}
+            exhausted = False
+
+            while True:
+                while not exhausted and len(in_flight) < self.__max_concurrency:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                        break
+                    texts = [chunk.page_content for _, chunk in batch]
+                    in_flight[executor.submit(self.__embed_with_retry, texts)] = batch
+
+                if not in_flight:
+                    break
+
+                completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    batch = in_flight.pop(future)
+                    embeddings = future.result()
+
+                    ids = [chunk_id for chunk_id, _ in batch]
+                    self.__write_batch(ids, [chunk for _, chunk in batch], embeddings)
+
+                    self.__done_ids.update(ids)
+                    self.__save_checkpoint(ids)
+
+                    embedded += len(batch)
+                    elapsed = time.perf_counter() - started
+                    print(f"Embedded {embedded} chunks ({embedded / elapsed:.1f} chunks/s)")
+
+        elapsed = time.perf_counter() - started
+        stats = {
+            'embedded': embedded,
+            'resumed': skipped_before,
+            'retries': self.__retries,
+            'seconds': round(elapsed, 2),
+            'chunks_per_second': round(embedded / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        print(
+            f"Embedding finished: {embedded} chunks in {stats['seconds']}s "
+            f"({stats['chunks_per_second']} chunks/s, {self.__retries} retries)"
+        )
+        return stats
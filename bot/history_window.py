@@ -0,0 +1,136 @@
+import uuid
+import logging
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from bot.tokens import count_message_tokens
+from services.memory import asave_history_summary
+from services.redis_client import redis_client
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_PROMPT = """You maintain a running summary of a WhatsApp conversation between a customer and a company assistant.
+Update the summary with the new messages below. Keep names, order numbers, products, dates and any open questions.
+Write at most {max_words} words in Brazilian Portuguese and answer with the summary only.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}"""
+
+# Deletes the lock only if it still holds this worker's token, an expired lock may belong to another worker
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def select_history_window(messages, budget=None):
+    if budget is None:
+        budget = Config.HISTORY_TOKEN_BUDGET
+
+    used = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        tokens = count_message_tokens(messages[index])
+        if used + tokens > budget:
+            break
+        used += tokens
+        start = index
+
+    # Don't open the window on an answer without the question that led to it
+    if start < len(messages) and isinstance(messages[start], AIMessage):
+        start += 1
+
+    return messages[start:]
+
+
+def include_unsummarized(history_context, window):
+    # Turns that left the token window but aren't in the summary yet stay in it, or the model would see neither.
+    # Capped, so a long history that was never summarized doesn't blow the budget before its first summary
+    messages = history_context['messages']
+    first_position = history_context['total'] - len(messages) + 1
+    start = max(history_context['summary_covered'] - first_position + 1, 0)
+    start = max(start, len(messages) - len(window) - Config.HISTORY_SUMMARY_MIN_MESSAGES * 2)
+
+    if start >= len(messages) - len(window):
+        return window
+
+    # Same rule as the window, never open on an answer without its question
+    if isinstance(messages[start], AIMessage):
+        start += 1
+    return messages[start:]
+
+
+def build_summary_message(summary):
+    return SystemMessage(content=f"Summary of the earlier conversation: {summary}")
+
+
+class HistorySummarizer:
+
+    def __init__(self, llm):
+        self.__llm = llm
+        self.__tasks = set()
+        self.__release_lock = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+    def schedule(self, session_id, history_context, window_size):
+        messages = history_context['messages']
+        total = history_context['total']
+
+        # Absolute positions: the oldest loaded message is total - len(messages) + 1
+        first_position = total - len(messages) + 1
+        covered_until = total - window_size
+        pending = [
+            message for position, message in enumerate(messages, first_position)
+            if history_context['summary_covered'] < position <= covered_until
+        ]
+
+        if len(pending) < Config.HISTORY_SUMMARY_MIN_MESSAGES:
+            return
+
+        task = asyncio.create_task(
+            self.__summarize(session_id, history_context['summary'], pending, covered_until)
+        )
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+
+    async def __summarize(self, session_id, summary, pending, covered_until):
+        lock_key = f'{Config.HISTORY_SUMMARY_KEY_PREFIX}{session_id}:lock'
+
+        token = uuid.uuid4().hex
+
+        # One summarization per session at a time, across every worker
+        if not await redis_client.set(lock_key, token, nx=True, ex=Config.HISTORY_SUMMARY_LOCK_SECONDS):
+            return
+
+        try:
+            transcript = '\n'.join(
+                f"{'Customer' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}"
+                for message in pending
+            )
+            result = await self.__llm.ainvoke(SUMMARY_PROMPT.format(
+                max_words=int(Config.HISTORY_SUMMARY_MAX_TOKENS * 0.6),
+                summary=summary or '(empty)',
+                transcript=transcript,
+            ))
+
+            await asave_history_summary(session_id, result.content.strip(), covered_until)
+            logger.info(f'History summary updated, {len(pending)} messages folded in', extra={'chat_id': session_id})
+
+        except Exception as e:
+            logger.warning(f'Error summarizing history: {e}', extra={'chat_id': session_id})
+        finally:
+            await self.__release_lock(keys=[lock_key], args=[token])
+
+    async def aclose(self):
+        tasks = list(self.__tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,21 @@
+import os
+import json
+
+
+def write_json_atomic(path, data, **dump_options):
+    # Written beside the target and swapped in, so readers never load a half-written index
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, **dump_options)
+    os.replace(temp_path, path)
+
+
+def read_index_version(index_path):
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        with open(index_path, 'r', encoding='utf-8') as file:
+            return json.load(file).get('index_version')
+    except Exception:
+        return None
@@ -1,5 +1,8 @@
 import os
-import glob
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
@@ -19,10 +22,30 @@ from exceptions.exceptions import (
     EmbeddingException,
     ConfigurationException
 )
+from bot.embedding_pipeline import EmbeddingPipeline
+from bot.index_files import write_json_atomic
+from bot.bm25 import build_bm25_index, get_bm25_index_version
+from bot.vector_stores.flat import build_flat_index, get_flat_index_version
+from services.tenants import load_tenants
 from config.config import Config
 
 
-def load_documents_from_directory(data_directory=None):
+LOADERS = {
+    '.pdf': PyPDFLoader,
+    '.csv': CSVLoader,
+    '.txt': TextLoader,
+    '.md': UnstructuredMarkdownLoader,
+    '.docx': UnstructuredWordDocumentLoader,
+    '.doc': UnstructuredWordDocumentLoader,
+}
+
+MANIFEST_FILE = 'index_manifest.json'
+MANIFEST_VERSION = 1
+CHECKPOINT_FILE = 'embedding_checkpoint.jsonl'
+BM25_PAGE_SIZE = 5000
+
+
+def validate_data_directory(data_directory=None):
     try:
         if data_directory is None:
             data_directory = Config.RAG_DATA_DIR
@@ -33,89 +56,75 @@ def load_documents_from_directory(data_directory=None):
         if not os.path.isdir(data_directory):
             raise ConfigurationException(f"Path is not a directory: {data_directory}")
 
+        return data_directory
+
     except Exception as e:
         if isinstance(e, ConfigurationException):
             raise
         raise ConfigurationException(f"Error validating data directory: {str(e)}")
 
-    all_documents = []
-    loaders = {
-        '.pdf': PyPDFLoader,
-        '.csv': CSVLoader,
-        '.txt': TextLoader,
-        '.md': UnstructuredMarkdownLoader,
-        '.docx': UnstructuredWordDocumentLoader,
-        '.doc': UnstructuredWordDocumentLoader,
-    }
 
-    for extension, loader_class in loaders.items():
-        try:
-            pattern = os.path.join(data_directory, f'**/*{extension}')
-            files = glob.glob(pattern, recursive=True)
+def load_file(file_path):
+    loader_class = LOADERS[os.path.splitext(file_path)[1].lower()]
+    return loader_class(file_path).load()
 
-            for file_path in files:
-                try:
-                    print(f"Loading file: {file_path}")
-                    loader = loader_class(file_path)
-                    docs = loader.load()
-                    all_documents.extend(docs)
-                    print(f"SUCCESS: {file_path} loaded successfully ({len(docs)} documents)")
-                except Exception as e:
-                    error_msg = f"Failed to load {file_path}: {str(e)}"
-                    print(f"ERROR: {error_msg}")
-                    raise DocumentLoadException(error_msg) from e
 
-        except DocumentLoadException:
-            # Re-raise DocumentLoadException
-            raise
-        except Exception as e:
-            error_msg = f"Error processing {extension} files: {str(e)}"
-            print(f"ERROR: {error_msg}")
-            raise DocumentLoadException(error_msg) from e
+def iter_loaded_files(files, errors=None, max_workers=None):
+    if max_workers is None:
+        max_workers = Config.RAG_LOADER_WORKERS or os.cpu_count() or 1
 
-    return all_documents
+    pending_files = iter(files.items())
+    # Only a small window of files is parsed ahead, so memory stays bounded on large corpora
+    window = max_workers * 2
 
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = {}
 
-def create_vector_store(documents, persist_directory=None):
-    try:
-        if persist_directory is None:
-            persist_directory = Config.CHROMA_PERSIST_DIR
-
-        if not documents:
-            raise VectorStoreException("No documents provided for vector store creation")
+        while True:
+            while len(in_flight) < window:
+                item = next(pending_files, None)
+                if item is None:
+                    break
+                relative_path, file_path = item
+                print(f"Loading file: {file_path}")
+                in_flight[executor.submit(load_file, file_path)] = item
 
-    except Exception as e:
-        if isinstance(e, (ConfigurationException, VectorStoreException)):
-            raise
-        raise ConfigurationException(f"Error validating parameters: {str(e)}")
+            if not in_flight:
+                return
 
-    try:
-        print(f"Processing {len(documents)} documents...")
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in completed:
+                relative_path, file_path = in_flight.pop(future)
+                try:
+                    docs = future.result()
+                except Exception as e:
+                    error_msg = f"Failed to load {file_path}: {str(e)}"
+                    print(f"ERROR: {error_msg}")
+                    if errors is None:
+                        raise DocumentLoadException(error_msg) from e
+                    errors.append({'file': relative_path, 'error': str(e)})
+                    continue
 
-        chunk_size = Config.RAG_CHUNK_SIZE
-        chunk_overlap = Config.RAG_CHUNK_OVERLAP
+                print(f"SUCCESS: {file_path} loaded successfully ({len(docs)} documents)")
+                yield relative_path, docs
 
-        if chunk_size <= 0:
-            raise ConfigurationException(f"Invalid chunk_size: {chunk_size}. Must be positive.")
-        if chunk_overlap < 0:
-            raise ConfigurationException(f"Invalid chunk_overlap: {chunk_overlap}. Must be non-negative.")
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-        )
+def build_text_splitter():
+    chunk_size = Config.RAG_CHUNK_SIZE
+    chunk_overlap = Config.RAG_CHUNK_OVERLAP
 
-        chunks = text_splitter.split_documents(documents)
-        print(f"Created {len(chunks)} text chunks")
+    if chunk_size <= 0:
+        raise ConfigurationException(f"Invalid chunk_size: {chunk_size}. Must be positive.")
+    if chunk_overlap < 0:
+        raise ConfigurationException(f"Invalid chunk_overlap: {chunk_overlap}. Must be non-negative.")
 
-        if not chunks:
-            raise VectorStoreException("No text chunks created from documents")
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
 
-    except Exception as e:
-        if isinstance(e, (ConfigurationException, VectorStoreException)):
-            raise
-        raise VectorStoreException(f"Error processing documents: {str(e)}") from e
 
+def build_embedding():
     try:
         embedding_model = Config.OPENAI_EMBEDDING_MODEL
         openai_api_key = Config.OPENAI_API_KEY
@@ -123,7 +132,7 @@ def create_vector_store(documents, persist_directory=None):
         if not openai_api_key:
             raise ConfigurationException("OPENAI_API_KEY is not configured")
 
-        embedding = OpenAIEmbeddings(
+        return OpenAIEmbeddings(
             model=embedding_model,
             openai_api_key=openai_api_key
         )
@@ -133,35 +142,322 @@ def create_vector_store(documents, persist_directory=None):
             raise
         raise EmbeddingException(f"Error creating embedding model: {str(e)}") from e
 
+
+def discover_files(data_directory=None):
+    data_directory = validate_data_directory(data_directory)
+
+    files = {}
+    for root, _, file_names in os.walk(data_directory):
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1].lower() in LOADERS:
+                file_path = os.path.join(root, file_name)
+                files[os.path.relpath(file_path, data_directory)] = file_path
+
+    return dict(sorted(files.items()))
+
+
+def hash_file(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_chunk_ids(relative_path, file_hash, total):
+    path_hash = hashlib.sha1(relative_path.encode('utf-8')).hexdigest()[:12]
+    return [f'{path_hash}-{file_hash[:12]}-{index}' for index in range(total)]
+
+
+def get_index_settings():
+    return {
+        'manifest_version': MANIFEST_VERSION,
+        'embedding_model': Config.OPENAI_EMBEDDING_MODEL,
+        'chunk_size': Config.RAG_CHUNK_SIZE,
+        'chunk_overlap': Config.RAG_CHUNK_OVERLAP,
+    }
+
+
+def compute_index_version(manifest):
+    # Derived from content only, so reruns that change nothing keep the same version
+    digest = hashlib.sha256(json.dumps(manifest['settings'], sort_keys=True).encode('utf-8'))
+    for relative_path, entry in sorted(manifest['files'].items()):
+        if entry.get('complete', True):
+            digest.update(f'{relative_path}:{entry["hash"]}'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def get_index_version(persist_directory=None):
+    manifest = load_manifest(persist_directory)
+    if manifest is None:
+        return None
+    return manifest.get('index_version')
+
+
+def load_manifest(persist_directory=None):
+    if persist_directory is None:
+        persist_directory = Config.CHROMA_PERSIST_DIR
+
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except Exception as e:
+        raise VectorStoreException(f"Error reading index manifest {manifest_path}: {str(e)}") from e
+
+
+def save_manifest(manifest, persist_directory=None):
+    if persist_directory is None:
+        persist_directory = Config.CHROMA_PERSIST_DIR
+
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILE)
+    try:
+        os.makedirs(persist_directory, exist_ok=True)
+        write_json_atomic(manifest_path, manifest, indent=2)
+    except Exception as e:
+        raise VectorStoreException(f"Error writing index manifest {manifest_path}: {str(e)}") from e
+
+
+def iter_collection_pages(vector_store, include):
+    offset = 0
+    while True:
+        try:
+            page = vector_store._collection.get(include=include, limit=BM25_PAGE_SIZE, offset=offset)
+        except Exception as e:
+            raise VectorStoreException(f"Error reading chunks from vector store: {str(e)}") from e
+
+        if not page['ids']:
+            return
+        yield page
+        offset += len(page['ids'])
+
+
+def iter_collection_texts(vector_store):
+    for page in iter_collection_pages(vector_store, ['documents']):
+        yield from zip(page['ids'], page['documents'])
+
+
+def iter_collection_records(vector_store):
+    for page in iter_collection_pages(vector_store, ['documents', 'metadatas', 'embeddings']):
+        yield from zip(page['ids'], page['documents'], page['metadatas'], page['embeddings'])
+
+
+def sync_bm25_index(vector_store, index_version, persist_directory=None):
+    # Built from the collection itself so the lexical and vector sides always hold the same chunks
+    if get_bm25_index_version(persist_directory) == index_version:
+        return False
+
+    build_bm25_index(iter_collection_texts(vector_store), index_version, persist_directory)
+    return True
+
+
+def sync_flat_index(vector_store, index_version, persist_directory=None, force=False):
+    # Chroma stays the store the indexer writes to, the flat index is a read-only snapshot of it
+    if not force and get_flat_index_version(persist_directory) == index_version:
+        return False
+
+    build_flat_index(iter_collection_records(vector_store), index_version, persist_directory)
+    return True
+
+
+def sync_vector_store(data_directory=None, persist_directory=None):
+    if persist_directory is None:
+        persist_directory = Config.CHROMA_PERSIST_DIR
+
+    files = discover_files(data_directory)
+    settings = get_index_settings()
+    manifest = load_manifest(persist_directory)
+
+    embedding = build_embedding()
+    text_splitter = build_text_splitter()
+
     try:
         vector_store = Chroma(
             embedding_function=embedding,
             persist_directory=persist_directory,
         )
 
-        vector_store.add_documents(documents=chunks)
-        print(f"SUCCESS: Vector store created successfully at {persist_directory}")
+        if manifest is None or manifest.get('settings') != settings:
+            # Without a matching manifest the stored chunks can't be traced back to files
+            print("Index manifest missing or settings changed, rebuilding the whole collection")
+            vector_store.reset_collection()
+            manifest = {'settings': settings, 'files': {}}
+            save_manifest(manifest, persist_directory)
 
-        return vector_store
+            checkpoint_path = os.path.join(persist_directory, CHECKPOINT_FILE)
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
 
+    except VectorStoreException:
+        raise
     except Exception as e:
-        raise VectorStoreException(f"Error creating vector store: {str(e)}") from e
+        raise VectorStoreException(f"Error opening vector store: {str(e)}") from e
+
+    indexed_files = manifest['files']
+    file_hashes = {relative_path: hash_file(file_path) for relative_path, file_path in files.items()}
+
+    added = [path for path in file_hashes if path not in indexed_files]
+    changed = [
+        path for path in file_hashes
+        if path in indexed_files and indexed_files[path]['hash'] != file_hashes[path]
+    ]
+    # Same content but the previous run crashed before finishing, resume from the checkpoint
+    resumed = [
+        path for path in file_hashes
+        if path in indexed_files
+        and indexed_files[path]['hash'] == file_hashes[path]
+        and not indexed_files[path].get('complete', True)
+    ]
+    removed = [path for path in indexed_files if path not in file_hashes]
+    unchanged = len(file_hashes) - len(added) - len(changed) - len(resumed)
+
+    stale_ids = []
+
+    def delete_chunks(relative_path):
+        try:
+            chunk_ids = indexed_files.pop(relative_path)['chunk_ids']
+            if chunk_ids:
+                vector_store.delete(ids=chunk_ids)
+            stale_ids.extend(chunk_ids)
+
+        except VectorStoreException:
+            raise
+        except Exception as e:
+            raise VectorStoreException(f"Error deleting stale chunks of {relative_path}: {str(e)}") from e
+
+    for relative_path in removed:
+        delete_chunks(relative_path)
+    if removed:
+        save_manifest(manifest, persist_directory)
+
+    to_index = {relative_path: files[relative_path] for relative_path in added + changed + resumed}
+    indexed = []
+    errors = []
+
+    def iter_chunks():
+        for relative_path, docs in iter_loaded_files(to_index, errors=errors):
+            file_path = files[relative_path]
+
+            # A changed file keeps its previous chunks until the new version has loaded
+            if relative_path in changed:
+                delete_chunks(relative_path)
+
+            try:
+                chunks = text_splitter.split_documents(docs)
+                chunk_ids = build_chunk_ids(relative_path, file_hashes[relative_path], len(chunks))
+
+                # Marked incomplete until embedded, a crashed run resumes these files from the checkpoint
+                indexed_files[relative_path] = {
+                    'hash': file_hashes[relative_path],
+                    'chunk_ids': chunk_ids,
+                    'complete': False,
+                }
+                indexed.append(relative_path)
+
+            except VectorStoreException:
+                raise
+            except Exception as e:
+                raise VectorStoreException(f"Error splitting {file_path}: {str(e)}") from e
+
+            yield from zip(chunk_ids, chunks)
+
+        # Written once every file has loaded rather than per file, which made the run quadratic.
+        # Chunk ids are derived from path and content, so files a crash left out get the same ids again
+        save_manifest(manifest, persist_directory)
+
+    def write_batch(ids, chunks, embeddings):
+        try:
+            # add_documents would embed the texts again, so the vectors go straight to the collection
+            vector_store._collection.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                documents=[chunk.page_content for chunk in chunks],
+                metadatas=[chunk.metadata or {'source': ''} for chunk in chunks],
+            )
+        except Exception as e:
+            raise VectorStoreException(f"Error writing {len(ids)} chunks to vector store: {str(e)}") from e
+
+    pipeline = EmbeddingPipeline(
+        embedding=embedding,
+        write_batch=write_batch,
+        checkpoint_path=os.path.join(persist_directory, CHECKPOINT_FILE),
+    )
+    stats = pipeline.run(iter_chunks())
+
+    indexed_at = datetime.now(timezone.utc).isoformat()
+    for relative_path in indexed:
+        indexed_files[relative_path]['complete'] = True
+        indexed_files[relative_path]['indexed_at'] = indexed_at
+    manifest['index_version'] = compute_index_version(manifest)
+    save_manifest(manifest, persist_directory)
+    pipeline.clear_checkpoint()
+
+    if Config.RAG_BM25_ENABLED:
+        sync_bm25_index(vector_store, manifest['index_version'], persist_directory)
+
+    if Config.VECTOR_STORE_BACKEND == 'flat':
+        sync_flat_index(vector_store, manifest['index_version'], persist_directory)
+
+    # Files that failed to load are only reported as errors, they are picked up again on the next run
+    indexed_paths = set(indexed)
+    added = [path for path in added if path in indexed_paths]
+    changed = [path for path in changed if path in indexed_paths]
+    resumed = [path for path in resumed if path in indexed_paths]
+
+    summary = {
+        'indexed': indexed,
+        'added': added,
+        'changed': changed,
+        'removed': removed,
+        'unchanged': unchanged,
+        'resumed': resumed,
+        'chunks_added': stats['embedded'],
+        'chunks_deleted': len(stale_ids),
+        'chunks_per_second': stats['chunks_per_second'],
+        'errors': errors,
+    }
+
+    print(
+        f"Index diff: {len(added)} added, {len(changed)} changed, {len(resumed)} resumed, "
+        f"{len(removed)} removed, {unchanged} unchanged, {len(errors)} failed"
+    )
+    for label, paths in (('+', added), ('~', changed), ('>', resumed), ('-', removed)):
+        for path in paths:
+            print(f"  {label} {path}")
+    for error in errors:
+        print(f"  ! {error['file']}: {error['error']}")
+
+    return summary
 
 
 if __name__ == '__main__':
     try:
         print("Starting RAG indexing process...")
 
-        documents = load_documents_from_directory()
+        # One knowledge base per tenant, or just the global one without a tenants file
+        indexed = 0
+        for session, tenant in load_tenants().items():
+            data_directory = tenant['documents_directory']
+            if not data_directory or not discover_files(data_directory):
+                print(f"WARNING: No documents found for {session} in {data_directory}")
+                continue
 
-        if not documents:
-            print("ERROR: No documents found in /app/data/documents folder")
-            exit(1)
+            print(f"Indexing {session}: {data_directory} -> {tenant['persist_directory']}")
+            summary = sync_vector_store(data_directory, tenant['persist_directory'])
+            indexed += 1
 
-        vector_store = create_vector_store(documents)
+            if summary['errors']:
+                print(f"WARNING: {len(summary['errors'])} files could not be loaded and were skipped")
+            print(f"Total chunks embedded for {session}: {summary['chunks_added']}")
+
+        if not indexed:
+            print("ERROR: No documents found to index")
+            exit(1)
 
         print("SUCCESS: RAG indexing process completed successfully!")
-        print(f"Total documents processed: {len(documents)}")
         print("Bot is ready to answer questions based on loaded documents!")
 
     except ConfigurationException as e:
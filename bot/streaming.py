@@ -0,0 +1,52 @@
+import re
+
+from config.config import Config
+
+
+SENTENCE_END_PATTERN = re.compile(r'[.!?…](?=\s)')
+WHITESPACE_PATTERN = re.compile(r'\s')
+
+
+class SegmentSplitter:
+
+    def __init__(self, min_chars=None, max_chars=None):
+        self.__min_chars = min_chars or Config.STREAMING_MIN_SEGMENT_CHARS
+        self.__max_chars = max_chars or Config.STREAMING_MAX_SEGMENT_CHARS
+        self.__buffer = ''
+
+    def __find_cut(self):
+        # Prefer the last paragraph break, so one message carries as many whole paragraphs as are ready
+        cut = self.__buffer.rfind('\n\n', 0, self.__max_chars)
+        if cut >= self.__min_chars:
+            return cut
+
+        if len(self.__buffer) < self.__max_chars:
+            return None
+
+        # A single paragraph grew too long, fall back to the last sentence end, then the last word break
+        for pattern in (SENTENCE_END_PATTERN, WHITESPACE_PATTERN):
+            ends = [match.end() for match in pattern.finditer(self.__buffer, self.__min_chars, self.__max_chars)]
+            if ends:
+                return ends[-1]
+
+        # No break at all, e.g. a long URL, so the limit is still respected
+        return self.__max_chars
+
+    def feed(self, text):
+        self.__buffer += text
+        segments = []
+
+        cut = self.__find_cut()
+        while cut is not None:
+            segment = self.__buffer[:cut].strip()
+            self.__buffer = self.__buffer[cut:].lstrip()
+            if segment:
+                segments.append(segment)
+            cut = self.__find_cut()
+
+        return segments
+
+    def flush(self):
+        segment = self.__buffer.strip()
+        self.__buffer = ''
+        return [segment] if segment else []
@@ -0,0 +1,37 @@
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+# Rough per-message overhead of the chat format (role markers and separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        # The BPE files are downloaded on first use, fall back to an estimate when offline
+        logger.warning(f"Error loading tokenizer for {model_name}, using character estimate: {e}")
+        return None
+
+
+def count_tokens(text, model_name=None):
+    encoding = get_encoding(model_name or Config.OPENAI_MODEL)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message, model_name=None):
+    return count_tokens(message.content, model_name) + MESSAGE_TOKEN_OVERHEAD
@@ -0,0 +1,26 @@
+from bot.vector_stores.chroma import ChromaVectorStore
+from bot.vector_stores.flat import FlatVectorStore, build_flat_index, get_flat_index_version
+from exceptions.exceptions import ConfigurationException
+from config.config import Config
+
+
+def build_vector_store(persist_directory=None, embedding=None, backend=None):
+    persist_directory = persist_directory or Config.CHROMA_PERSIST_DIR
+    backend = backend or Config.VECTOR_STORE_BACKEND
+
+    if backend == 'chroma':
+        return ChromaVectorStore(persist_directory=persist_directory, embedding_function=embedding)
+
+    if backend == 'flat':
+        return FlatVectorStore(persist_directory=persist_directory, embedding=embedding)
+
+    raise ConfigurationException(f"Unknown vector store backend {backend}")
+
+
+__all__ = [
+    'ChromaVectorStore',
+    'FlatVectorStore',
+    'build_flat_index',
+    'build_vector_store',
+    'get_flat_index_version',
+]
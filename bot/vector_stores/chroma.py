@@ -0,0 +1,55 @@
+import os
+import logging
+
+import chromadb
+from chromadb.api.shared_system_client import SharedSystemClient
+from langchain_chroma import Chroma
+
+
+logger = logging.getLogger(__name__)
+
+
+# chromadb has no public way to close one persistent client, release() relies on its shared system cache.
+# Checked against these releases, others are still tried but warned about
+RELEASE_TESTED_VERSIONS = ('1.0.',)
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+
+class ChromaVectorStore(Chroma):
+
+    def warm_up(self):
+        # Opens the persisted collection so the first question doesn't pay for it
+        self.get(limit=1, include=[])
+
+    def resident_bytes(self):
+        # On-disk size of the collection is the estimate, Chroma maps about that much once queried
+        return directory_size(self._client.get_settings().persist_directory)
+
+    def release(self):
+        # Chroma caches one system per persist directory for the whole process, dropping it frees the index.
+        # clear_system_cache() would drop every tenant's system at once, and reset() deletes the data
+        if not chromadb.__version__.startswith(RELEASE_TESTED_VERSIONS):
+            logger.warning(f'Releasing a Chroma index on untested chromadb {chromadb.__version__}')
+
+        systems = getattr(SharedSystemClient, '_identifier_to_system', None)
+        identifier = getattr(self._client, '_identifier', None)
+        if not isinstance(systems, dict) or identifier is None:
+            logger.warning(
+                f'chromadb {chromadb.__version__} changed its client cache, the index stays in memory until restart',
+                extra={'persist_directory': self._client.get_settings().persist_directory},
+            )
+            return
+
+        system = systems.pop(identifier, None)
+        if system is not None:
+            system.stop()
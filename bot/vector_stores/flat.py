@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+from bot.index_files import write_json_atomic, read_index_version
+from exceptions.exceptions import VectorStoreException
+from config.config import Config
+
+
+FLAT_INDEX_FILE = 'flat_index.json'
+FLAT_VECTORS_PREFIX = 'flat_vectors-'
+FLAT_INT8_PREFIX = 'flat_int8-'
+FLAT_BINARY_PREFIX = 'flat_binary-'
+FLAT_PREFIXES = (FLAT_VECTORS_PREFIX, FLAT_INT8_PREFIX, FLAT_BINARY_PREFIX)
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(matrix):
+    # One scale per dimension, the query is multiplied by it so the codes are dotted as they are
+    scales = np.abs(matrix).max(axis=0) / 127.0 if len(matrix) else np.ones(matrix.shape[1], dtype=np.float32)
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(matrix):
+    # Sign bits, eight dimensions per byte, compared by Hamming distance
+    return np.packbits(matrix > 0, axis=1)
+
+
+def build_flat_index(records, index_version=None, persist_directory=None, dtype=None):
+    if persist_directory is None:
+        persist_directory = Config.CHROMA_PERSIST_DIR
+    dtype = dtype or Config.VECTOR_STORE_FLAT_DTYPE
+
+    ids = []
+    texts = []
+    metadatas = []
+    vectors = []
+    for doc_id, text, metadata, embedding in records:
+        ids.append(doc_id)
+        texts.append(text or '')
+        metadatas.append(metadata or {})
+        vectors.append(np.asarray(embedding, dtype=np.float32))
+
+    # Rows are stored unit length, so a dot product with the normalized query is the cosine similarity
+    matrix = normalize_rows(np.vstack(vectors)) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    codes, scales = quantize_int8(matrix)
+
+    # Each build writes new vector files, processes still mapping the old ones keep reading them
+    generation = time.time_ns()
+    files = {
+        'vectors_file': (f'{FLAT_VECTORS_PREFIX}{generation}.npy', matrix.astype(dtype)),
+        'int8_file': (f'{FLAT_INT8_PREFIX}{generation}.npy', codes),
+        'binary_file': (f'{FLAT_BINARY_PREFIX}{generation}.npy', quantize_binary(matrix)),
+    }
+    index = {
+        'index_version': index_version,
+        **{key: name for key, (name, _) in files.items()},
+        'int8_scales': scales.tolist(),
+        'dtype': dtype,
+        'count': len(ids),
+        'dimensions': matrix.shape[1],
+        'ids': ids,
+        'texts': texts,
+        'metadatas': metadatas,
+    }
+
+    index_path = os.path.join(persist_directory, FLAT_INDEX_FILE)
+    try:
+        os.makedirs(persist_directory, exist_ok=True)
+        for name, array in files.values():
+            with open(os.path.join(persist_directory, name), 'wb') as file:
+                np.save(file, array)
+
+        write_json_atomic(index_path, index, separators=(',', ':'))
+
+        current = {name for name, _ in files.values()}
+        for name in os.listdir(persist_directory):
+            if name.startswith(FLAT_PREFIXES) and name not in current:
+                os.remove(os.path.join(persist_directory, name))
+    except Exception as e:
+        raise VectorStoreException(f"Error writing flat index {index_path}: {str(e)}") from e
+
+    print(f"Flat index built: {len(ids)} vectors, {matrix.shape[1]} dimensions, {dtype}")
+    return len(ids)
+
+
+def get_flat_index_version(persist_directory=None):
+    if persist_directory is None:
+        persist_directory = Config.CHROMA_PERSIST_DIR
+
+    return read_index_version(os.path.join(persist_directory, FLAT_INDEX_FILE))
+
+
+class FlatVectorStore(VectorStore):
+    # Exact cosine search over a memory-mapped matrix, worker processes share its pages through the OS cache.
+    # With quantization the scan reads the compact codes and only the best candidates are re-scored exactly
+
+    def __init__(self, persist_directory=None, embedding=None, block_rows=None, quantization=None, rescore_factor=None):
+        self.__persist_directory = persist_directory or Config.CHROMA_PERSIST_DIR
+        self.__index_path = os.path.join(self.__persist_directory, FLAT_INDEX_FILE)
+        self.__embedding = embedding
+        self.__block_rows = block_rows or Config.VECTOR_STORE_BLOCK_ROWS
+        self.__quantization = quantization or Config.VECTOR_STORE_QUANTIZATION
+        self.__rescore_factor = rescore_factor or Config.VECTOR_STORE_RESCORE_FACTOR
+        self.__lock = threading.Lock()
+        self.__mtime = -1
+        self.__state = None
+
+    @property
+    def embeddings(self):
+        return self.__embedding
+
+    def __load_state(self):
+        with open(self.__index_path, 'r', encoding='utf-8') as file:
+            index = json.load(file)
+
+        vectors = self.__load_array(index, 'vectors_file')
+        codes = None
+        if self.__quantization != 'none':
+            file_key = f'{self.__quantization}_file'
+            if file_key not in index:
+                raise VectorStoreException(
+                    f"Flat index has no {self.__quantization} codes, rebuild it with python -m bot.vector_stores.migrate"
+                )
+            codes = self.__load_array(index, file_key)
+
+        positions = {doc_id: position for position, doc_id in enumerate(index['ids'])}
+        return {
+            'ids': index['ids'],
+            'texts': index['texts'],
+            'metadatas': index['metadatas'],
+            'positions': positions,
+            'vectors': vectors,
+            'codes': codes,
+            'scales': np.asarray(index.get('int8_scales', []), dtype=np.float32),
+            'index_bytes': os.path.getsize(self.__index_path),
+        }
+
+    def __load_array(self, index, file_key):
+        if not index['count']:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.load(os.path.join(self.__persist_directory, index[file_key]), mmap_mode='r')
+
+    def __current(self):
+        # The indexer swaps the files atomically, reload whenever the index file changes on disk
+        try:
+            mtime = os.stat(self.__index_path).st_mtime_ns
+        except FileNotFoundError as e:
+            raise VectorStoreException(
+                f"Flat index not found at {self.__index_path}, build it with python -m bot.vector_stores.migrate"
+            ) from e
+
+        if mtime != self.__mtime:
+            with self.__lock:
+                if mtime != self.__mtime:
+                    try:
+                        self.__state = self.__load_state()
+                    except Exception as e:
+                        raise VectorStoreException(f"Error loading flat index {self.__index_path}: {str(e)}") from e
+                    self.__mtime = mtime
+
+        # Searches keep the snapshot they started with, even if a reload swaps it meanwhile
+        return self.__state
+
+    def __normalize(self, embedding):
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return query / norm if norm else query
+
+    def __scores(self, state, query):
+        vectors = state['vectors']
+        scores = np.empty(len(vectors), dtype=np.float32)
+        # Blocks bound the float32 copy a float16 index needs, float32 blocks are plain views
+        for start in range(0, len(vectors), self.__block_rows):
+            block = np.asarray(vectors[start:start + self.__block_rows], dtype=np.float32)
+            np.dot(block, query, out=scores[start:start + len(block)])
+        return scores
+
+    def __approximate_scores(self, state, query):
+        codes = state['codes']
+        scores = np.empty(len(codes), dtype=np.float32)
+        if self.__quantization == 'int8':
+            query = query * state['scales']
+            for start in range(0, len(codes), self.__block_rows):
+                block = codes[start:start + self.__block_rows].astype(np.float32)
+                np.dot(block, query, out=scores[start:start + len(block)])
+            return scores
+
+        # Fewer differing sign bits means a closer vector, negated so higher is better like the exact scores
+        query_bits = quantize_binary(query[np.newaxis, :])[0]
+        for start in range(0, len(codes), self.__block_rows):
+            distances = np.bitwise_count(codes[start:start + self.__block_rows] ^ query_bits).sum(axis=1)
+            scores[start:start + len(distances)] = distances
+        return np.negative(scores, out=scores)
+
+    def __top(self, scores, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.array([], dtype=np.int64)
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def __search(self, state, embedding, k):
+        query = self.__normalize(embedding)
+        candidate_count = k * self.__rescore_factor
+        if state['codes'] is None or candidate_count >= len(state['ids']):
+            scores = self.__scores(state, query)
+            top = self.__top(scores, k)
+            return top, scores[top]
+
+        # Sorted positions read the mapped full-precision file front to back, only their pages are touched
+        candidates = np.sort(self.__top(self.__approximate_scores(state, query), candidate_count))
+        exact = np.asarray(state['vectors'][candidates], dtype=np.float32) @ query
+        top = self.__top(exact, k)
+        return candidates[top], exact[top]
+
+    def __document(self, state, position):
+        return Document(
+            id=state['ids'][position],
+            page_content=state['texts'][position],
+            metadata=state['metadatas'][position],
+        )
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        state = self.__current()
+        positions, scores = self.__search(state, embedding, k)
+        return [(self.__document(state, position), float(score)) for position, score in zip(positions, scores)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.__embedding.embed_query(query), k=k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.__embedding.embed_query(query), k=k)
+
+    def _select_relevance_score_fn(self):
+        # Scores already are cosine similarities, mapped from [-1, 1] to [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        state = self.__current()
+        # Sorted positions read the mapped file front to back, MMR doesn't depend on their order
+        candidates = np.sort(self.__search(state, embedding, fetch_k)[0])
+        if not len(candidates):
+            return []
+
+        candidate_vectors = np.asarray(state['vectors'][candidates], dtype=np.float32)
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32),
+            candidate_vectors,
+            lambda_mult=lambda_mult,
+            k=k,
+        )
+        return [self.__document(state, candidates[index]) for index in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.__embedding.embed_query(query),
+            k=k,
+            fetch_k=fetch_k,
+            lambda_mult=lambda_mult,
+        )
+
+    def get_by_ids(self, ids):
+        state = self.__current()
+        positions = state['positions']
+        return [self.__document(state, positions[doc_id]) for doc_id in ids if doc_id in positions]
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise VectorStoreException("The flat index is read-only, rebuild it with python -m bot.vector_stores.migrate")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+        texts = list(texts)
+        ids = ids or [str(index) for index in range(len(texts))]
+        metadatas = metadatas or [{} for _ in texts]
+        build_flat_index(
+            zip(ids, texts, metadatas, embedding.embed_documents(texts)),
+            persist_directory=persist_directory,
+        )
+        return cls(persist_directory=persist_directory, embedding=embedding)
+
+    def warm_up(self):
+        # Faults the scanned matrix in once, other processes then find the pages already cached
+        vectors = self.__scanned(self.__current())
+        for start in range(0, len(vectors), self.__block_rows):
+            np.asarray(vectors[start:start + self.__block_rows]).sum()
+
+    def __scanned(self, state):
+        return state['vectors'] if state['codes'] is None else state['codes']
+
+    def resident_bytes(self):
+        # Every search reads the whole scanned matrix, re-scoring only pages in a few full-precision rows
+        state = self.__current()
+        return int(self.__scanned(state).nbytes) + state['index_bytes']
+
+    def stats(self):
+        state = self.__current()
+        vector_bytes = int(state['vectors'].nbytes)
+        scanned_bytes = int(self.__scanned(state).nbytes)
+        return {
+            'count': len(state['ids']),
+            'quantization': self.__quantization,
+            'rescore_factor': self.__rescore_factor,
+            'vector_bytes': vector_bytes,
+            'scanned_bytes': scanned_bytes,
+            'savings': round(1 - scanned_bytes / vector_bytes, 4) if vector_bytes else 0.0,
+        }
+
+    def release(self):
+        with self.__lock:
+            self.__state = None
+            self.__mtime = -1
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from bot.rag import get_index_version, sync_flat_index
+from bot.vector_stores.chroma import ChromaVectorStore
+from bot.vector_stores.flat import FLAT_INDEX_FILE, FlatVectorStore
+from services.tenants import load_tenants
+from exceptions.exceptions import RAGException
+from config.config import Config
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export Chroma collections to the memory-mapped flat index')
+    parser.add_argument(
+        '--persist-directory',
+        action='append',
+        help='Chroma directory to export, repeatable (default: every tenant, or CHROMA_PERSIST_DIR)',
+    )
+    parser.add_argument('--dtype', choices=('float32', 'float16'), help='overrides VECTOR_STORE_FLAT_DTYPE')
+    parser.add_argument(
+        '--evaluate',
+        type=int,
+        metavar='QUERIES',
+        help='after exporting, report memory savings and recall@k of the quantized indexes using QUERIES stored chunks',
+    )
+    parser.add_argument('--k', type=int, default=Config.RAG_SEARCH_K, help='results per query for --evaluate')
+    return parser.parse_args()
+
+
+def migrate(persist_directory):
+    started = time.perf_counter()
+    vector_store = ChromaVectorStore(persist_directory=persist_directory)
+    try:
+        print(f"Exporting {vector_store._collection.count()} chunks from {persist_directory}")
+        sync_flat_index(vector_store, get_index_version(persist_directory), persist_directory, force=True)
+    finally:
+        vector_store.release()
+    print(f"Done in {time.perf_counter() - started:.2f}s")
+
+
+def evaluate(persist_directory, queries, k):
+    with open(os.path.join(persist_directory, FLAT_INDEX_FILE), 'r', encoding='utf-8') as file:
+        index = json.load(file)
+    if not index['count']:
+        return
+
+    # Stored chunks stand in for questions, their exact neighbours are the reference
+    vectors = np.load(os.path.join(persist_directory, index['vectors_file']), mmap_mode='r')
+    picked = np.random.default_rng(0).choice(index['count'], min(queries, index['count']), replace=False)
+    samples = [np.asarray(vectors[position], dtype=np.float32).tolist() for position in picked]
+
+    exact = FlatVectorStore(persist_directory=persist_directory, quantization='none')
+    truth = [{doc.id for doc in exact.similarity_search_by_vector(sample, k=k)} for sample in samples]
+    exact.release()
+
+    for quantization in ('int8', 'binary'):
+        vector_store = FlatVectorStore(persist_directory=persist_directory, quantization=quantization)
+        hits = sum(
+            len({doc.id for doc in vector_store.similarity_search_by_vector(sample, k=k)} & expected)
+            for sample, expected in zip(samples, truth)
+        )
+        stats = vector_store.stats()
+        vector_store.release()
+        print(
+            f"{quantization}: scans {stats['scanned_bytes']} of {stats['vector_bytes']} bytes "
+            f"({stats['savings']:.1%} saved), recall@{k} {hits / sum(len(expected) for expected in truth):.4f}"
+        )
+
+
+def main():
+    args = parse_args()
+    if args.dtype:
+        Config.VECTOR_STORE_FLAT_DTYPE = args.dtype
+
+    directories = args.persist_directory or [tenant['persist_directory'] for tenant in load_tenants().values()]
+    try:
+        for persist_directory in directories:
+            migrate(persist_directory)
+            if args.evaluate:
+                evaluate(persist_directory, args.evaluate, args.k)
+    except RAGException as e:
+        print(f"MIGRATION ERROR: {e}")
+        exit(1)
+
+    print("Set VECTOR_STORE_BACKEND=flat to serve queries from the flat index")
+
+
+if __name__ == '__main__':
+    main()
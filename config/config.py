@@ -11,23 +11,152 @@ class Config:
     OPENAI_EMBEDDING_MODEL = 'text-embedding-3-small'
 
     # RAG
-    RAG_SEARCH_K = 30
+    RAG_SEARCH_K = 8
+    RAG_HYBRID_CANDIDATES = config('RAG_HYBRID_CANDIDATES', default=20, cast=int)
+    RAG_BM25_ENABLED = config('RAG_BM25_ENABLED', default=True, cast=bool)
+    RAG_BM25_K1 = config('RAG_BM25_K1', default=1.5, cast=float)
+    RAG_BM25_B = config('RAG_BM25_B', default=0.75, cast=float)
+    RAG_RRF_K = config('RAG_RRF_K', default=60, cast=int)
+    RAG_FETCH_K = config('RAG_FETCH_K', default=40, cast=int)
+    RAG_MMR_ENABLED = config('RAG_MMR_ENABLED', default=True, cast=bool)
+    RAG_MMR_LAMBDA = config('RAG_MMR_LAMBDA', default=0.7, cast=float)
+    RAG_DEDUP_SIMILARITY = config('RAG_DEDUP_SIMILARITY', default=0.85, cast=float)
+    RAG_CONTEXT_TOKEN_BUDGET = config('RAG_CONTEXT_TOKEN_BUDGET', default=3000, cast=int)
+    RAG_RERANK_ENABLED = config('RAG_RERANK_ENABLED', default=False, cast=bool)
+    RAG_RERANK_MODEL = config('RAG_RERANK_MODEL', default='cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
     RAG_CHUNK_SIZE = 1000
     RAG_CHUNK_OVERLAP = 200
     RAG_DATA_DIR = '/app/data/documents'
     CHROMA_PERSIST_DIR = '/app/data/chroma_data'
+    VECTOR_STORE_BACKEND = config('VECTOR_STORE_BACKEND', default='chroma')  # 'chroma' or 'flat'
+    VECTOR_STORE_FLAT_DTYPE = config('VECTOR_STORE_FLAT_DTYPE', default='float32')  # 'float32' or 'float16'
+    VECTOR_STORE_QUANTIZATION = config('VECTOR_STORE_QUANTIZATION', default='none')  # 'none', 'int8' or 'binary'
+    VECTOR_STORE_RESCORE_FACTOR = config('VECTOR_STORE_RESCORE_FACTOR', default=8, cast=int)
+    VECTOR_STORE_BLOCK_ROWS = 512  # small enough that converted blocks stay in the CPU cache
+    RAG_LOADER_WORKERS = config('RAG_LOADER_WORKERS', default=0, cast=int)  # 0 uses every CPU core
+    RAG_EMBEDDING_BATCH_SIZE = config('RAG_EMBEDDING_BATCH_SIZE', default=128, cast=int)
+    RAG_EMBEDDING_CONCURRENCY = config('RAG_EMBEDDING_CONCURRENCY', default=4, cast=int)
+    RAG_EMBEDDING_MAX_RETRIES = config('RAG_EMBEDDING_MAX_RETRIES', default=6, cast=int)
+    RAG_EMBEDDING_BACKOFF_SECONDS = config('RAG_EMBEDDING_BACKOFF_SECONDS', default=1.0, cast=float)
+    RAG_EMBEDDING_MAX_BACKOFF_SECONDS = config('RAG_EMBEDDING_MAX_BACKOFF_SECONDS', default=60.0, cast=float)
+
+    # Query embedding cache
+    EMBEDDING_CACHE_ENABLED = config('EMBEDDING_CACHE_ENABLED', default=True, cast=bool)
+    EMBEDDING_CACHE_SIZE = config('EMBEDDING_CACHE_SIZE', default=10000, cast=int)
+    EMBEDDING_CACHE_TTL = config('EMBEDDING_CACHE_TTL', default=3600, cast=int)
+    EMBEDDING_CACHE_REDIS_TTL = config('EMBEDDING_CACHE_REDIS_TTL', default=604800, cast=int)  # 7 days
+    EMBEDDING_CACHE_KEY_PREFIX = 'embedding_cache:'
+
+    # Semantic answer cache
+    ANSWER_CACHE_ENABLED = config('ANSWER_CACHE_ENABLED', default=False, cast=bool)
+    ANSWER_CACHE_SIMILARITY = config('ANSWER_CACHE_SIMILARITY', default=0.95, cast=float)
+    ANSWER_CACHE_MAX_HISTORY_MESSAGES = config('ANSWER_CACHE_MAX_HISTORY_MESSAGES', default=0, cast=int)
+    ANSWER_CACHE_MAX_ENTRIES = config('ANSWER_CACHE_MAX_ENTRIES', default=5000, cast=int)
+    ANSWER_CACHE_TTL = config('ANSWER_CACHE_TTL', default=86400, cast=int)  # 1 day
+    ANSWER_CACHE_REFRESH_SECONDS = 30
+    ANSWER_CACHE_KEY_PREFIX = 'answer_cache:'
+
+    # Response scheduler
+    SCHEDULER_MAX_CONCURRENCY = config('SCHEDULER_MAX_CONCURRENCY', default=20, cast=int)
+    SCHEDULER_MAX_QUEUE = config('SCHEDULER_MAX_QUEUE', default=200, cast=int)
+    SCHEDULER_OVERFLOW_POLICY = config('SCHEDULER_OVERFLOW_POLICY', default='retry')  # 'retry' or 'busy'
+    SCHEDULER_RETRY_SECONDS = config('SCHEDULER_RETRY_SECONDS', default=15, cast=float)
+    SCHEDULER_BUSY_MESSAGE = config(
+        'SCHEDULER_BUSY_MESSAGE',
+        default='Estamos com muitas mensagens no momento. Por favor, tente novamente em alguns minutos.',
+    )
+
+    # Observability
+    LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+    LOG_LEVELS = config('LOG_LEVELS', default='')  # per module, e.g. "bot.ai_bot=DEBUG,services.debounce=WARNING"
+    LOG_FORMAT = config('LOG_FORMAT', default='json')  # 'json' or 'text'
+    LOG_SAMPLE_RATES = config('LOG_SAMPLE_RATES', default='')  # per level, e.g. "DEBUG=0.05,INFO=0.5"
+    LOG_BODY_MODE = config('LOG_BODY_MODE', default='truncate')  # 'full', 'truncate' or 'redact'
+    LOG_BODY_MAX_CHARS = config('LOG_BODY_MAX_CHARS', default=120, cast=int)
+    LOG_BODY_FIELDS = ('body', 'question', 'answer')
+    TRACING_ENABLED = config('TRACING_ENABLED', default=False, cast=bool)
+    TRACING_SERVICE_NAME = config('TRACING_SERVICE_NAME', default='whatsapp-ai-chatbot')
+
+    # Streaming
+    STREAMING_ENABLED = config('STREAMING_ENABLED', default=False, cast=bool)
+    STREAMING_MIN_SEGMENT_CHARS = config('STREAMING_MIN_SEGMENT_CHARS', default=200, cast=int)
+    STREAMING_MAX_SEGMENT_CHARS = config('STREAMING_MAX_SEGMENT_CHARS', default=1000, cast=int)
 
     # Waha
     WAHA_API_URL = 'http://waha:3000'
     WAHA_SESSION = 'default'
+    WAHA_TIMEOUT = config('WAHA_TIMEOUT', default=30, cast=float)
+    WAHA_CONNECT_TIMEOUT = config('WAHA_CONNECT_TIMEOUT', default=5, cast=float)
+    WAHA_MAX_CONNECTIONS = config('WAHA_MAX_CONNECTIONS', default=100, cast=int)
+    WAHA_MAX_KEEPALIVE_CONNECTIONS = config('WAHA_MAX_KEEPALIVE_CONNECTIONS', default=20, cast=int)
+    WAHA_KEEPALIVE_EXPIRY = config('WAHA_KEEPALIVE_EXPIRY', default=30, cast=float)
 
     # Redis
     REDIS_URL = 'redis://redis:6379'
     BUFFER_KEY_SUFIX = ':buffer'
-    DEBOUNCE_SECONDS = 10
+    INFLIGHT_KEY_SUFIX = ':inflight'
+    BUFFER_STARTED_KEY_SUFIX = ':buffer_started'
+    BUFFER_TRACES_KEY_SUFIX = ':buffer_traces'
+    DEBOUNCE_SECONDS = 10  # upper bound of the adaptive delay, the fixed delay when adaptive is off
+    DEBOUNCE_ADAPTIVE = config('DEBOUNCE_ADAPTIVE', default=True, cast=bool)
+    DEBOUNCE_MIN_SECONDS = config('DEBOUNCE_MIN_SECONDS', default=1.5, cast=float)
+    DEBOUNCE_MAX_WAIT_SECONDS = config('DEBOUNCE_MAX_WAIT_SECONDS', default=20, cast=float)
+    DEBOUNCE_INITIAL_CADENCE_SECONDS = config('DEBOUNCE_INITIAL_CADENCE_SECONDS', default=3.0, cast=float)
+    DEBOUNCE_CADENCE_MULTIPLIER = config('DEBOUNCE_CADENCE_MULTIPLIER', default=2.0, cast=float)
+    DEBOUNCE_CADENCE_ALPHA = 0.3
+    DEBOUNCE_BURST_GAP_SECONDS = 30
+    DEBOUNCE_QUESTION_FACTOR = 0.25
+    DEBOUNCE_SENTENCE_FACTOR = 0.5
+    DEBOUNCE_CONTINUATION_FACTOR = 1.5
+    DEBOUNCE_CADENCE_KEY_PREFIX = 'debounce:cadence:'
+    DEBOUNCE_CADENCE_TTL = 604800  # 7 days
+    DEBOUNCE_DUE_KEY = 'debounce:due'
+    DEBOUNCE_PROCESSING_KEY = 'debounce:processing'
+    DEBOUNCE_DEFERRED_KEY = 'debounce:deferred'  # due while another worker still answers them
+    DEBOUNCE_POLL_INTERVAL = config('DEBOUNCE_POLL_INTERVAL', default=0.25, cast=float)
+    DEBOUNCE_CLAIM_BATCH = config('DEBOUNCE_CLAIM_BATCH', default=50, cast=int)
+    DEBOUNCE_MAX_ACTIVE = config('DEBOUNCE_MAX_ACTIVE', default=500, cast=int)
+    DEBOUNCE_LEASE_SECONDS = config('DEBOUNCE_LEASE_SECONDS', default=120, cast=int)
+    DEBOUNCE_SHUTDOWN_GRACE_SECONDS = config('DEBOUNCE_SHUTDOWN_GRACE_SECONDS', default=25, cast=float)
     BUFFER_TTL = 300
+    REPLY_MAX_RETRIES = config('REPLY_MAX_RETRIES', default=3, cast=int)
+    REPLY_RETRY_SECONDS = config('REPLY_RETRY_SECONDS', default=5.0, cast=float)  # doubled on every retry
+    REPLY_ATTEMPTS_KEY_SUFIX = ':reply_attempts'
+    WEBHOOK_DEDUP_KEY_PREFIX = 'webhook:seen:'
+    WEBHOOK_DEDUP_TTL = config('WEBHOOK_DEDUP_TTL', default=86400, cast=int)
+    BUFFER_ENTRIES_KEY_SUFIX = ':buffer_entries'
+    INFLIGHT_ENTRIES_KEY_SUFIX = ':inflight_entries'
     MAX_HISTORY_MESSAGES = 100
     HISTORY_TTL_HOURS = 168  # 7 days
+    HISTORY_TOKEN_BUDGET = config('HISTORY_TOKEN_BUDGET', default=2000, cast=int)
+    HISTORY_SUMMARY_ENABLED = config('HISTORY_SUMMARY_ENABLED', default=True, cast=bool)
+    HISTORY_SUMMARY_MIN_MESSAGES = config('HISTORY_SUMMARY_MIN_MESSAGES', default=6, cast=int)
+    HISTORY_SUMMARY_MAX_TOKENS = config('HISTORY_SUMMARY_MAX_TOKENS', default=400, cast=int)
+    HISTORY_SUMMARY_LOCK_SECONDS = 120
+    HISTORY_COUNT_KEY_PREFIX = 'message_count:'
+    HISTORY_SUMMARY_KEY_PREFIX = 'history_summary:'
+
+    # Worker mode: the API only appends to the ingest stream, `python -m worker` processes answer
+    WORKER_MODE = config('WORKER_MODE', default=False, cast=bool)
+    INGEST_STREAM_KEY = 'chatbot:ingest'
+    INGEST_STREAM_MAXLEN = config('INGEST_STREAM_MAXLEN', default=100000, cast=int)
+    INGEST_CONSUMER_GROUP = 'chatbot-workers'
+    WORKER_CONSUMER_NAME = config('WORKER_CONSUMER_NAME', default='')  # hostname-pid when empty
+    WORKER_READ_COUNT = config('WORKER_READ_COUNT', default=100, cast=int)
+    WORKER_BLOCK_MS = config('WORKER_BLOCK_MS', default=1000, cast=int)
+    WORKER_CLAIM_IDLE_MS = config('WORKER_CLAIM_IDLE_MS', default=60000, cast=int)
+    WORKER_CLAIM_INTERVAL = config('WORKER_CLAIM_INTERVAL', default=15, cast=float)
+    WORKER_METRICS_PORT = config('WORKER_METRICS_PORT', default=0, cast=int)  # 0 disables, one port per process on a shared host
+    WORKER_METRICS_REFRESH_SECONDS = 5
+
+    # Service startup, transient OpenAI or Chroma errors at boot are retried before giving up
+    STARTUP_MAX_ATTEMPTS = config('STARTUP_MAX_ATTEMPTS', default=5, cast=int)
+    STARTUP_BACKOFF_SECONDS = config('STARTUP_BACKOFF_SECONDS', default=2.0, cast=float)
+    STARTUP_MAX_BACKOFF_SECONDS = 30
+
+    # Tenants
+    TENANTS_FILE = config('TENANTS_FILE', default='')  # JSON mapping WAHA sessions to knowledge bases
+    TENANT_MEMORY_BUDGET_MB = config('TENANT_MEMORY_BUDGET_MB', default=2048, cast=int)
 
     @classmethod
     def validate(cls):
@@ -46,6 +175,40 @@ class Config:
         if cls.OPENAI_TEMPERATURE < 0 or cls.OPENAI_TEMPERATURE > 2:
             raise ConfigurationException(f"OPENAI_TEMPERATURE must be between 0 and 2, got {cls.OPENAI_TEMPERATURE}")
 
+        if cls.ANSWER_CACHE_SIMILARITY <= 0 or cls.ANSWER_CACHE_SIMILARITY > 1:
+            raise ConfigurationException(f"ANSWER_CACHE_SIMILARITY must be in (0, 1], got {cls.ANSWER_CACHE_SIMILARITY}")
+
+        if cls.VECTOR_STORE_BACKEND not in ('chroma', 'flat'):
+            raise ConfigurationException(f"VECTOR_STORE_BACKEND must be 'chroma' or 'flat', got {cls.VECTOR_STORE_BACKEND}")
+
+        if cls.VECTOR_STORE_FLAT_DTYPE not in ('float32', 'float16'):
+            raise ConfigurationException(
+                f"VECTOR_STORE_FLAT_DTYPE must be 'float32' or 'float16', got {cls.VECTOR_STORE_FLAT_DTYPE}"
+            )
+
+        if cls.VECTOR_STORE_QUANTIZATION not in ('none', 'int8', 'binary'):
+            raise ConfigurationException(
+                f"VECTOR_STORE_QUANTIZATION must be 'none', 'int8' or 'binary', got {cls.VECTOR_STORE_QUANTIZATION}"
+            )
+
+        if cls.VECTOR_STORE_RESCORE_FACTOR < 1:
+            raise ConfigurationException(
+                f"VECTOR_STORE_RESCORE_FACTOR must be at least 1, got {cls.VECTOR_STORE_RESCORE_FACTOR}"
+            )
+
+        if cls.SCHEDULER_OVERFLOW_POLICY not in ('retry', 'busy'):
+            raise ConfigurationException(
+                f"SCHEDULER_OVERFLOW_POLICY must be 'retry' or 'busy', got {cls.SCHEDULER_OVERFLOW_POLICY}"
+            )
+
+        if not 0 < cls.DEBOUNCE_MIN_SECONDS <= cls.DEBOUNCE_SECONDS <= cls.DEBOUNCE_MAX_WAIT_SECONDS:
+            raise ConfigurationException(
+                "Debounce settings must satisfy 0 < DEBOUNCE_MIN_SECONDS <= DEBOUNCE_SECONDS <= DEBOUNCE_MAX_WAIT_SECONDS"
+            )
+
+        if cls.LOG_BODY_MODE not in ('full', 'truncate', 'redact'):
+            raise ConfigurationException(f"LOG_BODY_MODE must be 'full', 'truncate' or 'redact', got {cls.LOG_BODY_MODE}")
+
     @classmethod
     def setup_environment(cls):
         import os
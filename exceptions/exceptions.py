@@ -33,6 +33,11 @@ class BufferException(WhatsAppAIChatbotException):
     pass
 
 
+class SchedulerOverloadedException(BufferException):
+    """Exception raised when the response scheduler queue is full"""
+    pass
+
+
 class ConfigurationException(WhatsAppAIChatbotException):
     """Exception raised for configuration-related errors"""
     pass
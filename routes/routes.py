@@ -1,49 +1,112 @@
-from fastapi import APIRouter, HTTPException, Request
+import logging
+
+import orjson
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
 from services.message_buffer import (
     buffer_message,
     cleanup_expired_tasks,
     get_buffer_status,
     clear_chat_history,
-    get_chat_history
+    get_chat_history,
+    refresh_queue_metrics
 )
-from services.memory import get_history_stats
+from services.ingest_stream import enqueue_message
+from services.memory import aget_history_stats
+from services.registry import registry
+from services.tenants import get_tenants, build_chat_key
+from services.redis_client import redis_client
+from services.scheduler import response_scheduler
+from services.metrics import MESSAGES_DROPPED, track_stage, record_error, render_metrics
 from exceptions.exceptions import (
     WhatsAppAIChatbotException,
     MemoryException,
     BufferException,
     WahaException
 )
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
 
 
 router = APIRouter()
 
 
+# WAHA sends "message" for incoming messages only, "message.any" also echoes our own
+MESSAGE_EVENTS = {'message', 'message.any'}
+
+
+def ignored(reason, description):
+    MESSAGES_DROPPED.labels(reason=reason).inc()
+    return ORJSONResponse({'status': 'success', 'message': f'{description} ignored.'})
+
+
 @router.post('/chatbot/webhook/', tags=["Webhook"])
 async def webhook(request: Request):
     try:
-        data = await request.json()
+        with track_stage('webhook'):
+            try:
+                data = orjson.loads(await request.body())
+            except orjson.JSONDecodeError:
+                raise HTTPException(status_code=400, detail="Invalid JSON body")
+
+            if not isinstance(data, dict) or 'payload' not in data:
+                raise HTTPException(status_code=400, detail="Missing payload in request")
+
+            # Everything below is dropped without touching Redis
+            event = data.get('event')
+            if event is not None and event not in MESSAGE_EVENTS:
+                return ignored('event', f'Event {event}')
+
+            payload = data['payload']
+            if 'from' not in payload or 'body' not in payload:
+                raise HTTPException(status_code=400, detail="Missing required fields in payload")
+
+            if payload.get('fromMe'):
+                return ignored('own_message', 'Own message')
+
+            chat_id = payload['from']
+            received_message = payload['body']
+            is_group = '@g.us' in chat_id
+
+            if is_group:
+                return ignored('group', 'Group message')
 
-        if 'payload' not in data:
-            raise HTTPException(status_code=400, detail="Missing payload in request")
+            if chat_id == 'status@broadcast':
+                return ignored('status', 'Status update')
 
-        payload = data['payload']
-        if 'from' not in payload or 'body' not in payload:
-            raise HTTPException(status_code=400, detail="Missing required fields in payload")
+            if not received_message or not received_message.strip():
+                return ignored('empty', 'Empty message')
 
-        chat_id = payload['from']
-        received_message = payload['body']
-        is_group = '@g.us' in chat_id
+            # Each WAHA session is a tenant, its chats are keyed apart from every other tenant's
+            session = data.get('session')
+            if Config.TENANTS_FILE and session not in get_tenants():
+                return ignored('tenant', f'Session {session}')
+            chat_key = build_chat_key(session, chat_id)
 
-        if is_group:
-            return {'status': 'success', 'message': 'Group message ignored.'}
+            if Config.WORKER_MODE:
+                # Deduplication and debounce happen in the workers consuming the stream
+                await enqueue_message(chat_key, received_message, message_id=payload.get('id'))
+                return ORJSONResponse({'status': 'success', 'message': 'Message queued for the workers'})
 
-        await buffer_message(chat_id, received_message)
+            # Nothing would answer a buffered message before the services are up, let WAHA retry it
+            if not registry.is_ready:
+                raise HTTPException(status_code=503, detail="Services are not ready")
 
-        return {'status': 'success', 'message': 'Message buffered for debounce'}
+            buffered = await buffer_message(chat_key, received_message, message_id=payload.get('id'))
+            if not buffered:
+                return ignored('duplicate', 'Duplicate delivery')
 
+            return ORJSONResponse({'status': 'success', 'message': 'Message buffered for debounce'})
+
+    except HTTPException:
+        raise
     except (WhatsAppAIChatbotException, WahaException) as e:
+        record_error(e)
         raise HTTPException(status_code=400, detail=f"Application error: {str(e)}")
     except Exception as e:
+        record_error(e)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
@@ -52,10 +115,51 @@ async def health_check():
     return {'status': 'healthy', 'service': 'whatsapp-ai-chatbot'}
 
 
+@router.get('/metrics', tags=["Health"])
+async def metrics():
+    try:
+        await refresh_queue_metrics()
+    except Exception as e:
+        # Queue gauges keep their last value, the counters and histograms are still worth serving
+        logger.warning(f'Failed to refresh queue gauges: {str(e)}')
+
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+@router.get('/ready', tags=["Health"])
+async def readiness_check():
+    if Config.WORKER_MODE:
+        # The ingest API only needs Redis, the bot and WAHA client live in the workers
+        try:
+            await redis_client.ping()
+        except Exception as e:
+            return JSONResponse(status_code=503, content={'status': 'unavailable', 'mode': 'ingest', 'error': str(e)})
+        return {'status': 'ready', 'mode': 'ingest'}
+
+    status = registry.status()
+    if not status['ready']:
+        state = 'unavailable' if status['error'] else 'starting'
+        return JSONResponse(status_code=503, content={'status': state, **status})
+    return {'status': 'ready', **status}
+
+
+@router.get('/scheduler/status', tags=["Buffer"])
+async def get_scheduler_status():
+    return response_scheduler.stats()
+
+
+@router.get('/tenants/status', tags=["Health"])
+async def get_tenants_status():
+    if not registry.is_ready:
+        return JSONResponse(status_code=503, content={'status': 'unavailable', 'tenants': None})
+    return registry.tenants.stats()
+
+
 @router.get('/buffer/status/{chat_id}', tags=["Buffer"])
-async def get_buffer_status_endpoint(chat_id: str):
+async def get_buffer_status_endpoint(chat_id: str, session: str = None):
     try:
-        status = await get_buffer_status(chat_id)
+        status = await get_buffer_status(build_chat_key(session, chat_id))
         return status
     except BufferException as e:
         raise HTTPException(status_code=400, detail=f"Buffer error: {str(e)}")
@@ -66,8 +170,8 @@ async def get_buffer_status_endpoint(chat_id: str):
 @router.post('/buffer/cleanup', tags=["Buffer"])
 async def cleanup_buffer():
     try:
-        await cleanup_expired_tasks()
-        return {'status': 'success', 'message': 'Expired tasks cleaned up'}
+        requeued = await cleanup_expired_tasks()
+        return {'status': 'success', 'message': 'Expired tasks cleaned up', 'requeued': requeued}
     except BufferException as e:
         raise HTTPException(status_code=400, detail=f"Buffer cleanup error: {str(e)}")
     except Exception as e:
@@ -75,9 +179,9 @@ async def cleanup_buffer():
 
 
 @router.delete('/chat/history/{chat_id}', tags=["Chat History"])
-async def clear_history(chat_id: str):
+async def clear_history(chat_id: str, session: str = None):
     try:
-        result = await clear_chat_history(chat_id)
+        result = await clear_chat_history(build_chat_key(session, chat_id))
         if result['status'] == 'success':
             return result
         else:
@@ -89,9 +193,9 @@ async def clear_history(chat_id: str):
 
 
 @router.get('/chat/history/{chat_id}', tags=["Chat History"])
-async def get_history(chat_id: str, limit: int = 10):
+async def get_history(chat_id: str, limit: int = 10, session: str = None):
     try:
-        result = await get_chat_history(chat_id, limit)
+        result = await get_chat_history(build_chat_key(session, chat_id), limit)
         if result['status'] == 'success':
             return result
         else:
@@ -103,9 +207,9 @@ async def get_history(chat_id: str, limit: int = 10):
 
 
 @router.get('/chat/history/{chat_id}/stats', tags=["Chat History"])
-async def get_history_stats_endpoint(chat_id: str):
+async def get_history_stats_endpoint(chat_id: str, session: str = None):
     try:
-        stats = get_history_stats(chat_id)
+        stats = await aget_history_stats(build_chat_key(session, chat_id))
         return stats
     except MemoryException as e:
         raise HTTPException(status_code=400, detail=f"Memory error: {str(e)}")
@@ -0,0 +1,214 @@
+import re
+import logging
+import asyncio
+import time
+
+from services.redis_client import redis_client
+from services.metrics import record_error
+from exceptions.exceptions import BufferException
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+# Moves due chats to the processing set. Chats another worker is still answering are parked
+# in the deferred set until their lease is released, so they never crowd out the claim window.
+CLAIM_SCRIPT = """
+local batch = tonumber(ARGV[2])
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, batch * 4)
+local claimed = {}
+for i = 1, #due, 2 do
+    if #claimed >= batch then
+        break
+    end
+    local chat_id = due[i]
+    redis.call('ZREM', KEYS[1], chat_id)
+    if redis.call('ZSCORE', KEYS[2], chat_id) then
+        redis.call('ZADD', KEYS[3], 'LT', due[i + 1], chat_id)
+    else
+        redis.call('ZADD', KEYS[2], ARGV[3], chat_id)
+        table.insert(claimed, chat_id)
+    end
+end
+return claimed
+"""
+
+# Ends a chat's lease and puts back what arrived for it meanwhile, keeping the earliest due time
+RELEASE_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[1])
+local deferred = redis.call('ZSCORE', KEYS[3], ARGV[1])
+if deferred then
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('ZADD', KEYS[1], 'LT', deferred, ARGV[1])
+end
+"""
+
+# Puts chats whose worker stopped renewing its lease back in the due set
+RECLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, chat_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], chat_id)
+    redis.call('ZREM', KEYS[3], chat_id)
+    redis.call('ZADD', KEYS[1], 'NX', ARGV[1], chat_id)
+end
+return expired
+"""
+
+
+# Endings that usually mean the user is still typing the rest of the thought
+CONTINUATION_PATTERN = re.compile(
+    r'(,|:|\.\.\.|…|\b(e|ou|mas|que|porque|pois|tipo|então|entao|com|de|para|pra))\s*$',
+    re.IGNORECASE,
+)
+
+
+def completeness_factor(message):
+    text = message.strip()
+
+    if text.endswith('?'):
+        return Config.DEBOUNCE_QUESTION_FACTOR
+
+    if CONTINUATION_PATTERN.search(text) or len(text) <= 3:
+        return Config.DEBOUNCE_CONTINUATION_FACTOR
+
+    if text.endswith(('.', '!')) and len(text) >= 20:
+        return Config.DEBOUNCE_SENTENCE_FACTOR
+
+    return 1.0
+
+
+class DebounceScheduler:
+
+    def __init__(self, handler):
+        self.__handler = handler
+        self.__claim = redis_client.register_script(CLAIM_SCRIPT)
+        self.__reclaim = redis_client.register_script(RECLAIM_SCRIPT)
+        self.__release = redis_client.register_script(RELEASE_SCRIPT)
+        self.__active = {}
+        self.__task = None
+        self.__renewed_at = 0.0
+
+    @property
+    def active_count(self):
+        return len(self.__active)
+
+    async def schedule(self, chat_id, delay=None):
+        if delay is None:
+            delay = Config.DEBOUNCE_SECONDS
+
+        try:
+            await redis_client.zadd(Config.DEBOUNCE_DUE_KEY, {chat_id: time.time() + float(delay)})
+        except Exception as e:
+            raise BufferException(f"Failed to schedule debounce for {chat_id}: {str(e)}") from e
+
+    async def is_pending(self, chat_id):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zscore(Config.DEBOUNCE_DUE_KEY, chat_id)
+            pipe.zscore(Config.DEBOUNCE_DEFERRED_KEY, chat_id)
+            due, deferred = await pipe.execute()
+        return due is not None or deferred is not None or chat_id in self.__active
+
+    async def pending_count(self):
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.zcard(Config.DEBOUNCE_DUE_KEY)
+            pipe.zcard(Config.DEBOUNCE_DEFERRED_KEY)
+            return sum(await pipe.execute())
+
+    async def reclaim_expired(self):
+        try:
+            expired = await self.__reclaim(
+                keys=[Config.DEBOUNCE_DUE_KEY, Config.DEBOUNCE_PROCESSING_KEY, Config.DEBOUNCE_DEFERRED_KEY],
+                args=[time.time()],
+            )
+            for chat_id in expired:
+                logger.warning('Debounce lease expired, chat requeued', extra={'chat_id': chat_id})
+            return len(expired)
+        except Exception as e:
+            raise BufferException(f"Failed to reclaim expired debounces: {str(e)}") from e
+
+    async def __renew_leases(self):
+        now = time.time()
+        if not self.__active or now - self.__renewed_at < Config.DEBOUNCE_LEASE_SECONDS / 3:
+            return
+
+        self.__renewed_at = now
+        expires_at = now + Config.DEBOUNCE_LEASE_SECONDS
+        await redis_client.zadd(
+            Config.DEBOUNCE_PROCESSING_KEY,
+            {chat_id: expires_at for chat_id in self.__active},
+            xx=True,
+        )
+
+    async def __requeue(self, chat_id):
+        await redis_client.zadd(Config.DEBOUNCE_DUE_KEY, {chat_id: time.time()}, nx=True)
+
+    async def __process(self, chat_id):
+        try:
+            await self.__handler(chat_id)
+        except asyncio.CancelledError:
+            # Stopped mid-reply, hand the chat back so this or another worker answers it
+            await self.__requeue(chat_id)
+            raise
+        except Exception as e:
+            record_error(e)
+            logger.error(f'Error handling debounce: {str(e)}', extra={'chat_id': chat_id})
+        finally:
+            self.__active.pop(chat_id, None)
+            try:
+                await self.__release(
+                    keys=[Config.DEBOUNCE_DUE_KEY, Config.DEBOUNCE_PROCESSING_KEY, Config.DEBOUNCE_DEFERRED_KEY],
+                    args=[chat_id],
+                )
+            except Exception as e:
+                logger.warning(f'Failed to release debounce: {str(e)}', extra={'chat_id': chat_id})
+
+    async def __run(self):
+        logger.info('Debounce worker loop started')
+        while True:
+            try:
+                await self.reclaim_expired()
+                await self.__renew_leases()
+
+                claimed = []
+                capacity = Config.DEBOUNCE_MAX_ACTIVE - len(self.__active)
+                if capacity > 0:
+                    now = time.time()
+                    claimed = await self.__claim(
+                        keys=[Config.DEBOUNCE_DUE_KEY, Config.DEBOUNCE_PROCESSING_KEY, Config.DEBOUNCE_DEFERRED_KEY],
+                        args=[now, min(capacity, Config.DEBOUNCE_CLAIM_BATCH), now + Config.DEBOUNCE_LEASE_SECONDS],
+                    )
+
+                for chat_id in claimed:
+                    self.__active[chat_id] = asyncio.create_task(self.__process(chat_id))
+
+                # A full batch means more chats are probably due, so poll again right away
+                if len(claimed) < Config.DEBOUNCE_CLAIM_BATCH:
+                    await asyncio.sleep(Config.DEBOUNCE_POLL_INTERVAL)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'Debounce worker loop error: {str(e)}')
+                await asyncio.sleep(Config.DEBOUNCE_POLL_INTERVAL)
+
+    def start(self):
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+        # Replies being generated or sent get a grace period, cancelling them could repeat a delivered reply
+        active = list(self.__active.values())
+        if active:
+            _, unfinished = await asyncio.wait(active, timeout=Config.DEBOUNCE_SHUTDOWN_GRACE_SECONDS)
+            if unfinished:
+                logger.warning('Cancelling replies still running after the grace period', extra={'replies': len(unfinished)})
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        logger.info('Debounce worker loop stopped')
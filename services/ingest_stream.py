@@ -0,0 +1,150 @@
+import os
+import socket
+import logging
+import asyncio
+import time
+
+from redis.exceptions import ResponseError
+
+from services.redis_client import redis_client
+from services.metrics import record_error, current_traceparent
+from exceptions.exceptions import BufferException
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+async def enqueue_message(chat_id: str, message: str, message_id: str = None):
+    try:
+        # Trimmed approximately so XADD stays O(1), entries are consumed long before the cap
+        return await redis_client.xadd(
+            Config.INGEST_STREAM_KEY,
+            {
+                'chat_id': chat_id,
+                'body': message,
+                'message_id': message_id or '',
+                'traceparent': current_traceparent(),
+            },
+            maxlen=Config.INGEST_STREAM_MAXLEN,
+            approximate=True,
+        )
+    except Exception as e:
+        raise BufferException(f"Failed to enqueue message for {chat_id}: {str(e)}") from e
+
+
+def ack_entries(pipe, entry_ids):
+    if entry_ids:
+        pipe.xack(Config.INGEST_STREAM_KEY, Config.INGEST_CONSUMER_GROUP, *entry_ids)
+
+
+class StreamConsumer:
+
+    def __init__(self, handler):
+        self.__handler = handler
+        self.__name = Config.WORKER_CONSUMER_NAME or f'{socket.gethostname()}-{os.getpid()}'
+        self.__task = None
+        self.__claimed_at = 0.0
+
+    @property
+    def name(self):
+        return self.__name
+
+    async def ensure_group(self):
+        try:
+            await redis_client.xgroup_create(
+                Config.INGEST_STREAM_KEY,
+                Config.INGEST_CONSUMER_GROUP,
+                id='0',
+                mkstream=True,
+            )
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise BufferException(f"Failed to create consumer group: {str(e)}") from e
+
+    async def __process(self, entry_id, fields):
+        try:
+            # The handler acks once the reply is sent, or right away when there is nothing to answer
+            if not await self.__handler(entry_id, fields):
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    ack_entries(pipe, [entry_id])
+                    await pipe.execute()
+        except Exception as e:
+            # Left pending, this or another worker claims it again after WORKER_CLAIM_IDLE_MS
+            record_error(e)
+            logger.error(f'Error handling stream entry: {str(e)}', extra={'entry_id': entry_id})
+
+    async def __process_chat(self, entries):
+        for entry_id, fields in entries:
+            await self.__process(entry_id, fields)
+
+    async def __process_batch(self, entries):
+        # Chats run concurrently, but a chat's entries are buffered one after another in stream order,
+        # concurrent scripts on different pooled connections could push them out of order
+        chats = {}
+        for entry_id, fields in entries:
+            if fields:
+                chats.setdefault(fields.get('chat_id'), []).append((entry_id, fields))
+
+        await asyncio.gather(*(self.__process_chat(chat_entries) for chat_entries in chats.values()))
+
+    async def __reclaim_stale(self):
+        now = time.monotonic()
+        if now - self.__claimed_at < Config.WORKER_CLAIM_INTERVAL:
+            return
+
+        self.__claimed_at = now
+        start_id = '0-0'
+        while True:
+            start_id, entries, *_ = await redis_client.xautoclaim(
+                Config.INGEST_STREAM_KEY,
+                Config.INGEST_CONSUMER_GROUP,
+                self.__name,
+                min_idle_time=Config.WORKER_CLAIM_IDLE_MS,
+                start_id=start_id,
+                count=Config.WORKER_READ_COUNT,
+            )
+            if entries:
+                logger.warning('Reclaimed stale stream entries', extra={'entries': len(entries)})
+                await self.__process_batch(entries)
+            if start_id == '0-0':
+                break
+
+    async def __run(self):
+        logger.info('Stream consumer started', extra={'consumer': self.__name})
+        while True:
+            try:
+                await self.__reclaim_stale()
+
+                started = time.monotonic()
+                response = await redis_client.xreadgroup(
+                    Config.INGEST_CONSUMER_GROUP,
+                    self.__name,
+                    {Config.INGEST_STREAM_KEY: '>'},
+                    count=Config.WORKER_READ_COUNT,
+                    block=Config.WORKER_BLOCK_MS,
+                )
+                for _, entries in response or []:
+                    await self.__process_batch(entries)
+
+                # An empty read that did not block (e.g. an in-memory fake server) would spin the loop
+                if not response and time.monotonic() - started < Config.WORKER_BLOCK_MS / 2000:
+                    await asyncio.sleep(Config.DEBOUNCE_POLL_INTERVAL)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'Stream consumer loop error: {str(e)}')
+                await asyncio.sleep(Config.DEBOUNCE_POLL_INTERVAL)
+
+    async def start(self):
+        await self.ensure_group()
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+        logger.info('Stream consumer stopped', extra={'consumer': self.__name})
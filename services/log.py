@@ -0,0 +1,121 @@
+import sys
+import queue
+import random
+import atexit
+import hashlib
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+from config.config import Config
+
+
+# Attributes every LogRecord has, anything else was passed through extra= and is structured data
+RESERVED_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+listener = None
+
+
+def parse_mapping(value, cast=str):
+    mapping = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        key, raw = item.split('=', 1)
+        mapping[key.strip()] = cast(raw.strip())
+    return mapping
+
+
+def protect_body(value):
+    text = str(value)
+    if Config.LOG_BODY_MODE == 'full':
+        return text
+
+    if Config.LOG_BODY_MODE == 'redact':
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+        return f'<redacted len={len(text)} sha256={digest}>'
+
+    if len(text) > Config.LOG_BODY_MAX_CHARS:
+        return f'{text[:Config.LOG_BODY_MAX_CHARS]}... ({len(text)} chars)'
+    return text
+
+
+class BodyFilter(logging.Filter):
+
+    def filter(self, record):
+        # Runs before the record is queued, so full message bodies never sit in the queue
+        for field in Config.LOG_BODY_FIELDS:
+            if field in record.__dict__:
+                setattr(record, field, protect_body(record.__dict__[field]))
+        return True
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rates):
+        super().__init__()
+        self.__rates = {logging.getLevelName(level.upper()): rate for level, rate in rates.items()}
+
+    def filter(self, record):
+        rate = self.__rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class StructuredFormatter(logging.Formatter):
+
+    def __init__(self, json_output=True):
+        super().__init__()
+        self.__json_output = json_output
+
+    def format(self, record):
+        fields = {key: value for key, value in record.__dict__.items() if key not in RESERVED_ATTRIBUTES}
+
+        if self.__json_output:
+            entry = {
+                'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage(),
+                **fields,
+            }
+            return orjson.dumps(entry, default=str).decode('utf-8')
+
+        extras = ' '.join(f'{key}={value}' for key, value in fields.items())
+        line = f'{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}'
+        return f'{line} {extras}' if extras else line
+
+
+def setup_logging():
+    global listener
+
+    if listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(StructuredFormatter(json_output=Config.LOG_FORMAT == 'json'))
+
+    # The event loop only enqueues, the stdout write happens on the listener thread
+    log_queue = queue.SimpleQueue()
+    handler = QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_mapping(Config.LOG_SAMPLE_RATES, float)))
+    handler.addFilter(BodyFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(Config.LOG_LEVEL.upper())
+    for name, level in parse_mapping(Config.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    global listener
+
+    if listener is not None:
+        listener.stop()
+        listener = None
@@ -1,5 +1,8 @@
-from langchain_community.chat_message_histories import RedisChatMessageHistory
+import json
 
+from langchain_core.messages import HumanMessage, AIMessage, message_to_dict, messages_from_dict
+
+from services.redis_client import redis_client
 from exceptions.exceptions import (
     MemoryException,
     ConfigurationException
@@ -7,7 +10,11 @@ from exceptions.exceptions import (
 from config.config import Config
 
 
-def get_session_history(session_id):
+# Same key layout as langchain's RedisChatMessageHistory, so histories stored by earlier versions still load
+HISTORY_KEY_PREFIX = 'message_store:'
+
+
+def validate_session_id(session_id):
     try:
         if not session_id:
             raise ConfigurationException("Session ID cannot be empty")
@@ -20,27 +27,24 @@ def get_session_history(session_id):
     except Exception as e:
         raise ConfigurationException(f"Error validating parameters: {str(e)}")
 
-    try:
-        return RedisChatMessageHistory(
-            session_id=session_id,
-            url=Config.REDIS_URL,
-            ttl=Config.HISTORY_TTL_HOURS * 3600,  # hours to seconds
-        )
-    except Exception as e:
-        raise MemoryException(f"Failed to create Redis chat history for session {session_id}: {str(e)}") from e
 
+def get_history_key(session_id):
+    return f'{HISTORY_KEY_PREFIX}{session_id}'
+
+
+def get_history_count_key(session_id):
+    return f'{Config.HISTORY_COUNT_KEY_PREFIX}{session_id}'
+
+
+def get_history_summary_key(session_id):
+    return f'{Config.HISTORY_SUMMARY_KEY_PREFIX}{session_id}'
 
-def clear_session_history(session_id):
-    try:
-        history = get_session_history(session_id)
-        history.clear()
-    except (ConfigurationException, MemoryException):
-        raise
-    except Exception as e:
-        raise MemoryException(f"Failed to clear history for session {session_id}: {str(e)}") from e
 
+def get_session_keys(session_id):
+    return [get_history_key(session_id), get_history_count_key(session_id), get_history_summary_key(session_id)]
 
-def get_session_messages(session_id, limit=None):
+
+def validate_limit(limit):
     try:
         if limit is not None and limit < 0:
             raise ConfigurationException(f"Limit must be non-negative, got {limit}")
@@ -50,57 +54,119 @@ def get_session_messages(session_id, limit=None):
     except Exception as e:
         raise ConfigurationException(f"Error validating limit parameter: {str(e)}")
 
+
+def get_window_end(limit):
+    # Newest messages are at the head of the list, so a window is a prefix of it
+    return limit - 1 if limit else -1
+
+
+def parse_messages(items):
+    return messages_from_dict([json.loads(item) for item in items[::-1]])
+
+
+def queue_exchange(pipe, session_id, question, answer):
+    key = get_history_key(session_id)
+    pipe.lpush(
+        key,
+        json.dumps(message_to_dict(HumanMessage(content=question))),
+        json.dumps(message_to_dict(AIMessage(content=answer))),
+    )
+    pipe.ltrim(key, 0, Config.MAX_HISTORY_MESSAGES - 1)
+    pipe.expire(key, Config.HISTORY_TTL_HOURS * 3600)  # hours to seconds
+
+    # Total ever appended, gives each message a stable position for the rolling summary
+    count_key = get_history_count_key(session_id)
+    pipe.incrby(count_key, 2)
+    pipe.expire(count_key, Config.HISTORY_TTL_HOURS * 3600)
+
+
+def build_history_stats(session_id, total):
+    return {
+        'session_id': session_id,
+        'total_messages': total,
+        'max_allowed': Config.MAX_HISTORY_MESSAGES,
+        'ttl_hours': Config.HISTORY_TTL_HOURS,
+        'is_trimmed': total >= Config.MAX_HISTORY_MESSAGES
+    }
+
+
+async def aclear_session_history(session_id):
+    validate_session_id(session_id)
+
     try:
-        history = get_session_history(session_id)
-        messages = history.messages
+        await redis_client.delete(*get_session_keys(session_id))
+    except Exception as e:
+        raise MemoryException(f"Failed to clear history for session {session_id}: {str(e)}") from e
 
-        if limit:
-            return messages[-limit:] if limit > 0 else messages
 
-        return messages
+async def aget_session_messages(session_id, limit=None):
+    validate_session_id(session_id)
+    validate_limit(limit)
+
+    try:
+        items = await redis_client.lrange(get_history_key(session_id), 0, get_window_end(limit))
+        return parse_messages(items)
 
-    except (ConfigurationException, MemoryException):
-        raise
     except Exception as e:
         raise MemoryException(f"Failed to get messages for session {session_id}: {str(e)}") from e
 
 
-def trim_history_if_needed(session_id):
+async def aadd_session_messages(session_id, question, answer):
+    validate_session_id(session_id)
+
     try:
-        history = get_session_history(session_id)
-        messages = history.messages
-
-        if len(messages) > Config.MAX_HISTORY_MESSAGES:
-            # Keep only the most recent messages
-            messages_to_keep = messages[-Config.MAX_HISTORY_MESSAGES:]
-            history.clear()
-            for msg in messages_to_keep:
-                if msg.__class__.__name__ == 'HumanMessage':
-                    history.add_user_message(msg.content)
-                else:
-                    history.add_ai_message(msg.content)
-            print(f"History trimmed for {session_id}: {len(messages)} -> {len(messages_to_keep)} messages")
-
-    except (ConfigurationException, MemoryException):
-        raise
+        async with redis_client.pipeline(transaction=True) as pipe:
+            queue_exchange(pipe, session_id, question, answer)
+            await pipe.execute()
+
     except Exception as e:
-        raise MemoryException(f"Failed to trim history for session {session_id}: {str(e)}") from e
+        raise MemoryException(f"Failed to save messages for session {session_id}: {str(e)}") from e
+
 
+async def aget_history_stats(session_id):
+    validate_session_id(session_id)
 
-def get_history_stats(session_id):
     try:
-        history = get_session_history(session_id)
-        messages = history.messages
+        return build_history_stats(session_id, await redis_client.llen(get_history_key(session_id)))
+    except Exception as e:
+        raise MemoryException(f"Failed to get history stats for session {session_id}: {str(e)}") from e
+
+
+async def aget_history_context(session_id, limit=None):
+    validate_session_id(session_id)
+    validate_limit(limit)
+
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(get_history_key(session_id), 0, get_window_end(limit))
+            pipe.get(get_history_count_key(session_id))
+            pipe.hgetall(get_history_summary_key(session_id))
+            items, total, summary = await pipe.execute()
+
+        messages = parse_messages(items)
 
         return {
-            'session_id': session_id,
-            'total_messages': len(messages),
-            'max_allowed': Config.MAX_HISTORY_MESSAGES,
-            'ttl_hours': Config.HISTORY_TTL_HOURS,
-            'is_trimmed': len(messages) >= Config.MAX_HISTORY_MESSAGES
+            'messages': messages,
+            # Histories written before the counter existed start counting from what is stored
+            'total': int(total) if total is not None else len(messages),
+            'summary': summary.get('summary', ''),
+            'summary_covered': int(summary.get('covered', 0)),
         }
 
-    except (ConfigurationException, MemoryException):
-        raise
     except Exception as e:
-        raise MemoryException(f"Failed to get history stats for session {session_id}: {str(e)}") from e
+        raise MemoryException(f"Failed to get history context for session {session_id}: {str(e)}") from e
+
+
+async def asave_history_summary(session_id, summary, covered):
+    validate_session_id(session_id)
+
+    try:
+        key = get_history_summary_key(session_id)
+
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={'summary': summary, 'covered': covered})
+            pipe.expire(key, Config.HISTORY_TTL_HOURS * 3600)
+            await pipe.execute()
+
+    except Exception as e:
+        raise MemoryException(f"Failed to save history summary for session {session_id}: {str(e)}") from e
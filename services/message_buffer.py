@@ -1,27 +1,115 @@
+import logging
 import asyncio
-import redis.asyncio as redis
-from collections import defaultdict
-
-from bot.ai_bot import AIBot
-from services.waha import Waha
-from services.memory import clear_session_history, get_session_messages
+import time
+from contextlib import aclosing
+
+from services.redis_client import redis_client
+from services.debounce import DebounceScheduler, completeness_factor
+from services.ingest_stream import StreamConsumer, ack_entries
+from services.registry import registry
+from services.scheduler import response_scheduler
+from services.tenants import split_chat_key
+from services.metrics import (
+    MESSAGES_BUFFERED,
+    MESSAGES_DROPPED,
+    REPLIES_FAILED,
+    PENDING_DEBOUNCES,
+    ACTIVE_DEBOUNCES,
+    SCHEDULER_QUEUED,
+    SCHEDULER_RUNNING,
+    track_stage,
+    observe_stage,
+    record_error,
+    current_traceparent
+)
+from services.memory import aclear_session_history, aget_session_messages
 from exceptions.exceptions import (
     BufferException,
+    SchedulerOverloadedException,
     MemoryException,
     ConfigurationException
 )
 from config.config import Config
 
 
-try:
-    redis_client = redis.Redis.from_url(Config.REDIS_URL, decode_responses=True)
-except Exception as e:
-    raise ConfigurationException(f"Failed to create Redis client: {str(e)}")
-
-debounce_tasks = defaultdict(asyncio.Task)
-
-
-async def buffer_message(chat_id: str, message: str):
+logger = logging.getLogger(__name__)
+
+
+# Moves the buffer into the in-flight list in one step, so messages that arrive while
+# the reply is generated start a new buffer instead of being deleted with this one.
+# Whatever a crashed attempt left in flight is answered together with the new messages.
+# In worker mode the ingest stream entry ids travel the same way, to be acked after the reply.
+DRAIN_SCRIPT = """
+while redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT') do
+end
+while redis.call('LMOVE', KEYS[5], KEYS[6], 'LEFT', 'RIGHT') do
+end
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[6], ARGV[1])
+local started_at = redis.call('GET', KEYS[3]) or ''
+local traceparents = redis.call('LRANGE', KEYS[4], 0, -1)
+redis.call('DEL', KEYS[3], KEYS[4])
+return {redis.call('LRANGE', KEYS[2], 0, -1), started_at, traceparents, redis.call('LRANGE', KEYS[6], 0, -1)}
+"""
+
+# Marks the WAHA message id as seen and buffers the message in one round-trip,
+# a redelivered webhook finds the id already set and changes nothing.
+# In worker mode the mark holds the stream entry id, to tell a redelivery from the same entry reclaimed.
+# The debounce delay adapts to the chat's typing cadence (an EWMA of the gaps between
+# its messages) and to how complete the message looks, and is capped by a max wait
+# counted from the first message of the batch.
+BUFFER_SCRIPT = """
+local dedup_key, buffer_key, due_key, started_key, traces_key, cadence_key, entries_key = unpack(KEYS)
+local message, buffer_ttl, now, dedup_ttl, chat_id, traceparent = ARGV[1], ARGV[2], tonumber(ARGV[3]), ARGV[4], ARGV[5], ARGV[6]
+local factor, adaptive, max_delay, min_delay = tonumber(ARGV[7]), ARGV[8] == '1', tonumber(ARGV[9]), tonumber(ARGV[10])
+local max_wait, alpha, burst_gap, multiplier = tonumber(ARGV[11]), tonumber(ARGV[12]), tonumber(ARGV[13]), tonumber(ARGV[14])
+local initial_cadence, cadence_ttl, entry_id = tonumber(ARGV[15]), ARGV[16], ARGV[17]
+
+if dedup_key ~= '' and not redis.call('SET', dedup_key, entry_id ~= '' and entry_id or '1', 'NX', 'EX', dedup_ttl) then
+    return 0
+end
+
+local length = redis.call('RPUSH', buffer_key, message)
+redis.call('EXPIRE', buffer_key, buffer_ttl)
+redis.call('SET', started_key, ARGV[3], 'NX', 'EX', buffer_ttl)
+local started_at = tonumber(redis.call('GET', started_key))
+if traceparent ~= '' then
+    redis.call('RPUSH', traces_key, traceparent)
+    redis.call('EXPIRE', traces_key, buffer_ttl)
+end
+if entry_id ~= '' then
+    redis.call('RPUSH', entries_key, entry_id)
+    redis.call('EXPIRE', entries_key, buffer_ttl)
+end
+
+local delay = max_delay
+if adaptive then
+    local last_at = tonumber(redis.call('HGET', cadence_key, 'last_at'))
+    local cadence = tonumber(redis.call('HGET', cadence_key, 'cadence')) or initial_cadence
+    -- Gaps longer than a burst are pauses between conversations, not typing speed
+    local long_pause = last_at == nil or now - last_at > burst_gap
+    if not long_pause then
+        cadence = alpha * (now - last_at) + (1 - alpha) * cadence
+    end
+    redis.call('HSET', cadence_key, 'last_at', ARGV[3], 'cadence', tostring(cadence))
+    redis.call('EXPIRE', cadence_key, cadence_ttl)
+
+    if length == 1 and long_pause and factor < 1 then
+        delay = min_delay
+    else
+        delay = math.min(math.max(cadence * multiplier * factor, min_delay), max_delay)
+    end
+end
+
+redis.call('ZADD', due_key, tostring(math.min(now + delay, started_at + max_wait)), chat_id)
+return 1
+"""
+
+drain_buffer = redis_client.register_script(DRAIN_SCRIPT)
+push_buffer = redis_client.register_script(BUFFER_SCRIPT)
+
+
+async def buffer_message(chat_id: str, message: str, message_id: str = None, entry_id: str = None, traceparent: str = None):
     try:
         if not chat_id:
             raise BufferException("Chat ID cannot be empty")
@@ -36,62 +124,224 @@ async def buffer_message(chat_id: str, message: str):
 
     try:
         buffer_key = f'{chat_id}{Config.BUFFER_KEY_SUFIX}'
+        dedup_key = f'{Config.WEBHOOK_DEDUP_KEY_PREFIX}{message_id}' if message_id else ''
+        # First-message time and trace context of the batch, for the debounce wait metric and reply span links
+        started_key = f'{chat_id}{Config.BUFFER_STARTED_KEY_SUFIX}'
+        traces_key = f'{chat_id}{Config.BUFFER_TRACES_KEY_SUFIX}'
+        cadence_key = f'{Config.DEBOUNCE_CADENCE_KEY_PREFIX}{chat_id}'
+        entries_key = f'{chat_id}{Config.BUFFER_ENTRIES_KEY_SUFIX}'
+
+        # Every new message moves the due time, the worker loop fires it once it passes
+        buffered = await push_buffer(
+            keys=[dedup_key, buffer_key, Config.DEBOUNCE_DUE_KEY, started_key, traces_key, cadence_key, entries_key],
+            args=[
+                message,
+                Config.BUFFER_TTL,
+                time.time(),
+                Config.WEBHOOK_DEDUP_TTL,
+                chat_id,
+                current_traceparent() if traceparent is None else traceparent,
+                completeness_factor(message),
+                1 if Config.DEBOUNCE_ADAPTIVE else 0,
+                Config.DEBOUNCE_SECONDS,
+                Config.DEBOUNCE_MIN_SECONDS,
+                Config.DEBOUNCE_MAX_WAIT_SECONDS,
+                Config.DEBOUNCE_CADENCE_ALPHA,
+                Config.DEBOUNCE_BURST_GAP_SECONDS,
+                Config.DEBOUNCE_CADENCE_MULTIPLIER,
+                Config.DEBOUNCE_INITIAL_CADENCE_SECONDS,
+                Config.DEBOUNCE_CADENCE_TTL,
+                entry_id or '',
+            ],
+        )
+
+        if not buffered:
+            logger.info('Duplicate delivery ignored', extra={'chat_id': chat_id, 'message_id': message_id})
+            return False
+
+        MESSAGES_BUFFERED.inc()
+        logger.debug('Message added to buffer', extra={'chat_id': chat_id, 'body': message})
+        return True
 
-        await redis_client.rpush(buffer_key, message)
-        await redis_client.expire(buffer_key, Config.BUFFER_TTL)
+    except Exception as e:
+        raise BufferException(f"Failed to buffer message for {chat_id}: {str(e)}") from e
 
-        print(f'[BUFFER] Message added to buffer for {chat_id}: {message}')
 
-        if debounce_tasks.get(chat_id):
-            debounce_tasks[chat_id].cancel()
-            print(f'[BUFFER] Debounce reset for {chat_id}')
+async def update_typing(action, chat_key: str):
+    # The typing indicator is cosmetic, failing to toggle it must not fail or repeat a reply
+    try:
+        await action
+    except Exception as e:
+        logger.warning(f'Failed to update typing indicator: {str(e)}', extra={'chat_id': chat_key})
+
+
+async def complete_after_delivery(coro):
+    # The user already has the reply, a shutdown cancelling us now must not requeue and repeat it
+    task = asyncio.ensure_future(coro)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        asyncio.current_task().uncancel()
+        return await task
 
-        debounce_tasks[chat_id] = asyncio.create_task(handle_debounce(chat_id))
+
+async def send_streamed_response(waha, ai_bot, chat_key: str, question: str):
+    session, chat_id = split_chat_key(chat_key)
+    sent = []
+    try:
+        # The bot saves the whole answer to history once the last segment has been sent
+        async with aclosing(ai_bot.astream_response(question=question, session_id=chat_key)) as segments:
+            async for segment in segments:
+                with track_stage('waha_send'):
+                    await waha.send_message(chat_id=chat_id, message=segment, session=session)
+                sent.append(segment)
+                # Sending a message clears the indicator, show it again while the rest is generated
+                await update_typing(waha.start_typing(chat_id=chat_id, session=session), chat_key)
+    except (Exception, asyncio.CancelledError) as e:
+        # Nothing reached the user yet, the whole reply can still be retried
+        if not sent:
+            raise
+
+        # Retrying would resend segments the user already has, keep what was sent and finish the batch.
+        # A shutdown that outlasted the grace period is handled the same way as a failed send.
+        if isinstance(e, asyncio.CancelledError):
+            asyncio.current_task().uncancel()
+        record_error(e)
+        logger.error(
+            f'Streamed response interrupted after {len(sent)} segments: {str(e)}',
+            extra={'chat_id': chat_key, 'segments': len(sent)},
+        )
+        await complete_after_delivery(ai_bot.asave_exchange(chat_key, question, '\n\n'.join(sent)))
+
+    await complete_after_delivery(update_typing(waha.stop_typing(chat_id=chat_id, session=session), chat_key))
+    logger.info('Streamed response sent', extra={'chat_id': chat_key, 'segments': len(sent)})
+
+
+async def reply_to_chat(chat_key: str, full_message: str):
+    try:
+        session, chat_id = split_chat_key(chat_key)
+        waha = registry.waha
+
+        async with registry.tenants.acquire(session) as ai_bot:
+            await update_typing(waha.start_typing(chat_id=chat_id, session=session), chat_key)
+
+            if Config.STREAMING_ENABLED:
+                await send_streamed_response(waha, ai_bot, chat_key, full_message)
+            else:
+                # Saved to history only once sent, a failed send is retried without a duplicate exchange
+                response_message = await ai_bot.aget_response(
+                    question=full_message,
+                    session_id=chat_key,  # Uses the chat key as session_id, so tenants never share history
+                    save_history=False,
+                )
+
+                # The reply counts as delivered once send_message succeeds, stopping the indicator is best-effort
+                with track_stage('waha_send'):
+                    await asyncio.gather(
+                        waha.send_message(chat_id=chat_id, message=response_message, session=session),
+                        update_typing(waha.stop_typing(chat_id=chat_id, session=session), chat_key),
+                    )
+
+                logger.info('Response sent', extra={'chat_id': chat_key, 'answer': response_message})
+                await complete_after_delivery(ai_bot.asave_exchange(chat_key, full_message, response_message))
 
     except Exception as e:
-        raise BufferException(f"Failed to buffer message for {chat_id}: {str(e)}") from e
+        raise BufferException(f"Error processing AI response for {chat_key}: {str(e)}") from e
+
+
+async def handle_overload(chat_key: str, error: SchedulerOverloadedException):
+    record_error(error)
+    logger.warning(str(error), extra={'chat_id': chat_key, 'policy': Config.SCHEDULER_OVERFLOW_POLICY})
+
+    if Config.SCHEDULER_OVERFLOW_POLICY == 'busy':
+        session, chat_id = split_chat_key(chat_key)
+        try:
+            await registry.waha.send_message(chat_id=chat_id, message=Config.SCHEDULER_BUSY_MESSAGE, session=session)
+        except Exception as e:
+            raise BufferException(f"Error sending busy reply to {chat_key}: {str(e)}") from e
+        return True
+
+    # The drained messages stay in flight and are answered together with anything new on retry
+    await debounce_scheduler.schedule(chat_key, delay=Config.SCHEDULER_RETRY_SECONDS)
+    return False
+
+
+async def schedule_retry(chat_key: str, error: BufferException):
+    attempts_key = f'{chat_key}{Config.REPLY_ATTEMPTS_KEY_SUFIX}'
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.incr(attempts_key)
+        pipe.expire(attempts_key, Config.BUFFER_TTL)
+        attempts, _ = await pipe.execute()
+
+    if attempts > Config.REPLY_MAX_RETRIES:
+        REPLIES_FAILED.labels(outcome='abandoned').inc()
+        return False
+
+    # The drained messages stay in flight and are answered together with anything new on retry
+    delay = Config.REPLY_RETRY_SECONDS * 2 ** (attempts - 1)
+    REPLIES_FAILED.labels(outcome='retried').inc()
+    logger.warning(
+        f'Reply failed, retrying in {delay:.1f}s: {str(error)}',
+        extra={'chat_id': chat_key, 'attempt': attempts},
+    )
+    await debounce_scheduler.schedule(chat_key, delay=delay)
+    return True
+
+
+async def release_inflight(chat_id: str, entry_ids):
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(
+            f'{chat_id}{Config.INFLIGHT_KEY_SUFIX}',
+            f'{chat_id}{Config.INFLIGHT_ENTRIES_KEY_SUFIX}',
+            f'{chat_id}{Config.REPLY_ATTEMPTS_KEY_SUFIX}',
+        )
+        ack_entries(pipe, entry_ids)
+        await pipe.execute()
 
 
 async def handle_debounce(chat_id: str):
     try:
-        print(f'[BUFFER] Starting debounce for {chat_id}')
-        await asyncio.sleep(float(Config.DEBOUNCE_SECONDS))
+        logger.debug('Debounce fired', extra={'chat_id': chat_id})
 
         buffer_key = f'{chat_id}{Config.BUFFER_KEY_SUFIX}'
-        messages = await redis_client.lrange(buffer_key, 0, -1)
+        inflight_key = f'{chat_id}{Config.INFLIGHT_KEY_SUFIX}'
+        started_key = f'{chat_id}{Config.BUFFER_STARTED_KEY_SUFIX}'
+        traces_key = f'{chat_id}{Config.BUFFER_TRACES_KEY_SUFIX}'
+        entries_key = f'{chat_id}{Config.BUFFER_ENTRIES_KEY_SUFIX}'
+        inflight_entries_key = f'{chat_id}{Config.INFLIGHT_ENTRIES_KEY_SUFIX}'
+        messages, started_at, traceparents, entry_ids = await drain_buffer(
+            keys=[buffer_key, inflight_key, started_key, traces_key, entries_key, inflight_entries_key],
+            args=[Config.BUFFER_TTL],
+        )
+
+        if started_at:
+            observe_stage('debounce_wait', time.time() - float(started_at))
 
         full_message = ' '.join(messages).strip()
 
         if full_message:
-            print(f'[BUFFER] Sending grouped message to {chat_id}: {full_message}')
+            logger.info('Answering grouped message', extra={'chat_id': chat_id, 'body': full_message, 'messages': len(messages)})
 
             try:
-                waha = Waha()
-                ai_bot = AIBot()
-
-                await asyncio.to_thread(waha.start_typing, chat_id=chat_id)
-
-                # History is automatically managed by Redis
-                response_message = await asyncio.to_thread(
-                    ai_bot.get_response,
-                    question=full_message,
-                    session_id=chat_id,  # Uses chat_id as session_id for Redis
-                )
-
-                await asyncio.gather(
-                    asyncio.to_thread(waha.send_message, chat_id=chat_id, message=response_message),
-                    asyncio.to_thread(waha.stop_typing, chat_id=chat_id)
+                with track_stage('reply', traceparents=traceparents, chat_id=chat_id):
+                    await response_scheduler.run(chat_id, lambda: reply_to_chat(chat_id, full_message))
+            except SchedulerOverloadedException as e:
+                if not await handle_overload(chat_id, e):
+                    return
+            except BufferException as e:
+                if await schedule_retry(chat_id, e):
+                    raise
+
+                record_error(e)
+                logger.error(
+                    f'Reply abandoned after {Config.REPLY_MAX_RETRIES} retries: {str(e)}',
+                    extra={'chat_id': chat_id, 'messages': len(messages)},
                 )
 
-                print(f'[BUFFER] Response sent to {chat_id}: {response_message}')
-
-            except Exception as e:
-                raise BufferException(f"Error processing AI response for {chat_id}: {str(e)}") from e
-
-        await redis_client.delete(buffer_key)
+        await complete_after_delivery(release_inflight(chat_id, entry_ids))
 
     except asyncio.CancelledError:
-        print(f'[BUFFER] Debounce cancelled for {chat_id}')
+        logger.info('Debounce cancelled', extra={'chat_id': chat_id})
         raise
     except BufferException:
         raise
@@ -99,16 +349,71 @@ async def handle_debounce(chat_id: str):
         raise BufferException(f"Error in debounce for {chat_id}: {str(e)}") from e
 
 
+debounce_scheduler = DebounceScheduler(handle_debounce)
+
+
+async def is_entry_pending(chat_id: str, entry_id: str):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.lpos(f'{chat_id}{Config.BUFFER_ENTRIES_KEY_SUFIX}', entry_id)
+        pipe.lpos(f'{chat_id}{Config.INFLIGHT_ENTRIES_KEY_SUFIX}', entry_id)
+        return any(position is not None for position in await pipe.execute())
+
+
+async def is_entry_lost(entry_id: str, message_id: str):
+    dedup_key = f'{Config.WEBHOOK_DEDUP_KEY_PREFIX}{message_id}'
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.get(dedup_key)
+        pipe.xpending_range(Config.INGEST_STREAM_KEY, Config.INGEST_CONSUMER_GROUP, min=entry_id, max=entry_id, count=1)
+        seen_entry, pending = await pipe.execute()
+
+    # Buffered by this same entry and never acked, its reply was not sent
+    return seen_entry == entry_id and bool(pending)
+
+
+async def handle_stream_entry(entry_id: str, fields: dict):
+    chat_id = fields['chat_id']
+    message_id = fields.get('message_id') or entry_id
+    traceparent = fields.get('traceparent', '')
+    buffered = await buffer_message(
+        chat_id,
+        fields['body'],
+        message_id=message_id,
+        entry_id=entry_id,
+        traceparent=traceparent,
+    )
+    if buffered:
+        return True
+
+    # Reclaimed while its reply is still being generated, the debounce acks it once the reply is sent
+    if await is_entry_pending(chat_id, entry_id):
+        logger.debug('Reclaimed entry still awaiting its reply', extra={'chat_id': chat_id, 'entry_id': entry_id})
+        return True
+
+    # Left pending longer than BUFFER_TTL (e.g. every worker down), its buffered copy expired unanswered
+    if await is_entry_lost(entry_id, message_id):
+        logger.warning('Re-buffering reclaimed entry whose buffer expired', extra={'chat_id': chat_id, 'entry_id': entry_id})
+        return await buffer_message(chat_id, fields['body'], entry_id=entry_id, traceparent=traceparent)
+
+    # A redelivered webhook, or an entry whose reply already went out, is acked right away
+    MESSAGES_DROPPED.labels(reason='duplicate').inc()
+    return False
+
+
+stream_consumer = StreamConsumer(handle_stream_entry)
+
+
+async def refresh_queue_metrics():
+    PENDING_DEBOUNCES.set(await debounce_scheduler.pending_count())
+    ACTIVE_DEBOUNCES.set(debounce_scheduler.active_count)
+
+    scheduler_stats = response_scheduler.stats()
+    SCHEDULER_QUEUED.set(scheduler_stats['queued'])
+    SCHEDULER_RUNNING.set(scheduler_stats['running'])
+
+
 async def cleanup_expired_tasks():
     try:
-        expired_tasks = []
-        for chat_id, task in debounce_tasks.items():
-            if task.done():
-                expired_tasks.append(chat_id)
-
-        for chat_id in expired_tasks:
-            del debounce_tasks[chat_id]
-            print(f'[BUFFER] Debounce task removed for {chat_id}')
+        return await debounce_scheduler.reclaim_expired()
 
     except Exception as e:
         raise BufferException(f"Error cleaning up expired tasks: {str(e)}") from e
@@ -126,15 +431,21 @@ async def get_buffer_status(chat_id: str):
 
     try:
         buffer_key = f'{chat_id}{Config.BUFFER_KEY_SUFIX}'
-        messages = await redis_client.lrange(buffer_key, 0, -1)
-        ttl = await redis_client.ttl(buffer_key)
+        inflight_key = f'{chat_id}{Config.INFLIGHT_KEY_SUFIX}'
+
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.lrange(buffer_key, 0, -1)
+            pipe.ttl(buffer_key)
+            pipe.llen(inflight_key)
+            messages, ttl, inflight_count = await pipe.execute()
 
         return {
             'chat_id': chat_id,
             'messages_count': len(messages),
             'messages': messages,
+            'messages_in_flight': inflight_count,
             'ttl': ttl,
-            'has_pending_debounce': chat_id in debounce_tasks
+            'has_pending_debounce': await debounce_scheduler.is_pending(chat_id)
         }
 
     except Exception as e:
@@ -152,8 +463,8 @@ async def clear_chat_history(chat_id: str):
         raise BufferException(f"Error validating chat_id: {str(e)}")
 
     try:
-        clear_session_history(chat_id)
-        print(f'[BUFFER] History cleared for {chat_id}')
+        await aclear_session_history(chat_id)
+        logger.info('History cleared', extra={'chat_id': chat_id})
         return {'status': 'success', 'message': f'History cleared for {chat_id}'}
 
     except (MemoryException, ConfigurationException) as e:
@@ -176,7 +487,7 @@ async def get_chat_history(chat_id: str, limit: int = 10):
         raise BufferException(f"Error validating parameters: {str(e)}")
 
     try:
-        messages = get_session_messages(chat_id, limit)
+        messages = await aget_session_messages(chat_id, limit)
         formatted_messages = []
 
         for msg in messages:
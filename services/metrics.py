@@ -0,0 +1,123 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+from exceptions.exceptions import ConfigurationException
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    'chatbot_stage_duration_seconds',
+    'Time spent in each stage between a webhook and the reply',
+    ['stage'],
+    buckets=STAGE_BUCKETS,
+)
+MESSAGES_BUFFERED = Counter('chatbot_messages_buffered_total', 'Webhook messages added to a chat buffer')
+MESSAGES_DROPPED = Counter(
+    'chatbot_messages_dropped_total',
+    'Webhook deliveries dropped before buffering',
+    ['reason'],
+)
+REPLIES_FAILED = Counter(
+    'chatbot_replies_failed_total',
+    'Replies that failed before being sent, retried or abandoned after REPLY_MAX_RETRIES',
+    ['outcome'],
+)
+ERRORS = Counter('chatbot_errors_total', 'Errors by exception class', ['exception'])
+PENDING_DEBOUNCES = Gauge('chatbot_pending_debounces', 'Chats waiting for their debounce to fire')
+ACTIVE_DEBOUNCES = Gauge('chatbot_active_debounces', 'Debounces being answered by this worker')
+SCHEDULER_QUEUED = Gauge('chatbot_scheduler_queued', 'Replies waiting for a response scheduler slot')
+SCHEDULER_RUNNING = Gauge('chatbot_scheduler_running', 'Replies being generated right now')
+TENANT_REQUESTS = Counter(
+    'chatbot_tenant_requests_total',
+    'Replies by tenant, a miss had to load the tenant knowledge base first',
+    ['tenant', 'result'],
+)
+TENANT_EVICTIONS = Counter('chatbot_tenant_evictions_total', 'Tenant knowledge bases unloaded', ['tenant'])
+TENANT_RESIDENT_BYTES = Gauge(
+    'chatbot_tenant_resident_bytes',
+    'Estimated memory of each loaded tenant knowledge base',
+    ['tenant'],
+)
+
+tracer = None
+
+
+def setup_tracing():
+    global tracer
+
+    if not Config.TRACING_ENABLED or tracer is not None:
+        return
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        raise ConfigurationException("TRACING_ENABLED requires the opentelemetry-sdk and OTLP exporter packages") from e
+
+    # The exporter reads OTEL_EXPORTER_OTLP_ENDPOINT and friends from the environment
+    provider = TracerProvider(resource=Resource.create({'service.name': Config.TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+    tracer = trace.get_tracer('whatsapp-ai-chatbot')
+    logger.info(f'Tracing enabled for service {Config.TRACING_SERVICE_NAME}')
+
+
+def current_traceparent():
+    if tracer is None:
+        return ''
+
+    from opentelemetry.propagate import inject
+    carrier = {}
+    inject(carrier)
+    return carrier.get('traceparent', '')
+
+
+def build_links(traceparents):
+    from opentelemetry import trace
+    from opentelemetry.propagate import extract
+
+    links = []
+    for traceparent in traceparents:
+        span_context = trace.get_current_span(extract({'traceparent': traceparent})).get_span_context()
+        if span_context.is_valid:
+            links.append(trace.Link(span_context))
+    return links
+
+
+@contextmanager
+def track_stage(stage, traceparents=None, **attributes):
+    started = time.perf_counter()
+    try:
+        if tracer is None:
+            yield
+        else:
+            # Links tie a reply to every webhook that fed its buffer, even across workers
+            links = build_links(traceparents) if traceparents else None
+            with tracer.start_as_current_span(stage, links=links, attributes=attributes):
+                yield
+    finally:
+        STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - started)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+def record_error(error):
+    ERRORS.labels(exception=type(error).__name__).inc()
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,17 @@
+import redis as sync_redis
+import redis.asyncio as redis
+
+from exceptions.exceptions import ConfigurationException
+from config.config import Config
+
+
+try:
+    redis_client = redis.Redis.from_url(Config.REDIS_URL, decode_responses=True)
+except Exception as e:
+    raise ConfigurationException(f"Failed to create Redis client: {str(e)}")
+
+try:
+    # Only for the remaining synchronous call sites, the event loop uses redis_client
+    sync_redis_client = sync_redis.Redis.from_url(Config.REDIS_URL, decode_responses=True)
+except Exception as e:
+    raise ConfigurationException(f"Failed to create Redis client: {str(e)}")
@@ -0,0 +1,111 @@
+import logging
+import asyncio
+import time
+
+from bot.ai_bot import AIBot
+from services.waha import Waha
+from services.tenants import TenantPool, get_tenants
+from exceptions.exceptions import ConfigurationException
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+
+    def __init__(self):
+        self.__tenants = None
+        self.__waha = None
+        self.__lock = asyncio.Lock()
+        self.__started_at = None
+        self.__startup_seconds = None
+        self.__startup_error = None
+
+    @property
+    def is_ready(self):
+        return self.__tenants is not None and self.__waha is not None
+
+    @property
+    def tenants(self):
+        if self.__tenants is None:
+            raise ConfigurationException("Tenant pool is not initialized, service registry has not started")
+        return self.__tenants
+
+    @property
+    def waha(self):
+        if self.__waha is None:
+            raise ConfigurationException("WAHA client is not initialized, service registry has not started")
+        return self.__waha
+
+    async def __start(self, bot_factory):
+        waha = Waha()
+        tenants = TenantPool(get_tenants(), bot_factory)
+        try:
+            # A single knowledge base is loaded up front, tenants load on their first message
+            if not Config.TENANTS_FILE:
+                await tenants.preload(Config.WAHA_SESSION)
+        except Exception:
+            await tenants.aclose()
+            await waha.aclose()
+            raise
+
+        self.__waha = waha
+        self.__tenants = tenants
+
+    async def startup(self, bot_factory=AIBot, max_attempts=None):
+        max_attempts = max_attempts or Config.STARTUP_MAX_ATTEMPTS
+
+        async with self.__lock:
+            if self.is_ready:
+                return True
+
+            started = time.perf_counter()
+            backoff = Config.STARTUP_BACKOFF_SECONDS
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    await self.__start(bot_factory)
+                except Exception as e:
+                    self.__startup_error = str(e)
+                    if attempt == max_attempts:
+                        logger.error(f'Failed to start services after {attempt} attempts: {str(e)}')
+                        return False
+
+                    logger.warning(
+                        f'Failed to start services, retrying in {backoff:.1f}s: {str(e)}',
+                        extra={'attempt': attempt},
+                    )
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, Config.STARTUP_MAX_BACKOFF_SECONDS)
+                    continue
+
+                self.__started_at = time.time()
+                self.__startup_seconds = time.perf_counter() - started
+                self.__startup_error = None
+                logger.info(f'Services ready in {self.__startup_seconds:.2f}s', extra={'attempt': attempt})
+                return True
+
+    async def shutdown(self):
+        async with self.__lock:
+            if self.__waha is not None:
+                await self.__waha.aclose()
+
+            if self.__tenants is not None:
+                await self.__tenants.aclose()
+
+            self.__tenants = None
+            self.__waha = None
+            self.__started_at = None
+            logger.info('Services stopped')
+
+    def status(self):
+        return {
+            'ready': self.is_ready,
+            'started_at': self.__started_at,
+            'startup_seconds': self.__startup_seconds,
+            'error': self.__startup_error,
+            'tenants': self.__tenants.stats() if self.__tenants else None,
+        }
+
+
+registry = ServiceRegistry()
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections import deque
+
+from services.metrics import observe_stage
+from exceptions.exceptions import SchedulerOverloadedException
+from config.config import Config
+
+
+class ResponseScheduler:
+
+    def __init__(self, max_concurrency=None, max_queue=None):
+        self.__max_concurrency = max_concurrency or Config.SCHEDULER_MAX_CONCURRENCY
+        self.__max_queue = max_queue if max_queue is not None else Config.SCHEDULER_MAX_QUEUE
+        self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+        self.__chat_locks = {}
+        self.__queued = 0
+        self.__running = 0
+        self.__completed = 0
+        self.__failed = 0
+        self.__rejected = 0
+        self.__wait_times = deque(maxlen=1000)
+        self.__max_wait = 0.0
+
+    def __acquire_chat_lock(self, chat_id):
+        # Reference counted so idle chats don't keep a lock around forever
+        entry = self.__chat_locks.get(chat_id)
+        if entry is None:
+            entry = self.__chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def __release_chat_lock(self, chat_id):
+        entry = self.__chat_locks[chat_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.__chat_locks[chat_id]
+
+    def __must_wait(self, chat_id):
+        entry = self.__chat_locks.get(chat_id)
+        return self.__semaphore.locked() or (entry is not None and entry[0].locked())
+
+    async def run(self, chat_id, job):
+        # The queue limit only applies to jobs that can't start right away
+        if self.__queued >= self.__max_queue and self.__must_wait(chat_id):
+            self.__rejected += 1
+            raise SchedulerOverloadedException(
+                f"Response queue is full ({self.__queued} waiting), rejecting reply for {chat_id}"
+            )
+
+        queued_at = time.monotonic()
+        self.__queued += 1
+        chat_lock = self.__acquire_chat_lock(chat_id)
+        waiting = True
+        try:
+            # asyncio locks wake waiters in arrival order, so replies to one chat stay FIFO
+            async with chat_lock, self.__semaphore:
+                waiting = False
+                self.__queued -= 1
+                wait = time.monotonic() - queued_at
+                self.__wait_times.append(wait)
+                self.__max_wait = max(self.__max_wait, wait)
+                observe_stage('scheduler_wait', wait)
+
+                self.__running += 1
+                try:
+                    result = await job()
+                    self.__completed += 1
+                    return result
+                except Exception:
+                    self.__failed += 1
+                    raise
+                finally:
+                    self.__running -= 1
+        finally:
+            if waiting:
+                self.__queued -= 1
+            self.__release_chat_lock(chat_id)
+
+    def stats(self):
+        waits = sorted(self.__wait_times)
+        return {
+            'max_concurrency': self.__max_concurrency,
+            'max_queue': self.__max_queue,
+            'running': self.__running,
+            'queued': self.__queued,
+            'chats': len(self.__chat_locks),
+            'completed': self.__completed,
+            'failed': self.__failed,
+            'rejected': self.__rejected,
+            'avg_wait_seconds': round(sum(waits) / len(waits), 4) if waits else 0.0,
+            'p95_wait_seconds': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4) if waits else 0.0,
+            'max_wait_seconds': round(self.__max_wait, 4),
+        }
+
+
+response_scheduler = ResponseScheduler()
@@ -0,0 +1,213 @@
+import json
+import logging
+import asyncio
+import time
+from functools import lru_cache
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+
+from services.metrics import TENANT_REQUESTS, TENANT_EVICTIONS, TENANT_RESIDENT_BYTES, track_stage
+from exceptions.exceptions import ConfigurationException
+from config.config import Config
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_tenants(path=None):
+    path = Config.TENANTS_FILE if path is None else path
+
+    # Without a tenants file the deployment serves WAHA_SESSION with the global knowledge base
+    if not path:
+        return {
+            Config.WAHA_SESSION: {
+                'persist_directory': Config.CHROMA_PERSIST_DIR,
+                'documents_directory': Config.RAG_DATA_DIR,
+                'prompt': None,
+                'cache_namespace': None,
+            }
+        }
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            raw = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigurationException(f"Failed to read tenants file {path}: {str(e)}") from e
+
+    if not isinstance(raw, dict) or not raw:
+        raise ConfigurationException(f"Tenants file {path} must map WAHA session names to tenant settings")
+
+    tenants = {}
+    for session, settings in raw.items():
+        if ':' in session:
+            raise ConfigurationException(f"Tenant session {session} cannot contain ':'")
+
+        if not isinstance(settings, dict) or not settings.get('persist_directory'):
+            raise ConfigurationException(f"Tenant {session} needs a persist_directory")
+
+        tenants[session] = {
+            'persist_directory': settings['persist_directory'],
+            'documents_directory': settings.get('documents_directory'),
+            'prompt': settings.get('prompt'),
+            'cache_namespace': session,
+        }
+
+    return tenants
+
+
+@lru_cache(maxsize=1)
+def get_tenants():
+    return load_tenants()
+
+
+def build_chat_key(session, chat_id):
+    # Single-tenant keys stay the bare chat id, so existing buffers and histories keep working
+    if not Config.TENANTS_FILE:
+        return chat_id
+    return f'{session or Config.WAHA_SESSION}:{chat_id}'
+
+
+def split_chat_key(chat_key):
+    if not Config.TENANTS_FILE:
+        return Config.WAHA_SESSION, chat_key
+    session, chat_id = chat_key.split(':', 1)
+    return session, chat_id
+
+
+class TenantPool:
+
+    def __init__(self, tenants, bot_factory, memory_budget=None):
+        self.__tenants = tenants
+        self.__bot_factory = bot_factory
+        self.__memory_budget = memory_budget or Config.TENANT_MEMORY_BUDGET_MB * 1024 * 1024
+        # Least recently used first, eviction walks it from the front
+        self.__loaded = OrderedDict()
+        self.__sizes = {}
+        self.__in_use = Counter()
+        self.__locks = {session: asyncio.Lock() for session in tenants}
+        self.__stats = {
+            session: {'hits': 0, 'misses': 0, 'evictions': 0, 'last_used': None, 'load_seconds': None}
+            for session in tenants
+        }
+
+    def __contains__(self, session):
+        return session in self.__tenants
+
+    @property
+    def resident_bytes(self):
+        return sum(self.__sizes.values())
+
+    async def __load(self, session):
+        tenant = self.__tenants[session]
+        started = time.perf_counter()
+
+        with track_stage('tenant_load'):
+            bot = await asyncio.to_thread(
+                self.__bot_factory,
+                persist_directory=tenant['persist_directory'],
+                system_prompt=tenant['prompt'],
+                cache_namespace=tenant['cache_namespace'],
+            )
+            await asyncio.to_thread(bot.warm_up)
+
+        size = await asyncio.to_thread(bot.resident_bytes)
+        self.__stats[session]['load_seconds'] = time.perf_counter() - started
+        TENANT_RESIDENT_BYTES.labels(tenant=session).set(size)
+
+        logger.info(
+            'Tenant loaded',
+            extra={'tenant': session, 'resident_bytes': size, 'seconds': round(self.__stats[session]['load_seconds'], 3)},
+        )
+        return bot, size
+
+    async def __evict(self):
+        while self.resident_bytes > self.__memory_budget:
+            victim = next((session for session in self.__loaded if not self.__in_use[session]), None)
+            if victim is None:
+                logger.warning(
+                    'Tenant memory budget exceeded by tenants in use',
+                    extra={'resident_bytes': self.resident_bytes, 'budget_bytes': self.__memory_budget},
+                )
+                return
+
+            bot = self.__loaded.pop(victim)
+            self.__sizes.pop(victim)
+            self.__stats[victim]['evictions'] += 1
+            TENANT_EVICTIONS.labels(tenant=victim).inc()
+            TENANT_RESIDENT_BYTES.labels(tenant=victim).set(0)
+            logger.info('Tenant evicted', extra={'tenant': victim, 'resident_bytes': self.resident_bytes})
+
+            try:
+                await bot.aclose()
+            except Exception as e:
+                logger.warning(f'Failed to close evicted tenant: {str(e)}', extra={'tenant': victim})
+
+    async def __get(self, session):
+        if session not in self.__tenants:
+            raise ConfigurationException(f"Unknown tenant session {session}")
+
+        stats = self.__stats[session]
+        stats['last_used'] = time.time()
+
+        if session in self.__loaded:
+            stats['hits'] += 1
+            TENANT_REQUESTS.labels(tenant=session, result='hit').inc()
+            self.__loaded.move_to_end(session)
+            return self.__loaded[session]
+
+        async with self.__locks[session]:
+            # Another reply may have loaded it while this one waited for the lock
+            if session not in self.__loaded:
+                stats['misses'] += 1
+                TENANT_REQUESTS.labels(tenant=session, result='miss').inc()
+                bot, size = await self.__load(session)
+                self.__loaded[session] = bot
+                self.__sizes[session] = size
+                await self.__evict()
+            else:
+                stats['hits'] += 1
+                TENANT_REQUESTS.labels(tenant=session, result='hit').inc()
+
+        self.__loaded.move_to_end(session)
+        return self.__loaded[session]
+
+    async def preload(self, session):
+        async with self.acquire(session):
+            pass
+
+    @asynccontextmanager
+    async def acquire(self, session):
+        # Counted before loading, so a concurrent load never evicts a tenant that is answering
+        self.__in_use[session] += 1
+        try:
+            yield await self.__get(session)
+        finally:
+            self.__in_use[session] -= 1
+
+    async def aclose(self):
+        for session in list(self.__loaded):
+            bot = self.__loaded.pop(session)
+            self.__sizes.pop(session, None)
+            TENANT_RESIDENT_BYTES.labels(tenant=session).set(0)
+            await bot.aclose()
+
+    def stats(self):
+        tenants = {}
+        for session, stats in self.__stats.items():
+            bot = self.__loaded.get(session)
+            tenants[session] = {
+                'loaded': bot is not None,
+                'resident_bytes': self.__sizes.get(session, 0),
+                'in_use': self.__in_use[session],
+                **stats,
+                'embedding_cache': bot.embedding_cache_stats() if bot else None,
+                'answer_cache': bot.answer_cache_stats() if bot else None,
+            }
+
+        return {
+            'loaded': len(self.__loaded),
+            'total': len(self.__tenants),
+            'resident_bytes': self.resident_bytes,
+            'budget_bytes': self.__memory_budget,
+            'tenants': tenants,
+        }
@@ -1,4 +1,4 @@
-import requests
+import httpx
 
 from exceptions.exceptions import (
     ConfigurationException,
@@ -20,12 +20,33 @@ class Waha:
             if not self.__session:
                 raise ConfigurationException("WAHA_SESSION is not configured")
 
+            # One pooled client per process, connections are kept alive between calls
+            # and shared by every tenant, each call can name its own WAHA session
+            self.__client = httpx.AsyncClient(
+                base_url=self.__api_url,
+                headers={'Content-Type': 'application/json'},
+                timeout=httpx.Timeout(Config.WAHA_TIMEOUT, connect=Config.WAHA_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=Config.WAHA_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.WAHA_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=Config.WAHA_KEEPALIVE_EXPIRY,
+                ),
+            )
+
         except Exception as e:
             if isinstance(e, ConfigurationException):
                 raise
             raise ConfigurationException(f"Error initializing WAHA client: {str(e)}")
 
-    def send_message(self, chat_id: str, message: str):
+    async def aclose(self):
+        await self.__client.aclose()
+
+    def __timeout(self, timeout):
+        if timeout is None:
+            return httpx.USE_CLIENT_DEFAULT
+        return httpx.Timeout(timeout, connect=min(timeout, Config.WAHA_CONNECT_TIMEOUT))
+
+    async def send_message(self, chat_id: str, message: str, timeout: float = None, session: str = None):
         try:
             if not chat_id:
                 raise WahaException("Chat ID cannot be empty")
@@ -39,32 +60,28 @@ class Waha:
             raise WahaException(f"Error validating parameters: {str(e)}")
 
         try:
-            url = f'{self.__api_url}/api/sendText'
-            headers = {
-                'Content-Type': 'application/json',
-            }
+            url = '/api/sendText'
             payload = {
-                'session': self.__session,
+                'session': session or self.__session,
                 'chatId': chat_id,
                 'text': message,
             }
 
-            response = requests.post(
+            response = await self.__client.post(
                 url=url,
                 json=payload,
-                headers=headers,
-                timeout=30
+                timeout=self.__timeout(timeout)
             )
 
-            if not response.ok:
+            if not response.is_success:
                 raise WahaException(f"WAHA API error: {response.status_code} - {response.text}")
 
-        except requests.exceptions.RequestException as e:
+        except httpx.RequestError as e:
             raise WahaException(f"Network error sending message to {chat_id}: {str(e)}") from e
         except Exception as e:
             raise WahaException(f"Unexpected error sending message to {chat_id}: {str(e)}") from e
 
-    def get_history_messages(self, chat_id: str, limit: int):
+    async def get_history_messages(self, chat_id: str, limit: int, timeout: float = None, session: str = None):
         try:
             if not chat_id:
                 raise WahaException("Chat ID cannot be empty")
@@ -78,28 +95,29 @@ class Waha:
             raise WahaException(f"Error validating parameters: {str(e)}")
 
         try:
-            url = f'{self.__api_url}/api/{self.__session}/chats/{chat_id}/messages?limit={limit}&downloadMedia=false'
-            headers = {
-                'Content-Type': 'application/json',
+            url = f'/api/{session or self.__session}/chats/{chat_id}/messages'
+            params = {
+                'limit': limit,
+                'downloadMedia': 'false',
             }
 
-            response = requests.get(
+            response = await self.__client.get(
                 url=url,
-                headers=headers,
-                timeout=30
+                params=params,
+                timeout=self.__timeout(timeout)
             )
 
-            if not response.ok:
+            if not response.is_success:
                 raise WahaException(f"WAHA API error: {response.status_code} - {response.text}")
 
             return response.json()
 
-        except requests.exceptions.RequestException as e:
+        except httpx.RequestError as e:
             raise WahaException(f"Network error getting history for {chat_id}: {str(e)}") from e
         except Exception as e:
             raise WahaException(f"Unexpected error getting history for {chat_id}: {str(e)}") from e
 
-    def start_typing(self, chat_id: str):
+    async def start_typing(self, chat_id: str, timeout: float = None, session: str = None):
         try:
             if not chat_id:
                 raise WahaException("Chat ID cannot be empty")
@@ -110,31 +128,27 @@ class Waha:
             raise WahaException(f"Error validating chat_id: {str(e)}")
 
         try:
-            url = f'{self.__api_url}/api/startTyping'
-            headers = {
-                'Content-Type': 'application/json',
-            }
+            url = '/api/startTyping'
             payload = {
-                'session': self.__session,
+                'session': session or self.__session,
                 'chatId': chat_id,
             }
 
-            response = requests.post(
+            response = await self.__client.post(
                 url=url,
                 json=payload,
-                headers=headers,
-                timeout=30
+                timeout=self.__timeout(timeout)
             )
 
-            if not response.ok:
+            if not response.is_success:
                 raise WahaException(f"WAHA API error: {response.status_code} - {response.text}")
 
-        except requests.exceptions.RequestException as e:
+        except httpx.RequestError as e:
             raise WahaException(f"Network error starting typing for {chat_id}: {str(e)}") from e
         except Exception as e:
             raise WahaException(f"Unexpected error starting typing for {chat_id}: {str(e)}") from e
 
-    def stop_typing(self, chat_id: str):
+    async def stop_typing(self, chat_id: str, timeout: float = None, session: str = None):
         try:
             if not chat_id:
                 raise WahaException("Chat ID cannot be empty")
@@ -145,26 +159,22 @@ class Waha:
             raise WahaException(f"Error validating chat_id: {str(e)}")
 
         try:
-            url = f'{self.__api_url}/api/stopTyping'
-            headers = {
-                'Content-Type': 'application/json',
-            }
+            url = '/api/stopTyping'
             payload = {
-                'session': self.__session,
+                'session': session or self.__session,
                 'chatId': chat_id,
             }
 
-            response = requests.post(
+            response = await self.__client.post(
                 url=url,
                 json=payload,
-                headers=headers,
-                timeout=30
+                timeout=self.__timeout(timeout)
             )
 
-            if not response.ok:
+            if not response.is_success:
                 raise WahaException(f"WAHA API error: {response.status_code} - {response.text}")
 
-        except requests.exceptions.RequestException as e:
+        except httpx.RequestError as e:
             raise WahaException(f"Network error stopping typing for {chat_id}: {str(e)}") from e
         except Exception as e:
             raise WahaException(f"Unexpected error stopping typing for {chat_id}: {str(e)}") from e
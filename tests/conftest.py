@@ -0,0 +1,39 @@
+import os
+
+# Must be set before config is imported, like the benchmarks do
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+
+import fakeredis  # noqa: E402
+import pytest  # noqa: E402
+
+from services import message_buffer  # noqa: E402
+
+
+class Clock:
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    # The scripts run on fakeredis' Lua engine, registered on a fresh server per test
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    monkeypatch.setattr(message_buffer, 'redis_client', client)
+    monkeypatch.setattr(message_buffer, 'push_buffer', client.register_script(message_buffer.BUFFER_SCRIPT))
+    monkeypatch.setattr(message_buffer, 'drain_buffer', client.register_script(message_buffer.DRAIN_SCRIPT))
+    return client
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(message_buffer, 'time', clock)
+    return clock
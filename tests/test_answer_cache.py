@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import fakeredis
+import numpy as np
+import pytest
+
+from bot import answer_cache
+from bot.answer_cache import SemanticAnswerCache
+from bot.rag import MANIFEST_FILE
+from config.config import Config
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    monkeypatch.setattr(answer_cache, 'redis_client', client)
+    return client
+
+
+@pytest.fixture
+def persist_directory(tmp_path):
+    (tmp_path / MANIFEST_FILE).write_text(json.dumps({'index_version': 'v1'}), encoding='utf-8')
+    return str(tmp_path)
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).standard_normal(8).astype(np.float32)
+
+
+def test_store_and_lookup_reuse_rows_when_evicting(redis, persist_directory):
+    cache = SemanticAnswerCache(persist_directory=persist_directory, threshold=0.99, max_entries=2)
+
+    async def scenario():
+        for seed in range(3):
+            await cache.store(f'pergunta {seed}', embedding(seed), f'resposta {seed}')
+        lookups = [await cache.lookup(embedding(seed)) for seed in range(3)]
+        return lookups, await redis.hlen(f'{Config.ANSWER_CACHE_KEY_PREFIX}v1')
+
+    lookups, stored = asyncio.run(scenario())
+
+    # The oldest answer was evicted, its row taken by the newest
+    assert lookups == [None, 'resposta 1', 'resposta 2']
+    assert stored == 2
+    assert cache.stats()['entries'] == 2
+
+
+def test_refresh_picks_up_answers_from_other_workers(redis, persist_directory, monkeypatch):
+    monkeypatch.setattr(Config, 'ANSWER_CACHE_REFRESH_SECONDS', 0)
+    ours = SemanticAnswerCache(persist_directory=persist_directory, threshold=0.99)
+    other = SemanticAnswerCache(persist_directory=persist_directory, threshold=0.99)
+
+    async def scenario():
+        await ours.store('pergunta 0', embedding(0), 'resposta 0')
+        await other.store('pergunta 1', embedding(1), 'resposta 1')
+        found = await ours.lookup(embedding(1))
+
+        # Expired or evicted by another worker
+        await redis.delete(f'{Config.ANSWER_CACHE_KEY_PREFIX}v1')
+        return found, await ours.lookup(embedding(0))
+
+    assert asyncio.run(scenario()) == ('resposta 1', None)
@@ -0,0 +1,82 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from services import debounce
+from services.debounce import DebounceScheduler
+from config.config import Config
+
+
+CHAT_ID = '5511999999999@c.us'
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=True)
+    monkeypatch.setattr(debounce, 'redis_client', client)
+    monkeypatch.setattr(Config, 'DEBOUNCE_POLL_INTERVAL', 0.01)
+    return client
+
+
+async def stop_while_answering(handler):
+    scheduler = DebounceScheduler(handler)
+    await scheduler.schedule(CHAT_ID, delay=0)
+    scheduler.start()
+    while not scheduler.active_count:
+        await asyncio.sleep(0.01)
+    await scheduler.stop()
+
+
+def test_stop_lets_running_replies_finish(redis, monkeypatch):
+    monkeypatch.setattr(Config, 'DEBOUNCE_SHUTDOWN_GRACE_SECONDS', 1)
+    finished = []
+
+    async def handler(chat_id):
+        await asyncio.sleep(0.05)
+        finished.append(chat_id)
+
+    async def scenario():
+        await stop_while_answering(handler)
+        return await redis.zscore(Config.DEBOUNCE_DUE_KEY, CHAT_ID)
+
+    assert asyncio.run(scenario()) is None
+    assert finished == [CHAT_ID]
+
+
+def test_stop_requeues_replies_past_the_grace_period(redis, monkeypatch):
+    monkeypatch.setattr(Config, 'DEBOUNCE_SHUTDOWN_GRACE_SECONDS', 0.05)
+
+    async def handler(chat_id):
+        await asyncio.Event().wait()
+
+    async def scenario():
+        await stop_while_answering(handler)
+        return await redis.zscore(Config.DEBOUNCE_DUE_KEY, CHAT_ID)
+
+    assert asyncio.run(scenario()) is not None
+
+
+def test_busy_chats_do_not_starve_the_claim(redis):
+    keys = [Config.DEBOUNCE_DUE_KEY, Config.DEBOUNCE_PROCESSING_KEY, Config.DEBOUNCE_DEFERRED_KEY]
+    claim = redis.register_script(debounce.CLAIM_SCRIPT)
+    release = redis.register_script(debounce.RELEASE_SCRIPT)
+    busy = {f'busy-{i}@c.us': float(i) for i in range(300)}
+
+    async def scenario():
+        # Other workers are answering 300 chats that got new messages meanwhile
+        await redis.zadd(Config.DEBOUNCE_PROCESSING_KEY, {chat_id: 10_000 for chat_id in busy})
+        await redis.zadd(Config.DEBOUNCE_DUE_KEY, {**busy, CHAT_ID: 500})
+
+        polls = [await claim(keys=keys, args=[1000, 50, 2000]) for _ in range(2)]
+        deferred = await redis.zcard(Config.DEBOUNCE_DEFERRED_KEY)
+
+        await release(keys=keys, args=['busy-7@c.us'])
+        return polls, deferred, await redis.zscore(Config.DEBOUNCE_DUE_KEY, 'busy-7@c.us')
+
+    polls, deferred, requeued_at = asyncio.run(scenario())
+
+    assert [chat_id for poll in polls for chat_id in poll] == [CHAT_ID]
+    assert deferred == len(busy)
+    # Released with the due time it had when parked
+    assert requeued_at == busy['busy-7@c.us']
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from langchain_core.documents import Document
+
+from bot import embedding_pipeline
+from bot.embedding_pipeline import EmbeddingPipeline
+from exceptions.exceptions import EmbeddingException
+
+
+class StatusError(Exception):
+
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+class FakeEmbedding:
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(texts)
+        if self.failures:
+            raise StatusError(self.failures.pop(0))
+        return [[float(len(text))] for text in texts]
+
+
+class Writer:
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, ids, chunks, embeddings):
+        self.batches.append((ids, embeddings))
+
+
+@pytest.fixture(autouse=True)
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(embedding_pipeline.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def chunks(*ids):
+    return [(chunk_id, Document(page_content=f'texto {chunk_id}')) for chunk_id in ids]
+
+
+def test_chunks_are_embedded_and_checkpointed_in_batches(tmp_path):
+    checkpoint = tmp_path / 'embedding_checkpoint.jsonl'
+    embedding, writer = FakeEmbedding(), Writer()
+    pipeline = EmbeddingPipeline(embedding, writer, batch_size=2, max_concurrency=2, checkpoint_path=str(checkpoint))
+
+    stats = pipeline.run(chunks('a', 'b', 'c', 'd', 'e'))
+
+    assert sorted(len(texts) for texts in embedding.calls) == [1, 2, 2]
+    assert sorted(chunk_id for ids, _ in writer.batches for chunk_id in ids) == ['a', 'b', 'c', 'd', 'e']
+    assert all(len(ids) == len(embeddings) for ids, embeddings in writer.batches)
+    assert len(checkpoint.read_text(encoding='utf-8').splitlines()) == 3
+    assert stats['embedded'] == 5
+
+
+@pytest.mark.parametrize('status_code', [429, 500, 503])
+def test_rate_limits_and_server_errors_are_retried_with_backoff(status_code, sleeps):
+    embedding = FakeEmbedding(failures=[status_code, status_code])
+    pipeline = EmbeddingPipeline(embedding, Writer(), batch_size=10, max_retries=3, backoff_seconds=1)
+
+    stats = pipeline.run(chunks('a', 'b'))
+
+    assert len(embedding.calls) == 3
+    assert stats['retries'] == 2
+    # Jittered between half and all of the doubling delay
+    assert 0.5 <= sleeps[0] <= 1
+    assert 1 <= sleeps[1] <= 2
+
+
+def test_client_errors_and_exhausted_retries_are_raised(sleeps):
+    embedding = FakeEmbedding(failures=[400])
+    with pytest.raises(EmbeddingException):
+        EmbeddingPipeline(embedding, Writer(), max_retries=3).run(chunks('a'))
+    assert len(embedding.calls) == 1
+    assert sleeps == []
+
+    embedding = FakeEmbedding(failures=[429, 429, 429])
+    with pytest.raises(EmbeddingException):
+        EmbeddingPipeline(embedding, Writer(), max_retries=2).run(chunks('a'))
+    assert len(embedding.calls) == 3
+
+
+def test_resumes_from_checkpoint_with_a_partial_last_line(tmp_path):
+    checkpoint = tmp_path / 'embedding_checkpoint.jsonl'
+    # The previous run crashed while appending the batch of 'c'
+    checkpoint.write_text(json.dumps({'ids': ['a', 'b']}) + '\n{"ids": ["c"', encoding='utf-8')
+
+    embedding, writer = FakeEmbedding(), Writer()
+    stats = EmbeddingPipeline(embedding, writer, batch_size=10, checkpoint_path=str(checkpoint)).run(chunks('a', 'b', 'c', 'd'))
+
+    assert writer.batches[0][0] == ['c', 'd']
+    assert stats['resumed'] == 2
+
+    # The appended batch starts on its own line, so the next run sees every chunk as done
+    embedding = FakeEmbedding()
+    stats = EmbeddingPipeline(embedding, Writer(), checkpoint_path=str(checkpoint)).run(chunks('a', 'b', 'c', 'd'))
+    assert embedding.calls == []
+    assert stats['resumed'] == 4
@@ -0,0 +1,24 @@
+import asyncio
+
+from services.ingest_stream import StreamConsumer
+
+
+def test_batch_keeps_stream_order_within_a_chat():
+    handled = []
+
+    async def handler(entry_id, fields):
+        # Earlier entries take longer, concurrent handling would finish them last
+        await asyncio.sleep(0.01 * (3 - int(entry_id[0])))
+        handled.append(entry_id)
+        return True
+
+    entries = [
+        ('1-0', {'chat_id': 'a@c.us', 'body': 'oi'}),
+        ('2-0', {'chat_id': 'b@c.us', 'body': 'ola'}),
+        ('3-0', {'chat_id': 'a@c.us', 'body': 'tudo bem?'}),
+    ]
+    asyncio.run(StreamConsumer(handler)._StreamConsumer__process_batch(entries))
+
+    assert [entry_id for entry_id in handled if entry_id != '2-0'] == ['1-0', '3-0']
+    # Other chats are not held back by a slow one
+    assert handled.index('2-0') < handled.index('3-0')
@@ -0,0 +1,239 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from services import message_buffer
+from services.message_buffer import buffer_message
+from services.registry import registry
+from config.config import Config
+
+
+CHAT_ID = '5511999999999@c.us'
+NEUTRAL_MESSAGE = 'quero saber sobre o pedido'  # completeness factor 1.0
+CONTINUATION_MESSAGE = 'o pedido chegou mas'  # completeness factor above 1
+
+
+@pytest.fixture(autouse=True)
+def debounce_config(monkeypatch):
+    monkeypatch.setattr(Config, 'DEBOUNCE_ADAPTIVE', True)
+    monkeypatch.setattr(Config, 'DEBOUNCE_SECONDS', 10)
+    monkeypatch.setattr(Config, 'DEBOUNCE_MIN_SECONDS', 1.5)
+    monkeypatch.setattr(Config, 'DEBOUNCE_MAX_WAIT_SECONDS', 20)
+    monkeypatch.setattr(Config, 'DEBOUNCE_INITIAL_CADENCE_SECONDS', 3.0)
+    monkeypatch.setattr(Config, 'DEBOUNCE_CADENCE_MULTIPLIER', 2.0)
+    monkeypatch.setattr(Config, 'DEBOUNCE_CADENCE_ALPHA', 0.3)
+    monkeypatch.setattr(Config, 'DEBOUNCE_BURST_GAP_SECONDS', 30)
+
+
+async def due_at(redis):
+    return await redis.zscore(Config.DEBOUNCE_DUE_KEY, CHAT_ID)
+
+
+async def cadence(redis):
+    return float(await redis.hget(f'{Config.DEBOUNCE_CADENCE_KEY_PREFIX}{CHAT_ID}', 'cadence'))
+
+
+def test_duplicate_message_id_is_not_buffered(redis, clock):
+    async def scenario():
+        assert await buffer_message(CHAT_ID, 'oi', message_id='wamid-1') is True
+        assert await buffer_message(CHAT_ID, 'oi', message_id='wamid-1') is False
+        return await redis.lrange(f'{CHAT_ID}{Config.BUFFER_KEY_SUFIX}', 0, -1)
+
+    assert asyncio.run(scenario()) == ['oi']
+
+
+def test_first_complete_message_of_a_burst_gets_the_min_delay(redis, clock):
+    async def scenario():
+        await buffer_message(CHAT_ID, 'Qual o prazo de entrega?')
+        return await due_at(redis)
+
+    assert asyncio.run(scenario()) == pytest.approx(clock.now + Config.DEBOUNCE_MIN_SECONDS)
+
+
+def test_cadence_follows_the_gaps_between_messages(redis, clock):
+    async def scenario():
+        await buffer_message(CHAT_ID, NEUTRAL_MESSAGE)
+        first = await cadence(redis)
+
+        clock.advance(2)
+        await buffer_message(CHAT_ID, NEUTRAL_MESSAGE)
+        second = await cadence(redis)
+
+        clock.advance(2)
+        await buffer_message(CHAT_ID, NEUTRAL_MESSAGE)
+        return first, second, await cadence(redis), await due_at(redis)
+
+    first, second, third, due = asyncio.run(scenario())
+
+    # The first message has no gap to learn from, then each gap is blended in with weight alpha
+    assert first == pytest.approx(3.0)
+    assert second == pytest.approx(0.3 * 2 + 0.7 * 3.0)
+    assert third == pytest.approx(0.3 * 2 + 0.7 * second)
+    assert due == pytest.approx(clock.now + third * Config.DEBOUNCE_CADENCE_MULTIPLIER)
+
+
+def test_long_pause_does_not_move_the_cadence(redis, clock):
+    async def scenario():
+        await buffer_message(CHAT_ID, NEUTRAL_MESSAGE)
+        clock.advance(Config.DEBOUNCE_BURST_GAP_SECONDS + 1)
+        await buffer_message(CHAT_ID, NEUTRAL_MESSAGE)
+        return await cadence(redis)
+
+    assert asyncio.run(scenario()) == pytest.approx(3.0)
+
+
+def test_due_time_never_passes_the_max_wait(redis, clock):
+    started_at = clock.now
+
+    async def scenario():
+        dues = []
+        for _ in range(4):
+            await buffer_message(CHAT_ID, CONTINUATION_MESSAGE)
+            dues.append(await due_at(redis))
+            clock.advance(8)
+        return dues
+
+    dues = asyncio.run(scenario())
+
+    assert all(due <= started_at + Config.DEBOUNCE_MAX_WAIT_SECONDS for due in dues)
+    assert dues[-1] == pytest.approx(started_at + Config.DEBOUNCE_MAX_WAIT_SECONDS)
+
+
+def test_drain_moves_messages_and_entries_in_flight(redis, clock):
+    buffer_keys = [
+        f'{CHAT_ID}{Config.BUFFER_KEY_SUFIX}',
+        f'{CHAT_ID}{Config.INFLIGHT_KEY_SUFIX}',
+        f'{CHAT_ID}{Config.BUFFER_STARTED_KEY_SUFIX}',
+        f'{CHAT_ID}{Config.BUFFER_TRACES_KEY_SUFIX}',
+        f'{CHAT_ID}{Config.BUFFER_ENTRIES_KEY_SUFIX}',
+        f'{CHAT_ID}{Config.INFLIGHT_ENTRIES_KEY_SUFIX}',
+    ]
+
+    async def scenario():
+        await buffer_message(CHAT_ID, 'oi', entry_id='1-0')
+        clock.advance(1)
+        await buffer_message(CHAT_ID, 'tudo bem?', entry_id='2-0')
+
+        # Looked up on the module, the fixture swaps the script for one registered on fakeredis
+        drained = await message_buffer.drain_buffer(keys=buffer_keys, args=[Config.BUFFER_TTL])
+
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.exists(buffer_keys[0], buffer_keys[2], buffer_keys[4])
+            pipe.lrange(buffer_keys[1], 0, -1)
+            pipe.lrange(buffer_keys[5], 0, -1)
+            return drained, await pipe.execute()
+
+    (messages, started_at, _, entry_ids), (buffered, inflight, inflight_entries) = asyncio.run(scenario())
+
+    assert messages == ['oi', 'tudo bem?']
+    assert float(started_at) == pytest.approx(clock.now - 1)
+    assert entry_ids == ['1-0', '2-0']
+    assert buffered == 0
+    assert inflight == ['oi', 'tudo bem?']
+    assert inflight_entries == ['1-0', '2-0']
+
+
+async def read_entries(redis, *messages):
+    await redis.xgroup_create(Config.INGEST_STREAM_KEY, Config.INGEST_CONSUMER_GROUP, id='0', mkstream=True)
+    for message_id, body in messages:
+        await redis.xadd(Config.INGEST_STREAM_KEY, {'chat_id': CHAT_ID, 'body': body, 'message_id': message_id})
+    response = await redis.xreadgroup(Config.INGEST_CONSUMER_GROUP, 'worker-1', {Config.INGEST_STREAM_KEY: '>'})
+    return response[0][1]
+
+
+def test_reclaimed_entry_is_buffered_again_after_its_buffer_expired(redis, clock):
+    buffer_key = f'{CHAT_ID}{Config.BUFFER_KEY_SUFIX}'
+    entries_key = f'{CHAT_ID}{Config.BUFFER_ENTRIES_KEY_SUFIX}'
+
+    async def scenario():
+        [(entry_id, fields)] = await read_entries(redis, ('wamid-1', 'oi'))
+        assert await message_buffer.handle_stream_entry(entry_id, fields) is True
+
+        # Every worker was down for longer than BUFFER_TTL, the entry is still pending
+        await redis.delete(buffer_key, entries_key)
+        kept = await message_buffer.handle_stream_entry(entry_id, fields)
+        return entry_id, kept, await redis.lrange(buffer_key, 0, -1), await redis.lrange(entries_key, 0, -1)
+
+    entry_id, kept, buffered, entry_ids = asyncio.run(scenario())
+
+    assert kept is True
+    assert buffered == ['oi']
+    assert entry_ids == [entry_id]
+
+
+def test_redelivered_webhook_and_answered_entries_are_acked(redis, clock):
+    async def scenario():
+        (first_id, first), (second_id, second) = await read_entries(redis, ('wamid-1', 'oi'), ('wamid-1', 'oi'))
+        assert await message_buffer.handle_stream_entry(first_id, first) is True
+        redelivered = await message_buffer.handle_stream_entry(second_id, second)
+
+        # Once the reply is sent the debounce drops the buffered ids and acks the entry
+        await redis.delete(f'{CHAT_ID}{Config.BUFFER_KEY_SUFIX}', f'{CHAT_ID}{Config.BUFFER_ENTRIES_KEY_SUFIX}')
+        await redis.xack(Config.INGEST_STREAM_KEY, Config.INGEST_CONSUMER_GROUP, first_id)
+        answered = await message_buffer.handle_stream_entry(first_id, first)
+        return redelivered, answered
+
+    assert asyncio.run(scenario()) == (False, False)
+
+
+class FakeWaha:
+
+    def __init__(self):
+        self.sent = []
+
+    async def start_typing(self, chat_id, session=None):
+        pass
+
+    async def stop_typing(self, chat_id, session=None):
+        pass
+
+    async def send_message(self, chat_id, message, session=None):
+        self.sent.append(message)
+
+
+class StalledBot:
+
+    def __init__(self):
+        self.saved = []
+
+    async def astream_response(self, question, session_id=None):
+        yield 'Primeira parte.'
+        # Generation stalls until the shutdown grace period runs out
+        await asyncio.Event().wait()
+        yield 'Nunca enviada.'
+
+    async def asave_exchange(self, session_id, question, answer):
+        self.saved.append((session_id, question, answer))
+
+
+class FakeTenants:
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @asynccontextmanager
+    async def acquire(self, session):
+        yield self.bot
+
+
+def test_cancelled_stream_after_first_segment_is_committed(redis, clock, monkeypatch):
+    waha, bot = FakeWaha(), StalledBot()
+    monkeypatch.setattr(Config, 'STREAMING_ENABLED', True)
+    monkeypatch.setattr(registry, '_ServiceRegistry__waha', waha)
+    monkeypatch.setattr(registry, '_ServiceRegistry__tenants', FakeTenants(bot))
+
+    async def scenario():
+        await buffer_message(CHAT_ID, 'oi', entry_id='1-0')
+        task = asyncio.create_task(message_buffer.handle_debounce(CHAT_ID))
+        while not waha.sent:
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+        await task
+        return await redis.exists(f'{CHAT_ID}{Config.INFLIGHT_KEY_SUFIX}', f'{CHAT_ID}{Config.INFLIGHT_ENTRIES_KEY_SUFIX}')
+
+    # Requeueing would resend the first segment, the partial reply is saved and the batch finished
+    assert asyncio.run(scenario()) == 0
+    assert waha.sent == ['Primeira parte.']
+    assert bot.saved == [(CHAT_ID, 'oi', 'Primeira parte.')]
@@ -0,0 +1,62 @@
+import signal
+import asyncio
+import logging
+
+from prometheus_client import start_http_server
+
+from services.registry import registry
+from services.message_buffer import debounce_scheduler, stream_consumer, refresh_queue_metrics
+from services.metrics import setup_tracing
+from services.log import setup_logging
+from exceptions.exceptions import ConfigurationException
+from config.config import Config
+
+
+Config.setup_environment()
+Config.validate()
+setup_logging()
+setup_tracing()
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    if not await registry.startup():
+        raise ConfigurationException(f"Worker services failed to start: {registry.status()['error']}")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    # Workers have no HTTP API, their stage histograms are scraped from this endpoint instead
+    if Config.WORKER_METRICS_PORT:
+        try:
+            start_http_server(Config.WORKER_METRICS_PORT)
+        except OSError as e:
+            # A port taken by another worker on the host only costs the metrics, not the worker
+            logger.error(f'Failed to start metrics endpoint on port {Config.WORKER_METRICS_PORT}: {str(e)}')
+
+    await stream_consumer.start()
+    debounce_scheduler.start()
+    logger.info('Worker ready', extra={'consumer': stream_consumer.name, 'metrics_port': Config.WORKER_METRICS_PORT})
+
+    while not stopping.is_set():
+        try:
+            await refresh_queue_metrics()
+        except Exception as e:
+            logger.warning(f'Failed to refresh queue gauges: {str(e)}')
+
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=Config.WORKER_METRICS_REFRESH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+    # Unacked entries and unfinished debounces are picked up by the remaining workers
+    await stream_consumer.stop()
+    await debounce_scheduler.stop()
+    await registry.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())